@@ -0,0 +1,108 @@
+"""Memory per edge and traversal speed of the NetworkX and compact graph cores.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_graph_core --edges 100000 1000000
+
+For each size and core, a fresh process loads the same synthetic graph into a
+``GraphStore`` and reports the memory the store retains (traced with
+``tracemalloc``, which also sees numpy arrays) per edge, the load time, and the
+time of the traversals the API runs: full successor scans, neighbourhoods,
+shortest paths, cold reachability and edge pages.
+"""
+import argparse
+import gc
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from graphquery import GraphQueryEngine, QueryTimeoutError
+from graphstore import GRAPH_CORES, GraphStore
+from benchmarks.datasets import RELATIONS, graph_rows
+
+QUERIES = 200
+
+
+def measure(core: str, num_edges: int) -> dict:
+    """Run one core at one size in a new process so memory is not shared between runs."""
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_graph_core", "--measure", core, str(num_edges)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def median_ms(func, args_list) -> float:
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        try:
+            func(*args)
+        except (LookupError, QueryTimeoutError):
+            pass
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def _measure_here(core: str, num_edges: int):
+    num_nodes = max(num_edges // 5, 10)
+    entities, relations = graph_rows(num_nodes, num_edges)
+
+    started = time.perf_counter()
+    store = GraphStore(core=core)
+    store.bulk_load(entities, relations)
+    load_seconds = time.perf_counter() - started
+    del store
+    gc.collect()
+
+    # A second load under tracemalloc; only what the store keeps counts
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    store = GraphStore(core=core)
+    store.bulk_load(entities, relations)
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    graph = store.graph
+    rng = random.Random(7)
+    sources = [(f"entity-{rng.randrange(num_nodes)}",) for _ in range(QUERIES)]
+    pairs = [(f"entity-{rng.randrange(num_nodes)}", f"entity-{rng.randrange(num_nodes)}") for _ in range(QUERIES)]
+    engine = GraphQueryEngine(store)
+
+    started = time.perf_counter()
+    visited = sum(1 for name in graph for _ in graph.succ[name])
+    scan_seconds = time.perf_counter() - started
+
+    print(json.dumps({
+        "bytes_per_edge": retained / num_edges, "retained_mb": retained / 2 ** 20, "load_seconds": load_seconds,
+        "scan_edges_per_second": visited / scan_seconds,
+        "neighborhood_ms": median_ms(lambda s: store.neighborhood(s, 2), sources),
+        "shortest_path_ms": median_ms(engine.shortest_path, pairs),
+        "reachable_ms": median_ms(lambda s: engine.reachable(s, "Regulation", None, "out", 3), sources),
+        "page_edges_ms": median_ms(store.page_edges, [(relation,) for relation in (None,) + RELATIONS] * 5),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edges", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--measure", nargs=2, metavar=("CORE", "EDGES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        _measure_here(args.measure[0], int(args.measure[1]))
+        return
+
+    columns = ("bytes/edge", "load s", "scan edges/s", "nbhd ms", "path ms", "reach ms", "page ms")
+    print(f"{'edges':>10} {'core':>9} " + " ".join(f"{column:>12}" for column in columns))
+    for num_edges in args.edges:
+        for core in GRAPH_CORES:
+            r = measure(core, num_edges)
+            print(f"{num_edges:>10,} {core:>9} {r['bytes_per_edge']:>12.0f} {r['load_seconds']:>12.2f} "
+                  f"{r['scan_edges_per_second']:>12,.0f} {r['neighborhood_ms']:>12.3f} "
+                  f"{r['shortest_path_ms']:>12.3f} {r['reachable_ms']:>12.3f} {r['page_edges_ms']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
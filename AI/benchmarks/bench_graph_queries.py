@@ -0,0 +1,67 @@
+"""Latency of the knowledge graph path and reachability queries.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_graph_queries --edges 10000 100000 1000000
+
+For each size, builds a synthetic in-memory graph, then times shortest paths and
+bounded path enumeration between random entities, and reachability queries with a
+cold and a warm cache.
+"""
+import argparse
+import random
+import statistics
+import time
+from graphquery import GraphQueryEngine, QueryTimeoutError
+from benchmarks.datasets import build_graph
+
+
+def timed(fn, *args) -> float:
+    started = time.perf_counter()
+    try:
+        fn(*args)
+    except QueryTimeoutError:
+        pass
+    return (time.perf_counter() - started) * 1000
+
+
+def summarize(label: str, samples_ms) -> None:
+    samples_ms = sorted(samples_ms)
+    p95 = samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))]
+    print(f"  {label:<26} p50 {statistics.median(samples_ms):9.3f} ms   p95 {p95:9.3f} ms")
+
+
+def run(num_edges: int, num_nodes: int, queries: int, timeout: float) -> None:
+    started = time.perf_counter()
+    store = build_graph(num_nodes, num_edges)
+    print(f"{num_edges:,} edges, {num_nodes:,} nodes (built in {time.perf_counter() - started:.1f}s)")
+
+    engine = GraphQueryEngine(store, timeout=timeout)
+    rng = random.Random(7)
+    pairs = [(f"entity-{rng.randrange(num_nodes)}", f"entity-{rng.randrange(num_nodes)}") for _ in range(queries)]
+    compliance = ["applies_to", "requires"]
+
+    summarize("shortest_path", [timed(engine.shortest_path, s, t) for s, t in pairs])
+    summarize("shortest_path (2 rel.)", [timed(engine.shortest_path, s, t, compliance) for s, t in pairs])
+    summarize("all_paths (k=3)", [timed(engine.all_paths, s, t, 3) for s, t in pairs])
+    summarize("reachable (cold, depth 3)",
+              [timed(engine.reachable, s, "Regulation", compliance, "out", 3) for s, _ in pairs])
+    summarize("reachable (warm, depth 3)",
+              [timed(engine.reachable, s, "Regulation", compliance, "out", 3) for s, _ in pairs])
+    summarize("reachable (cold, closure)", [timed(engine.reachable, s, "Regulation", compliance) for s, _ in pairs])
+    summarize("reachable (warm, closure)", [timed(engine.reachable, s, "Regulation", compliance) for s, _ in pairs])
+    print(f"  timeouts: {engine.stats()['timeouts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edges", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args()
+    for num_edges in args.edges:
+        run(num_edges, max(num_edges // 5, 1), args.queries, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Write throughput and recovery time of the persisted knowledge graph.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_graph_storage --edges 1000000
+
+Loads a synthetic graph through ``GraphStore`` in API-sized batches, then measures
+snapshot time and how long a new process takes to recover it, both from a snapshot
+plus a log tail and from the log alone.
+"""
+from collections import namedtuple
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from graphlog import GraphLog
+from graphstore import GraphStore
+from benchmarks.datasets import RELATIONS, TYPES
+
+Entity = namedtuple("Entity", "name type")
+Relation = namedtuple("Relation", "source target relation")
+
+
+def load(store: GraphStore, num_nodes: int, num_edges: int, batch: int, seed: int = 42) -> float:
+    """Insert nodes then edges in batches; returns seconds spent on edges."""
+    rng = random.Random(seed)
+    for start in range(0, num_nodes, batch):
+        store.add_entities([Entity(f"entity-{i}", TYPES[i % len(TYPES)])
+                            for i in range(start, min(start + batch, num_nodes))])
+    started = time.perf_counter()
+    for start in range(0, num_edges, batch):
+        store.add_relations([Relation(f"entity-{rng.randrange(num_nodes)}", f"entity-{rng.randrange(num_nodes)}",
+                                      rng.choice(RELATIONS))
+                             for _ in range(min(batch, num_edges - start))])
+    return time.perf_counter() - started
+
+
+def recover(directory: str) -> float:
+    started = time.perf_counter()
+    GraphStore(GraphLog(directory))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--edges", type=int, default=1_000_000)
+    parser.add_argument("--nodes", type=int, default=None, help="Defaults to edges / 10")
+    parser.add_argument("--batch", type=int, default=10_000, help="Entities or relations per API call")
+    parser.add_argument("--no-fsync", action="store_true")
+    args = parser.parse_args()
+    num_nodes = args.nodes or max(args.edges // 10, 1)
+    tail = args.edges // 10
+
+    root = tempfile.mkdtemp(prefix="graph-bench-")
+    try:
+        wal_only = os.path.join(root, "wal-only")
+        store = GraphStore(GraphLog(wal_only, fsync=not args.no_fsync), snapshot_every=10 ** 12)
+        seconds = load(store, num_nodes, args.edges, args.batch)
+        print(f"write:        {args.edges / seconds:,.0f} edges/s ({args.edges:,} edges, batch {args.batch:,})")
+        print(f"recover log:  {recover(wal_only):.2f}s "
+              f"({store.graph.number_of_nodes():,} nodes, {store.graph.number_of_edges():,} edges)")
+
+        snapshotted = os.path.join(root, "snapshot")
+        store = GraphStore(GraphLog(snapshotted, fsync=not args.no_fsync), snapshot_every=10 ** 12)
+        load(store, num_nodes, args.edges - tail, args.batch)
+        started = time.perf_counter()
+        store.checkpoint()
+        print(f"snapshot:     {time.perf_counter() - started:.2f}s")
+        load(store, num_nodes, tail, args.batch, seed=7)
+        print(f"recover snap: {recover(snapshotted):.2f}s (snapshot + {tail:,} edge log tail)")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Import time of the API modules, broken down by package with ``python -X importtime``.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_imports --output imports.json
+    python -m benchmarks.bench_imports --compare imports.json
+
+Each module is imported in a fresh interpreter. The report lists its total import
+time, peak RSS and the packages that cost the most (cumulative time of each
+top-level package's first import), plus which heavy libraries were imported at
+all. ``--compare`` prints the change against an earlier ``--output`` file, so
+regressions can be tracked per module across commits.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+MODULES = ["main", "nlp", "chatbot", "marketrisk", "knowledgebase", "resources"]
+# Libraries that should only be imported once an endpoint needs them
+HEAVY = ["spacy", "nltk", "sklearn", "scipy", "matplotlib", "joblib", "pyarrow"]
+
+PROBE = ("import resource, sys, json, {module}; "
+         "print(json.dumps({{'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "
+         "'heavy': [name for name in {heavy!r} if name in sys.modules]}}))")
+
+
+def parse_importtime(stderr: str):
+    """``(module, self_us, cumulative_us, depth)`` for every line ``-X importtime`` printed."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module: str) -> dict:
+    env = {**os.environ, "LLM_CLIENT": os.getenv("LLM_CLIENT", "fake")}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=HEAVY)],
+                          capture_output=True, text=True, env=env, check=True)
+    rows = parse_importtime(proc.stderr)
+    total_us = next(cumulative for name, _, cumulative, depth in rows if name == module and depth == 0)
+    # A package's first import is the outermost line naming it; later lines are nested in it
+    packages = defaultdict(int)
+    for name, _, cumulative, depth in rows:
+        top = name.split(".")[0]
+        if name == top or top not in packages:
+            packages[top] = max(packages[top], cumulative)
+    probe = json.loads(proc.stdout.splitlines()[-1])
+    return {"seconds": total_us / 1e6, "rss_mb": probe["rss_mb"], "heavy": probe["heavy"],
+            "packages": {name: us / 1e6 for name, us in sorted(packages.items(), key=lambda item: -item[1])}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--top", type=int, default=8, help="Packages listed per module")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results = {}
+    for module in args.modules:
+        result = results[module] = measure(module)
+        change = ""
+        if module in previous:
+            change = (f"   (was {previous[module]['seconds']:.2f}s, {previous[module]['rss_mb']:.0f} MB: "
+                      f"{result['seconds'] - previous[module]['seconds']:+.2f}s)")
+        print(f"{module}: {result['seconds']:.2f}s, peak RSS {result['rss_mb']:.0f} MB{change}")
+        print(f"    heavy libraries imported: {', '.join(result['heavy']) or 'none'}")
+        packages = [name for name in result["packages"] if name != module][:args.top]
+        print("    " + ", ".join(f"{name} {result['packages'][name]:.2f}s" for name in packages))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Peak memory and load time of the market data loaders.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_market_data --rows 10000000
+
+Writes a synthetic per-country, per-month indicator file, then loads it in a fresh
+process per loader and reports wall time and peak RSS: the previous loader
+(``pd.read_csv`` of the whole file, ``dropna`` and float64 arithmetic) against
+``marketdata.load_market_frame`` on CSV and, when pyarrow is installed, Parquet.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from marketdata import load_market_frame
+from benchmarks.datasets import write_market_data
+
+
+def previous_loader(path: str) -> pd.DataFrame:
+    data = pd.read_csv(path)
+    data.dropna(inplace=True)
+    data['Market_Risk_Score'] = data['Political_Stability'] * 0.4 + data['Economic_Stability'] * 0.6
+    return data
+
+
+LOADERS = {"previous": previous_loader, "chunked": load_market_frame}
+
+
+def measure(loader: str, path: str) -> dict:
+    """Run one loader in a new process so peak RSS is not inflated by earlier runs."""
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_market_data", "--measure", loader, path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def _measure_here(loader: str, path: str):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    data = LOADERS[loader](path)
+    seconds = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": seconds, "peak_mb": peak / 1024, "added_mb": (peak - baseline) / 1024,
+                      "rows": len(data)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--countries", type=int, default=200)
+    parser.add_argument("--measure", nargs=2, metavar=("LOADER", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        _measure_here(*args.measure)
+        return
+
+    root = tempfile.mkdtemp(prefix="market-bench-")
+    try:
+        csv_path = os.path.join(root, "market_history.csv")
+        started = time.perf_counter()
+        write_market_data(csv_path, args.rows, args.countries)
+        size_mb = os.path.getsize(csv_path) / 2 ** 20
+        print(f"{args.rows:,} rows, {args.countries} countries, {size_mb:,.0f} MB CSV "
+              f"(written in {time.perf_counter() - started:.1f}s)")
+
+        runs = [("previous", "csv", csv_path), ("chunked", "csv", csv_path)]
+        try:
+            import pyarrow  # noqa: F401
+            parquet_path = os.path.join(root, "market_history.parquet")
+            import pyarrow.csv
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(pyarrow.csv.read_csv(csv_path), parquet_path)
+            runs.append(("chunked", "parquet", parquet_path))
+        except ImportError:
+            print("pyarrow not installed; skipping Parquet")
+
+        for loader, fmt, path in runs:
+            result = measure(loader, path)
+            print(f"{loader:>8} {fmt:<8} {result['seconds']:7.2f}s   peak RSS {result['peak_mb']:8.0f} MB "
+                  f"(+{result['added_mb']:.0f} MB)   -> {result['rows']:,} rows")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
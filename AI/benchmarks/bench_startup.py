@@ -0,0 +1,110 @@
+"""Startup time and memory of the API apps, lazily loaded or with every resource preloaded.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_startup
+
+Each app is imported in a fresh process and reports its import time and RSS, then
+the time and RSS after loading the resources its routes use, which is what every
+app paid at import before resources became lazy and shared (``PRELOAD_RESOURCES``
+does the same at startup). The last lines compare running the four services as
+separate processes, each with its own resources, against ``main`` serving all of
+them from one process. Resources that cannot load here (e.g. no spaCy model) are
+reported and left out.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_RESOURCES = {
+    "nlp": ["spacy_nlp", "nlp_pool"],
+    "chatbot": ["graph_store", "knowledge_retriever", "chat_service"],
+    "marketrisk": ["market_model", "scenario_jobs"],
+    "knowledgebase": ["graph_store", "graph_renderer", "graph_queries"],
+}
+APP_RESOURCES["main"] = list(dict.fromkeys(name for names in APP_RESOURCES.values() for name in names))
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(app: str, env: dict) -> dict:
+    """Run one app in a new process so earlier imports do not hide its cost."""
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--measure", app],
+                            check=True, capture_output=True, text=True, env={**os.environ, **env}).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def _measure_here(app: str):
+    started = time.perf_counter()
+    __import__(app)
+    import resources
+    import_seconds = time.perf_counter() - started
+    import_mb = rss_mb()
+
+    failed = {}
+    started = time.perf_counter()
+    for name in APP_RESOURCES[app]:
+        try:
+            resources.RESOURCES[name].get()
+        except Exception as e:
+            failed[name] = f"{type(e).__name__}: {e}"[:120]
+    load_seconds = time.perf_counter() - started
+    loaded_mb = rss_mb()
+
+    async def close():
+        for res in reversed(list(resources.RESOURCES.values())):
+            await res.close()
+    asyncio.run(close())
+    print(json.dumps({"import_seconds": import_seconds, "import_mb": import_mb, "load_seconds": load_seconds,
+                      "loaded_mb": loaded_mb, "failed": failed}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", nargs="+", default=list(APP_RESOURCES), choices=list(APP_RESOURCES))
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        _measure_here(args.measure)
+        return
+
+    root = tempfile.mkdtemp(prefix="startup-bench-")
+    # Fresh state per run, so every app trains, recovers and indexes from scratch
+    env = {"MARKET_MODEL_DIR": os.path.join(root, "models"), "GRAPH_DATA_DIR": os.path.join(root, "graph"),
+           "RAG_ENABLED": "1", "RAG_INDEX_DIR": os.path.join(root, "rag"), "LLM_CLIENT": "fake",
+           "PRELOAD_RESOURCES": ""}
+    results = {}
+    try:
+        for app in args.apps:
+            shutil.rmtree(env["MARKET_MODEL_DIR"], ignore_errors=True)
+            result = results[app] = measure(app, env)
+            print(f"{app:>13}  lazy: {result['import_seconds']:6.2f}s {result['import_mb']:6.0f} MB   "
+                  f"preloaded: {result['import_seconds'] + result['load_seconds']:6.2f}s "
+                  f"{result['loaded_mb']:6.0f} MB")
+            for name, error in result["failed"].items():
+                print(f"{'':>15}{name} not loaded: {error}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    services = [app for app in results if app != "main"]
+    if "main" in results and services:
+        split_seconds = sum(results[app]["import_seconds"] + results[app]["load_seconds"] for app in services)
+        split_mb = sum(results[app]["loaded_mb"] for app in services)
+        print(f"{len(services)} separate services, preloaded: {split_seconds:6.2f}s {split_mb:6.0f} MB in total")
+        print(f"main, preloaded:                {results['main']['import_seconds'] + results['main']['load_seconds']:6.2f}s "
+              f"{results['main']['loaded_mb']:6.0f} MB")
+        print(f"main, lazy:                     {results['main']['import_seconds']:6.2f}s "
+              f"{results['main']['import_mb']:6.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""Micro-benchmarks and in-process load tests of every API, with comparable JSON results.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_suite --quick --output before.json
+    python -m benchmarks.bench_suite --quick --output after.json --compare before.json
+    python -m benchmarks.bench_suite --cases graph api_graph --sizes 100000
+
+Every case runs at several input sizes (words of regulation text, rows of market
+data, edges of the knowledge graph, indexed documents) on seeded synthetic data,
+each size in a fresh process with its own model, graph and index directories, so
+peak RSS and caches belong to that run alone. Micro-benchmarks call the core
+functions directly (summary sentence scoring, market model build and lookups,
+scenario simulation, graph pages, queries and rendering, retrieval). Load tests
+send a mix of requests to ``main.app`` through ``httpx.ASGITransport`` with
+``LLM_CLIENT=fake``, so /chat never leaves the machine. Cases that need data not
+provisioned here (e.g. the spaCy model) are reported as skipped.
+
+Results hold p50/p95/p99 latency and throughput per operation and peak RSS per
+run, with the commit they were measured on; ``--compare`` prints the change of
+each against an earlier ``--output`` file and flags those worse than
+``--threshold``. Everything runs offline on one machine.
+"""
+from typing import Callable, NamedTuple, Tuple
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from benchmarks.datasets import RELATIONS, TYPES, build_graph, graph_rows, synthetic_text, write_market_data
+from benchmarks.harness import compare, environment, load_test, peak_rss_mb, time_calls, timed_once
+
+
+class Case(NamedTuple):
+    kind: str  # "micro" or "load"
+    unit: str  # what the size counts
+    sizes: Tuple[int, ...]
+    quick_sizes: Tuple[int, ...]
+    run: Callable[[int, argparse.Namespace], dict]
+
+
+CASES = {}
+
+
+def case(name: str, kind: str, unit: str, sizes, quick_sizes):
+    def register(run):
+        CASES[name] = Case(kind, unit, tuple(sizes), tuple(quick_sizes), run)
+        return run
+    return register
+
+
+class Skipped(Exception):
+    """The case cannot run here, e.g. because NLP data is not provisioned."""
+
+
+def market_csv(rows: int) -> str:
+    """Synthetic market data with ``rows`` rows, written once per suite run and shared by its cases."""
+    path = os.path.join(os.environ["BENCH_DATA_DIR"], f"market-{rows}.csv")
+    if not os.path.exists(path):
+        write_market_data(path + ".tmp", rows, num_countries=min(rows, 500))
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def graph_nodes(num_edges: int) -> int:
+    return max(num_edges // 5, 10)
+
+
+def require_spacy():
+    from nlpdata import load_spacy, missing_resources
+    if any(name not in ("punkt_tab", "stopwords") for name in missing_resources()):
+        raise Skipped("spaCy model not provisioned; run `python nlpdata.py --provision`")
+    return load_spacy()
+
+
+def summary_inputs(text: str):
+    """Sentence splitter and stop words as ``summary_job`` uses them, with fallbacks when
+    the NLTK data is missing so the scoring itself can still be timed."""
+    import textanalysis
+    from nlpdata import configure_nltk
+    from benchmarks.bench_summarize import split_sentences
+    configure_nltk()
+    try:
+        textanalysis.get_stop_words()
+        from nltk.tokenize import sent_tokenize
+        sent_tokenize("Check. Split.")
+        return sent_tokenize, "nltk"
+    except LookupError:
+        # Same fallback as bench_summarize, so the timings stay comparable
+        textanalysis._stop_words = {"the", "of", "and", "to", "in", "for", "is", "be", "by", "on",
+                                    "with", "as", "are", "this", "that", "from", "which"}
+        return split_sentences, "regex"
+
+
+# Micro-benchmarks
+
+@case("summarize", "micro", "words", [1_000, 10_000, 100_000], [1_000, 10_000])
+def bench_summarize(words: int, options) -> dict:
+    from textanalysis import rank_sentences, score_sentences
+    text = synthetic_text(words)
+    split, splitter = summary_inputs(text)
+    sentences = split(text)
+    return {"splitter": splitter, "sentences": len(sentences),
+            "split": time_calls(split, text, repeat=options.repeat),
+            "score_and_rank": time_calls(lambda: rank_sentences(score_sentences(sentences)), repeat=options.repeat)}
+
+
+@case("nlp_parse", "micro", "words", [200, 2_000, 20_000], [200])
+def bench_nlp_parse(words: int, options) -> dict:
+    from textanalysis import OUTPUTS, analyze_doc
+    nlp, load_seconds = timed_once(require_spacy)
+    text = synthetic_text(words)
+    return {"model_load_seconds": load_seconds,
+            "parse": time_calls(nlp, text, repeat=options.repeat),
+            "analyze_doc": time_calls(analyze_doc, nlp(text), OUTPUTS, repeat=options.repeat)}
+
+
+@case("market_model", "micro", "rows", [100, 10_000, 1_000_000], [100, 10_000])
+def bench_market_model(rows: int, options) -> dict:
+    from riskmodel import MarketModelHolder, build_market_model
+    from scenario import Perturbation, simulate
+    path = market_csv(rows)
+    model_dir = os.environ["MARKET_MODEL_DIR"]
+    _, cold = timed_once(build_market_model, path, model_dir)
+    holder, warm = timed_once(MarketModelHolder, path, model_dir)
+    countries = list(holder.current.country_index)
+    rng = random.Random(7)
+    batch = rng.sample(countries, min(100, len(countries)))
+    shock = [Perturbation("Political_Stability", distribution="normal", std=0.1)]
+    return {"countries": len(countries), "build_cold_seconds": cold, "build_warm_seconds": warm,
+            "lookup": time_calls(lambda: holder.lookup(rng.choice(countries)), repeat=options.repeat * 20),
+            "lookup_batch_100": time_calls(holder.lookup_many, batch, repeat=options.repeat),
+            "scenario_1000_draws": time_calls(simulate, holder.current, shock, 1000, repeat=options.repeat // 5 or 1)}
+
+
+@case("graph", "micro", "edges", [1_000, 100_000, 1_000_000], [1_000, 100_000])
+def bench_graph(edges: int, options) -> dict:
+    from graphquery import GraphQueryEngine, QueryTimeoutError
+    nodes = graph_nodes(edges)
+    store, build_seconds = timed_once(build_graph, nodes, edges)
+    engine = GraphQueryEngine(store)
+    rng = random.Random(7)
+
+    def entity():
+        return f"entity-{rng.randrange(nodes)}"
+
+    def query(method, *args):
+        try:
+            method(*args)
+        except (LookupError, QueryTimeoutError):
+            pass
+
+    return {"nodes": nodes, "build_seconds": build_seconds,
+            "get_graph": time_calls(store.filtered, repeat=options.repeat // 5 or 1),
+            "page_nodes": time_calls(lambda: store.page_nodes(rng.choice(TYPES), limit=1000), repeat=options.repeat),
+            "page_edges": time_calls(lambda: store.page_edges(rng.choice(RELATIONS), limit=1000),
+                                     repeat=options.repeat),
+            "neighborhood": time_calls(lambda: query(store.neighborhood, entity(), 2), repeat=options.repeat),
+            "shortest_path": time_calls(lambda: query(engine.shortest_path, entity(), entity()),
+                                        repeat=options.repeat),
+            "reachable": time_calls(lambda: query(engine.reachable, entity(), "Regulation", None, "out", 3),
+                                    repeat=options.repeat)}
+
+
+@case("graph_render", "micro", "edges", [100, 1_000, 5_000], [100])
+def bench_graph_render(edges: int, options) -> dict:
+    from graphrender import GraphRenderer
+    nodes = graph_nodes(edges)
+    store = build_graph(nodes, edges)
+    renderer = GraphRenderer(store)
+    _, cold = timed_once(renderer.render)
+    # A small change is laid out incrementally from the cached positions
+    store.bulk_load([(0, f"entity-{nodes}", "Country")], [(0, f"entity-{nodes}", "entity-0", "exported_to")])
+    _, incremental = timed_once(renderer.render)
+    return {"render_cold_seconds": cold, "render_incremental_seconds": incremental,
+            "cached": time_calls(renderer.render, repeat=options.repeat)}
+
+
+@case("retrieval", "micro", "documents", [10, 1_000, 10_000], [10, 1_000])
+def bench_retrieval(documents: int, options) -> dict:
+    from retrieval import KnowledgeRetriever
+    retriever = KnowledgeRetriever(index_dir=None)
+    texts = [synthetic_text(400, seed=i) for i in range(documents)]
+    _, index_seconds = timed_once(lambda: [retriever.add_document(f"doc-{i}", text) for i, text in enumerate(texts)])
+    queries = [synthetic_text(12, seed=documents + i) for i in range(64)]
+    rng = random.Random(7)
+    return {"chunks": len(retriever.documents), "index_seconds": index_seconds,
+            "retrieve": time_calls(lambda: retriever.retrieve(rng.choice(queries)), repeat=options.repeat)}
+
+
+# Load tests of main.app; each returns latency per request label and the overall throughput
+
+def app_under_test():
+    import main
+    return main.app
+
+
+@case("api_market", "load", "rows", [100, 10_000, 1_000_000], [100])
+def load_market(rows: int, options) -> dict:
+    os.environ["MARKET_DATA_PATH"] = market_csv(rows)
+    app = app_under_test()
+    import resources
+    countries = list(resources.market_model.get().current.country_index)
+    rng = random.Random(7)
+    shock = {"perturbations": [{"column": "Political_Stability", "distribution": "normal", "std": 0.1}],
+             "draws": 200, "seed": 1}
+    mix = [
+        (60, lambda: ("analyze", "POST", "/analyze", {"country": rng.choice(countries)})),
+        (10, lambda: ("analyze_batch", "POST", "/analyze/batch",
+                      {"countries": rng.sample(countries, min(50, len(countries)))})),
+        (10, lambda: ("analyze_unknown", "POST", "/analyze", {"country": "Atlantis"})),
+        (5, lambda: ("countries", "GET", "/countries", None)),
+        (5, lambda: ("feature_importance", "GET", "/feature-importance", None)),
+        (5, lambda: ("scenario", "POST", "/scenario", shock)),
+        (5, lambda: ("metrics", "GET", "/metrics", None)),
+    ]
+    return load_test(app, weighted(mix, options.requests, rng), options.concurrency,
+                     warmup=[request() for _, request in mix])
+
+
+@case("api_graph", "load", "edges", [1_000, 10_000, 100_000], [1_000])
+def load_graph(edges: int, options) -> dict:
+    app = app_under_test()
+    import resources
+    nodes = graph_nodes(edges)
+    resources.graph_store.get().bulk_load(*graph_rows(nodes, edges))
+    rng = random.Random(7)
+
+    def entity():
+        return f"entity-{rng.randrange(nodes)}"
+
+    mix = [
+        (20, lambda: ("get_graph_nodes", "GET", f"/get_graph/nodes?type={rng.choice(TYPES)}&limit=100", None)),
+        (20, lambda: ("get_graph_edges", "GET", f"/get_graph/edges?relation={rng.choice(RELATIONS)}&limit=100",
+                      None)),
+        (15, lambda: ("neighborhood", "GET", f"/get_graph/neighborhood?entity={entity()}&depth=2", None)),
+        (15, lambda: ("shortest_path", "GET", f"/query/shortest_path?source={entity()}&target={entity()}", None)),
+        (15, lambda: ("reachable", "GET", f"/query/reachable?source={entity()}&type=Regulation&max_depth=3",
+                      None)),
+        (10, lambda: ("add_relations", "POST", "/add_relations",
+                      [{"source": entity(), "target": entity(), "relation": rng.choice(RELATIONS)}])),
+        (1, lambda: ("get_graph", "GET", f"/get_graph?type={rng.choice(TYPES)}", None)),
+    ]
+    return load_test(app, weighted(mix, options.requests, rng), options.concurrency,
+                     warmup=[request() for _, request in mix])
+
+
+@case("api_visualize", "load", "edges", [100, 1_000], [100])
+def load_visualize(edges: int, options) -> dict:
+    app = app_under_test()
+    import resources
+    nodes = graph_nodes(edges)
+    resources.graph_store.get().bulk_load(*graph_rows(nodes, edges))
+    rng = random.Random(7)
+    # Mostly cached renders, with a write every tenth request forcing an incremental re-layout
+    mix = [
+        (9, lambda: ("visualize_graph", "GET", "/visualize_graph", None)),
+        (1, lambda: ("add_relations", "POST", "/add_relations",
+                     [{"source": f"entity-{rng.randrange(nodes)}", "target": f"entity-{rng.randrange(nodes)}",
+                       "relation": rng.choice(RELATIONS)}])),
+    ]
+    return load_test(app, weighted(mix, max(options.requests // 10, 20), rng), options.concurrency,
+                     warmup=[request() for _, request in mix])
+
+
+@case("api_chat", "load", "documents", [10, 1_000], [10])
+def load_chat(documents: int, options) -> dict:
+    os.environ["LLM_CLIENT"] = "fake"
+    app = app_under_test()
+    import resources
+    retriever = resources.knowledge_retriever.get()
+    if retriever is not None:
+        for i in range(documents):
+            retriever.add_document(f"doc-{i}", synthetic_text(400, seed=i))
+    rng = random.Random(7)
+    repeated = [synthetic_text(12, seed=i) for i in range(20)]
+    counter = iter(range(10 ** 9))
+
+    def unique_query():
+        return f"{rng.choice(repeated)} #{next(counter)}"
+
+    mix = [
+        (40, lambda: ("chat_uncached", "POST", "/chat", {"user_query": unique_query()})),
+        (30, lambda: ("chat_cached", "POST", "/chat", {"user_query": rng.choice(repeated)})),
+        (10, lambda: ("chat_stream", "POST", "/chat", {"user_query": unique_query(), "stream": True})),
+        (20, lambda: ("retrieval_search", "GET", f"/retrieval/search?query={rng.choice(repeated)}", None)),
+    ]
+    return load_test(app, weighted(mix, options.requests, rng), options.concurrency,
+                     warmup=[request() for _, request in mix])
+
+
+@case("api_nlp", "load", "words", [200, 2_000], [200])
+def load_nlp(words: int, options) -> dict:
+    require_spacy()
+    app = app_under_test()
+    rng = random.Random(7)
+    texts = [synthetic_text(words, seed=i) for i in range(50)]
+    counter = iter(range(10 ** 9))
+    mix = [
+        (30, lambda: ("analyze_text", "POST", "/analyze-text", {"text": f"{rng.choice(texts)} {next(counter)}"})),
+        (20, lambda: ("analyze_text_cached", "POST", "/analyze-text", {"text": texts[0]})),
+        (20, lambda: ("summarize_text", "POST", "/summarize-text", {"text": rng.choice(texts)})),
+        (15, lambda: ("extract_key_phrases", "POST", "/extract-key-phrases", {"text": rng.choice(texts)})),
+        (15, lambda: ("extract_insights", "POST", "/extract-insights", {"text": rng.choice(texts)})),
+    ]
+    return load_test(app, weighted(mix, max(options.requests // 10, 20), rng), options.concurrency,
+                     warmup=[request() for _, request in mix])
+
+
+def weighted(mix, count: int, rng: random.Random):
+    """``count`` requests drawn from ``(weight, make_request)`` pairs in a seeded order."""
+    weights = [weight for weight, _ in mix]
+    return [make() for _, make in rng.choices(mix, weights=weights, k=count)]
+
+
+def measure(name: str, size: int, args, root: str) -> dict:
+    """Run one case at one size in a new process with fresh state; returns its JSON result."""
+    run_dir = tempfile.mkdtemp(prefix=f"{name}-{size}-", dir=root)
+    env = {**os.environ, "BENCH_DATA_DIR": os.path.join(root, "data"),
+           "MARKET_MODEL_DIR": os.path.join(run_dir, "models"), "GRAPH_DATA_DIR": os.path.join(run_dir, "graph"),
+           "RAG_ENABLED": "1", "RAG_INDEX_DIR": os.path.join(run_dir, "rag"), "LLM_CLIENT": "fake",
+           "PRELOAD_RESOURCES": ""}
+    try:
+        proc = subprocess.run([sys.executable, "-m", "benchmarks.bench_suite", "--measure", name, str(size),
+                               "--repeat", str(args.repeat), "--requests", str(args.requests),
+                               "--concurrency", str(args.concurrency)],
+                              capture_output=True, text=True, env=env)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    if proc.returncode != 0:
+        return {"failed": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def _measure_here(name: str, size: int, options):
+    try:
+        result = CASES[name].run(size, options)
+    except Skipped as e:
+        result = {"skipped": str(e)}
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+def report(name: str, result: dict) -> None:
+    if "skipped" in result or "failed" in result:
+        print(f"{name:<28} {'skipped' if 'skipped' in result else 'FAILED'}: "
+              f"{result.get('skipped') or result.get('failed')}")
+        return
+    scalars = [f"{key} {value:.3f}" for key, value in result.items()
+               if key.endswith("seconds") and isinstance(value, float)]
+    print(f"{name:<28} peak RSS {result['peak_rss_mb']:.0f} MB   {'   '.join(scalars)}")
+    for label, stats in result.items():
+        if isinstance(stats, dict) and "p50_ms" in stats:
+            print(f"    {label:<24} p50 {stats['p50_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms   "
+                  f"p99 {stats['p99_ms']:9.3f} ms   {stats['per_second']:10.1f}/s   n={stats['count']}")
+    if result.get("server_errors"):
+        print(f"    server errors: {result['server_errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--kind", choices=["micro", "load"], help="Only micro-benchmarks or only load tests")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Override every selected case's sizes")
+    parser.add_argument("--quick", action="store_true", help="Small sizes and fewer requests, for a fast check")
+    parser.add_argument("--repeat", type=int, default=None, help="Calls per micro-benchmark operation")
+    parser.add_argument("--requests", type=int, default=None, help="Requests per load test")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients per load test")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Earlier --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="Percent change flagged as a regression by --compare")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    parser.add_argument("--measure", nargs=2, metavar=("CASE", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.repeat = args.repeat or (20 if args.quick else 100)
+    args.requests = args.requests or (200 if args.quick else 2000)
+    if args.measure:
+        _measure_here(args.measure[0], int(args.measure[1]), args)
+        return
+
+    results = {}
+    root = tempfile.mkdtemp(prefix="bench-suite-")
+    os.makedirs(os.path.join(root, "data"))
+    try:
+        for name in args.cases:
+            spec = CASES[name]
+            if args.kind and spec.kind != args.kind:
+                continue
+            for size in args.sizes or (spec.quick_sizes if args.quick else spec.sizes):
+                key = f"{name}[{size}]"
+                results[key] = measure(name, size, args, root)
+                report(f"{key} ({spec.unit})", results[key])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    output = {"environment": environment(),
+              "options": {"quick": args.quick, "repeat": args.repeat, "requests": args.requests,
+                          "concurrency": args.concurrency},
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"\nchange since {previous['environment']['commit']} (threshold {args.threshold:.0f}%):")
+        regressions = compare(previous["results"], results, args.threshold / 100)
+        print(f"{len(regressions)} regression(s)" + (": " + ", ".join(regressions) if regressions else ""))
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Scaling benchmark for the extractive summarizer.
+
+Run from the AI directory:
+
+    python -m benchmarks.bench_summarize
+
+Times ``textanalysis.score_sentences`` on synthetic regulation text of 1k, 10k and
+100k words. The previous scorer (every word of every sentence compared with every
+token of the document) is timed on the smallest input only; its cost grows with
+sentences x words x tokens, so larger sizes would take minutes to hours.
+"""
+import re
+import time
+import textanalysis
+from textanalysis import preprocess_text, rank_sentences, score_sentences
+from benchmarks.datasets import synthetic_text
+
+SIZES = (1_000, 10_000, 100_000)
+
+
+def split_sentences(text: str):
+    return [sent for sent in re.split(r'(?<=\.)\s+', text) if sent]
+
+
+def legacy_score_sentences(sentences, tokens):
+    """The old scoring loop, with a plain token list standing in for the spaCy Doc."""
+    stop_words = textanalysis.get_stop_words()
+    sentence_scores = {}
+    for sent in sentences:
+        for word in preprocess_text(sent).split():
+            if word in stop_words:
+                continue
+            for token in tokens:
+                if token == word:
+                    sentence_scores[sent] = sentence_scores.get(sent, 0) + 1
+    return sentence_scores
+
+
+def timed(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    try:
+        textanalysis.get_stop_words()
+    except LookupError:
+        # NLTK stopwords not provisioned; the fallback keeps the timings comparable
+        textanalysis._stop_words = {"the", "of", "and", "to", "in", "for", "is", "be", "by", "on",
+                                    "with", "as", "are", "this", "that", "from", "which"}
+
+    print(f"{'words':>8} {'sentences':>10} {'indexed (s)':>12} {'us/word':>8} {'legacy (s)':>11}")
+    for size in SIZES:
+        sentences = split_sentences(synthetic_text(size))
+        indexed = timed(lambda: rank_sentences(score_sentences(sentences)))
+        legacy = "skipped"
+        if size == SIZES[0]:
+            tokens = preprocess_text(" ".join(sentences)).split()
+            legacy = f"{timed(legacy_score_sentences, sentences, tokens, repeat=1):.3f}"
+        print(f"{size:>8} {len(sentences):>10} {indexed:>12.4f} {indexed / size * 1e6:>8.2f} {legacy:>11}")
+
+
+if __name__ == "__main__":
+    main()
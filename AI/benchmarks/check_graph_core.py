@@ -0,0 +1,131 @@
+"""Differential check of the compact graph core against the NetworkX core.
+
+Run from the AI directory:
+
+    python -m benchmarks.check_graph_core --trials 200
+
+Each trial replays the same random mix of entity, relation and bulk writes (with
+retyped entities, relabelled edges and clears) into a ``GraphStore`` per core,
+each with its own log directory and frequent snapshots, then compares pages,
+filters, neighbourhoods, path and reachability queries, snapshots and the graph
+recovered from the log. Exits non-zero on the first trial where the cores differ.
+"""
+from typing import NamedTuple
+import argparse
+import random
+import sys
+import tempfile
+import compactgraph
+from graphlog import GraphLog
+from graphquery import GraphQueryEngine
+from graphstore import GraphStore
+
+TYPES = ("Country", "Product", "Regulation")
+RELATIONS = ("applies_to", "requires", "exempts")
+
+
+class Entity(NamedTuple):
+    name: str
+    type: str
+
+
+class Relation(NamedTuple):
+    source: str
+    target: str
+    relation: str
+
+
+def write(store: GraphStore, seed: int, steps: int) -> None:
+    rng = random.Random(seed)
+    num_names = rng.choice((20, 100, 300))
+    for step in range(steps):
+        store.add_entities([Entity(f"n{rng.randrange(num_names)}", rng.choice(TYPES))
+                            for _ in range(rng.randrange(1, 30))])
+        names = list(store.graph)
+        store.add_relations([Relation(rng.choice(names), rng.choice(names), rng.choice(RELATIONS))
+                             for _ in range(rng.randrange(1, 40))])
+        if rng.random() < 0.05:
+            store.bulk_load([(0, "bulk", "Country")],
+                            [(i, "bulk", rng.choice(names), rng.choice(RELATIONS)) for i in range(30)])
+        if rng.random() < 0.02:
+            store.clear()
+
+
+def pages(page, key: str, *args) -> list:
+    items, cursor = [], None
+    while True:
+        result = page(*args, cursor=cursor, limit=17)
+        items += result[key]
+        cursor = result["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def unordered(items) -> list:
+    return sorted(map(repr, items))
+
+
+def observe(store: GraphStore, seed: int) -> dict:
+    """Everything the API can read from ``store``; neighbour order only where both cores define it."""
+    engine = GraphQueryEngine(store)
+    seen = {"counts": (store.graph.number_of_nodes(), store.graph.number_of_edges())}
+    for node_type in (None,) + TYPES:
+        seen["nodes", node_type] = pages(store.page_nodes, "nodes", node_type)
+    for relation in (None,) + RELATIONS:
+        seen["edges", relation] = unordered(pages(store.page_edges, "edges", relation))
+        for node_type in (None, TYPES[0]):
+            result = store.filtered(node_type, relation)
+            seen["filtered", node_type, relation] = (result["nodes"], unordered(result["edges"]))
+
+    names = sorted(store.graph)
+    rng = random.Random(seed)
+    for source in rng.sample(names, min(len(names), 10)):
+        target = rng.choice(names)
+        for relation in (None, RELATIONS[0]):
+            result = store.neighborhood(source, 2, relation)
+            seen["neighborhood", source, relation] = (unordered(result["nodes"]), unordered(result["edges"]))
+        for direction in ("out", "in", "both"):
+            seen["reachable", source, direction] = unordered(engine.reachable(source, TYPES[2], RELATIONS[:2],
+                                                                              direction, 3))
+            path = engine.shortest_path(source, target, None, direction)
+            seen["shortest_path", source, target, direction] = None if path is None else len(path)
+        seen["all_paths", source, target] = unordered(engine.all_paths(source, target, 3)[0])
+
+    _, graph = store.snapshot()
+    seen["snapshot"] = (unordered(graph.nodes(data="type")), unordered(graph.edges(data="relation")))
+    return seen
+
+
+def trial(seed: int, steps: int) -> list:
+    """Keys whose values differ between the cores after the writes of ``seed``."""
+    seen = {}
+    for core in ("networkx", "compact"):
+        with tempfile.TemporaryDirectory() as directory:
+            store = GraphStore(GraphLog(directory, fsync=False), snapshot_every=37, core=core)
+            write(store, seed, steps)
+            seen[core] = observe(store, seed)
+            recovered = GraphStore(GraphLog(directory, fsync=False), core=core)
+            seen[core]["recovered"] = (pages(recovered.page_nodes, "nodes"),
+                                       unordered(pages(recovered.page_edges, "edges")))
+    return [key for key in seen["networkx"] if seen["networkx"][key] != seen["compact"].get(key)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=200)
+    parser.add_argument("--steps", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # Small merge thresholds, so the trials also go through buffer merges
+    compactgraph.MERGE_MIN_EDGES = 50
+
+    for seed in range(args.seed, args.seed + args.trials):
+        mismatches = trial(seed, args.steps)
+        if mismatches:
+            print(f"seed {seed}: cores differ on {len(mismatches)} checks, e.g. {mismatches[:5]}")
+            sys.exit(1)
+    print(f"{args.trials} trials: the compact and NetworkX cores agree")
+
+
+if __name__ == "__main__":
+    main()
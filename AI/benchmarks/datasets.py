@@ -0,0 +1,61 @@
+"""Synthetic, seeded inputs shared by the benchmarks.
+
+Regulation-like text of any length, per-country market indicator files of any
+number of rows and knowledge graphs of any number of edges, all generated
+offline and reproducibly from a seed.
+"""
+import random
+import numpy as np
+import pandas as pd
+from graphstore import GraphStore
+from marketdata import INDICATOR_COLUMNS
+
+VOCABULARY = (
+    "export incentive duty drawback remission tariff exporter shipment certificate origin "
+    "customs declaration compliance regulation scheme notification directorate foreign trade "
+    "invoice value goods classification rate benefit claim eligibility authority port "
+    "the of and to in for is be by on with as are this that from which"
+).split()
+TYPES = ("Country", "Product", "Regulation", "Scheme", "Agency")
+RELATIONS = ("applies_to", "requires", "exempts", "administered_by", "exported_to")
+
+
+def synthetic_text(num_words: int, seed: int = 42) -> str:
+    rng = random.Random(seed)
+    sentences, written = [], 0
+    while written < num_words:
+        length = rng.randint(8, 30)
+        words = [rng.choice(VOCABULARY) for _ in range(length)]
+        sentences.append(" ".join(words).capitalize() + ".")
+        written += length
+    return " ".join(sentences)
+
+
+def write_market_data(path: str, num_rows: int, num_countries: int, chunk_rows: int = 1_000_000, seed: int = 42):
+    """Per-country, per-month indicators in the ``market_data.csv`` layout, written in chunks."""
+    rng = np.random.default_rng(seed)
+    countries = np.array([f"Country {i}" for i in range(num_countries)])
+    for start in range(0, num_rows, chunk_rows):
+        size = min(chunk_rows, num_rows - start)
+        chunk = pd.DataFrame({'Country': countries[(np.arange(start, start + size)) % num_countries]})
+        for column in INDICATOR_COLUMNS:
+            chunk[column] = rng.random(size).round(3)
+        chunk['Cost_Saving'] = (chunk['Cost_Saving'] * 3000).round(2)
+        chunk.loc[rng.random(size) < 0.001, 'Duty_Drawback'] = np.nan
+        chunk.to_csv(path, mode='a', header=start == 0, index=False)
+
+
+def graph_rows(num_nodes: int, num_edges: int, seed: int = 42):
+    """``(entities, relations)`` in the row format of ``GraphStore.bulk_load``."""
+    rng = random.Random(seed)
+    entities = [(i, f"entity-{i}", TYPES[i % len(TYPES)]) for i in range(num_nodes)]
+    relations = [(i, f"entity-{rng.randrange(num_nodes)}", f"entity-{rng.randrange(num_nodes)}", rng.choice(RELATIONS))
+                 for i in range(num_edges)]
+    return entities, relations
+
+
+def build_graph(num_nodes: int, num_edges: int, seed: int = 42, store: GraphStore = None) -> GraphStore:
+    """Load a random graph into ``store`` (a new in-memory one by default)."""
+    store = store if store is not None else GraphStore()
+    store.bulk_load(*graph_rows(num_nodes, num_edges, seed))
+    return store
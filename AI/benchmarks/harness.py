@@ -0,0 +1,150 @@
+"""Timing, in-process load generation and result files for ``bench_suite``.
+
+Latencies are summarized as count, mean, p50, p95, p99 and max in milliseconds
+plus operations per second. ``load_test`` drives an ASGI app through
+``httpx.ASGITransport`` with a fixed number of concurrent clients, so the
+routing, validation, threadpool and serialization costs of a real request are
+measured without a server or network in the way.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+# Metrics where a higher value is better; every other compared metric is a cost
+HIGHER_IS_BETTER = ("per_second",)
+# Compared across runs; counts and maxima are reported but too noisy or not comparable
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "per_second", "seconds", "peak_rss_mb")
+# Latency changes smaller than this are timer and scheduling noise, whatever the percentage
+NOISE_FLOOR_MS = 0.05
+
+# (label, method, url, JSON body or None)
+Request = Tuple[str, str, str, Optional[object]]
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(samples: Sequence[float], wall_seconds: Optional[float] = None) -> dict:
+    """Percentiles of ``samples`` (seconds) in ms; throughput over ``wall_seconds`` or their sum."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    seconds = wall_seconds if wall_seconds is not None else ms.sum() / 1000
+    return {"count": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+            "p99_ms": float(p99), "max_ms": float(ms.max()),
+            "per_second": len(ms) / seconds if seconds > 0 else float("inf")}
+
+
+def time_calls(func: Callable, *args, repeat: int = 50, warmup: int = 1, max_seconds: float = 10.0) -> dict:
+    """Call ``func(*args)`` up to ``repeat`` times, stopping early once ``max_seconds`` are spent."""
+    for _ in range(warmup):
+        func(*args)
+    samples = []
+    deadline = time.perf_counter() + max_seconds
+    while len(samples) < repeat and (not samples or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def timed_once(func: Callable, *args) -> Tuple[object, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+async def _drive(client, requests: Sequence[Request], concurrency: int):
+    samples = defaultdict(list)
+    statuses = Counter()
+    pending = iter(requests)
+
+    async def worker():
+        for label, method, url, body in pending:
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            samples[label].append(time.perf_counter() - start)
+            statuses[label, response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, statuses, time.perf_counter() - start
+
+
+def load_test(app, requests: Sequence[Request], concurrency: int = 16, warmup: Sequence[Request] = ()) -> dict:
+    """Send ``requests`` to ``app`` from ``concurrency`` clients, inside the app's lifespan.
+
+    ``warmup`` requests are sent first, one at a time, and not measured. Returns
+    latency per request label, overall throughput and the responses by status.
+    """
+    import httpx
+
+    async def run():
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+                await _drive(client, warmup, 1)
+                return await _drive(client, requests, concurrency)
+
+    samples, statuses, wall_seconds = asyncio.run(run())
+    result = {label: summarize(values) for label, values in samples.items()}
+    result["total"] = summarize([value for values in samples.values() for value in values], wall_seconds)
+    result["concurrency"] = concurrency
+    result["server_errors"] = sum(count for (_, status), count in statuses.items() if status >= 500)
+    result["statuses"] = {f"{label} {status}": count for (label, status), count in sorted(statuses.items())}
+    return result
+
+
+def environment() -> dict:
+    """Where and on what a result was produced, so runs can be matched to commits."""
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    def git(*args) -> str:
+        try:
+            return subprocess.run(["git", *args], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {"commit": git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no", "--", "..")),
+            "python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count(),
+            "started_at": datetime.now(timezone.utc).isoformat()}
+
+
+def flatten(result: dict, prefix: str = "") -> Dict[str, float]:
+    """``{"lookup": {"p50_ms": 1}}`` -> ``{"lookup.p50_ms": 1}``, numbers only."""
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(previous: dict, current: dict, threshold: float) -> List[str]:
+    """Print the change of every comparable metric; return those worse by more than ``threshold`` (a fraction)."""
+    regressions = []
+    for name, result in current.items():
+        if name not in previous:
+            continue
+        before, after = flatten(previous[name]), flatten(result)
+        for key in sorted(after):
+            if key not in before or not key.endswith(COMPARED) or not before[key]:
+                continue
+            change = after[key] / before[key] - 1
+            worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+            noise = key.endswith("_ms") and abs(after[key] - before[key]) < NOISE_FLOOR_MS
+            flag = "  REGRESSION" if worse > threshold and not noise else ""
+            print(f"  {name:<26} {key:<34} {before[key]:12.3f} -> {after[key]:12.3f} ({change:+7.1%}){flag}")
+            if flag:
+                regressions.append(f"{name} {key}")
+    return regressions
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class InMemoryBackend:
+    """Process-local LRU cache with a per-entry time-to-live."""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Shared cache in Redis so every worker sees the same entries.
+
+    Entries expire after ``ttl`` seconds; size is bounded by the server's
+    ``maxmemory`` with an ``allkeys-lru`` eviction policy.
+    """
+
+    def __init__(self, url: str = None, ttl: float = 3600, prefix: str = "ecoexpand:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            value = value.decode("utf-8")
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self.client.set(self.prefix + key, value, ex=int(self.ttl))
+
+    def clear(self) -> None:
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+class ResponseCache:
+    """Memoizes results in a backend and counts hits and misses.
+
+    ``InMemoryBackend`` stores any object; ``RedisBackend`` only strings.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self.backend.set(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Collapse whitespace and case so trivially different phrasings share an entry."""
+    return " ".join(text.split()).casefold() if text else ""
+
+
+def chat_cache_key(user_query: str, context: Optional[str], model: str, temperature: float, max_tokens: int) -> str:
+    payload = [normalize_text(user_query), normalize_text(context), model, round(float(temperature), 3), int(max_tokens)]
+    return "chat:" + hashlib.sha256(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+def cache_from_env() -> Optional[ResponseCache]:
+    """Build the chat cache from ``CHAT_CACHE_BACKEND`` (memory, redis or none)."""
+    backend = os.getenv("CHAT_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+    if backend == "none":
+        return None
+    if backend == "redis":
+        return ResponseCache(RedisBackend(os.getenv("REDIS_URI"), ttl=ttl))
+    return ResponseCache(InMemoryBackend(int(os.getenv("CHAT_CACHE_SIZE", "1024")), ttl=ttl))
@@ -1,83 +1,151 @@
 # Install required packages
-# pip install fastapi uvicorn openai
+# pip install fastapi uvicorn httpx
 
-import openai
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
+from llm import response_cache, sse_events
+from metrics import REGISTRY, cache_metrics
+from monitoring import instrument
+from resources import chat_service, knowledge_retriever, lifespan, on_startup
+from retrieval import RAG_MAX_TOP_K
 
-# OpenAI API Key setup
-openai.api_key = "YOUR_OPENAI_API_KEY"
-
-# Initialize FastAPI app
-app = FastAPI(title="EcoExpand AI", description="A compliance and incentive guide powered by Generative AI.",
-              version="1.0")
+# Chat routes; the LLM client and the retriever are shared resources created on first use
+router = APIRouter(tags=["chat"])
 
 
 # Request model for FastAPI
 class QueryRequest(BaseModel):
     user_query: str
     context: str = None  # Optional context field
+    stream: bool = False  # Stream tokens back as server-sent events
 
 
-# Generate response using OpenAI GPT model
-def generate_response(user_query: str, context: str = None) -> str:
-    """
-    Generates a response using OpenAI's GPT model.
+# Regulation text indexed for retrieval-augmented answers
+class DocumentInput(BaseModel):
+    id: str
+    text: str
 
-    Args:
-        user_query (str): The user's query.
-        context (str, optional): Optional context for providing specific responses.
 
-    Returns:
-        str: The response from the GPT model.
-    """
-    try:
-        # Predefine the system's behavior
-        system_prompt = (
-            "You are EcoExpand AI, a smart chatbot that helps users understand compliance regulations "
-            "and international export incentives. Provide detailed, accurate, and actionable guidance."
-        )
-
-        # Append context if provided
-        if context:
-            system_prompt += f"\nContext: {context}"
-
-        # Call OpenAI's GPT-4 API
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_query}
-            ],
-            max_tokens=300,  # Adjust based on response length requirements
-            temperature=0.7  # Controls creativity
-        )
-
-        return response['choices'][0]['message']['content']
+# Create the LLM client and embed the retriever's pending graph facts before traffic arrives
+@on_startup(warmup=True)
+def warm_up_chat():
+    chat_service.get()
+    if knowledge_retriever.get() is not None:
+        knowledge_retriever.get().sync_facts()
+        knowledge_retriever.get().retrieve("export incentives")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+
+@REGISTRY.collector
+def chat_metrics():
+    collected = cache_metrics({"chat": response_cache})
+    if chat_service.loaded:
+        stats = chat_service.get().stats()
+        collected += [
+            ("chat_upstream_in_flight", "gauge", "Upstream LLM calls in flight", [({}, stats["in_flight"])]),
+            ("chat_upstream_queued", "gauge", "Requests waiting for an upstream slot", [({}, stats["queued"])]),
+            ("chat_upstream_calls_total", "counter", "Upstream LLM calls made", [({}, stats["upstream_calls"])]),
+            ("chat_coalesced_total", "counter", "Requests answered by an identical in-flight call",
+             [({}, stats["coalesced"])]),
+        ]
+    return collected
 
 
 # API endpoint to handle queries
-@app.post("/chat", summary="Chat with EcoExpand AI")
-def chat_with_ai(query: QueryRequest):
+@router.post("/chat", summary="Chat with EcoExpand AI")
+async def chat_with_ai(query: QueryRequest):
     """
     Endpoint to interact with the chatbot.
 
     Args:
-        query (QueryRequest): JSON payload containing `user_query` and optional `context`.
+        query (QueryRequest): JSON payload containing `user_query`, optional `context`
+            and `stream` to receive the answer as server-sent events.
 
     Returns:
-        JSON: The chatbot's response.
+        JSON: The chatbot's response, or an event stream of tokens.
     """
+    service = await chat_service.aget()
+    if query.stream:
+        return StreamingResponse(sse_events(service.stream(query.user_query, query.context)),
+                                 media_type="text/event-stream")
     try:
-        response = generate_response(query.user_query, query.context)
+        response = await service.generate(query.user_query, query.context)
         return {"response": response}
-    except HTTPException as e:
-        raise e
     except Exception as e:
-        raise HTTPException(status_code=500, detail="Internal server error")
+        raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+
+
+# Cache statistics for the /chat endpoint
+@router.get("/chat/cache", summary="Chat response cache statistics")
+def chat_cache_stats():
+    """
+    Reports hit and miss counters of the /chat response cache.
+    """
+    if response_cache is None:
+        return {"backend": None}
+    return response_cache.stats()
+
+
+# Upstream concurrency and queueing statistics for the /chat endpoint
+@router.get("/chat/stats", summary="Chat upstream statistics")
+def chat_stats():
+    """
+    Reports in-flight and queued upstream calls, queue times and coalesced requests.
+    """
+    return chat_service.get().stats()
+
+
+def _require_retriever():
+    retriever = knowledge_retriever.get()
+    if retriever is None:
+        raise HTTPException(status_code=404, detail="Retrieval is disabled (RAG_ENABLED=0).")
+    return retriever
+
+
+# Index a regulation document for retrieval
+@router.post("/retrieval/documents", summary="Index a document for retrieval")
+def add_retrieval_document(document: DocumentInput):
+    """
+    Splits the document into chunks and indexes them, replacing an earlier document with the same id.
+    """
+    chunks = _require_retriever().add_document(document.id, document.text)
+    return {"message": f"Document {document.id} indexed.", "chunks": chunks}
+
+
+# Write indexed documents to disk now rather than at the next batch or shutdown
+@router.post("/retrieval/flush", summary="Save the retrieval index")
+def flush_retrieval_index():
+    """
+    Writes documents indexed since the last save to the index directory.
+    """
+    _require_retriever().flush()
+    return {"message": "Retrieval index saved."}
+
+
+# Snippets that would be attached to a /chat prompt
+@router.get("/retrieval/search", summary="Search indexed documents and graph facts")
+def search_retrieval(query: str, top_k: Optional[int] = Query(None, ge=1, le=RAG_MAX_TOP_K)):
+    """
+    Returns the top-k document chunks and knowledge graph facts for the query.
+    """
+    return {"snippets": _require_retriever().retrieve(query, top_k)}
+
+
+# Index sizes and search latency
+@router.get("/retrieval/stats", summary="Retrieval index statistics")
+def retrieval_stats():
+    """
+    Reports the number of indexed chunks and facts and search latency percentiles.
+    """
+    return _require_retriever().stats()
+
+
+# Standalone app serving only the chat routes
+app = FastAPI(title="EcoExpand AI", description="A compliance and incentive guide powered by Generative AI.",
+              version="1.0", lifespan=lifespan)
+app.include_router(router)
+instrument(app)
 
 
 # Root endpoint
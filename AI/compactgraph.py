@@ -0,0 +1,530 @@
+"""Compact knowledge graph core: interned ids and array-backed adjacency.
+
+``CompactGraph`` holds the same graph as the store's ``nx.DiGraph`` (nodes with a
+``type``, edges with a ``relation``) in integers instead of per-node and per-edge
+dicts. Entity names, types and relation labels are interned to ids; node types
+live in one int32 array; edges live in CSR arrays (``indptr``/``indices``/
+``relation`` per source, a reverse CSR for predecessors and a sorted key array
+for edge lookups). New edges go to an append buffer that is merged into the
+arrays once it outgrows a fraction of the graph, so inserts stay cheap and the
+merges are amortized. An edge costs about 36 bytes instead of several hundred.
+
+It implements the part of the DiGraph interface that the store and its readers
+use (``nodes``, ``edges``, the ``adj``/``succ``/``pred`` views, ``add_nodes_from``,
+``add_edges_from``, ``clear``) and keeps ``type_index`` and ``relation_index``
+views that stand in for the store's dict indexes. Attribute dicts are built on
+access and are read-only. ``to_networkx`` builds a DiGraph for algorithms that
+need one. Neighbours are returned in insertion order, as in NetworkX;
+predecessors are grouped by source rather than in insertion order.
+"""
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional
+import networkx as nx
+import numpy as np
+
+# Buffered edges are merged into the arrays past this share of the graph (or MERGE_MIN_EDGES)
+MERGE_RATIO = 0.25
+MERGE_MIN_EDGES = 4096
+_TARGET_BITS = 32
+_TARGET_MASK = (1 << _TARGET_BITS) - 1
+
+
+def _edge_key(source: int, target: int) -> int:
+    return (source << _TARGET_BITS) | target
+
+
+def _intern(table: List, ids: Dict, value) -> int:
+    index = ids.get(value)
+    if index is None:
+        index = ids[value] = len(table)
+        table.append(value)
+    return index
+
+
+class _Neighbours(Mapping):
+    """Successors (``out``) or predecessors (``in``) of one node: name -> edge attributes."""
+
+    def __init__(self, graph: "CompactGraph", node: int, direction: str):
+        self._graph = graph
+        self._node = node
+        self._direction = direction
+
+    def _ids(self) -> List[int]:
+        return self._graph._neighbour_ids(self._node, self._direction)
+
+    def _key(self, other: int) -> int:
+        return _edge_key(self._node, other) if self._direction == "out" else _edge_key(other, self._node)
+
+    def __iter__(self) -> Iterator[str]:
+        names = self._graph.names
+        return (names[i] for i in self._ids())
+
+    def __len__(self) -> int:
+        return self._graph._degree(self._node, self._direction)
+
+    def __getitem__(self, name: str) -> dict:
+        other = self._graph._ids.get(name)
+        relation = None if other is None else self._graph._relation_id(self._key(other))
+        if relation is None:
+            raise KeyError(name)
+        return self._graph._edge_data(relation)
+
+    def __contains__(self, name) -> bool:
+        other = self._graph._ids.get(name)
+        return other is not None and self._graph._relation_id(self._key(other)) is not None
+
+    def items(self):
+        graph = self._graph
+        ids, relations = graph._neighbour_relations(self._node, self._direction)
+        return [(graph.names[i], graph._edge_data(r)) for i, r in zip(ids, relations)]
+
+
+class _AdjacencyView(Mapping):
+    def __init__(self, graph: "CompactGraph", direction: str):
+        self._graph = graph
+        self._direction = direction
+
+    def __getitem__(self, name: str) -> _Neighbours:
+        return _Neighbours(self._graph, self._graph._ids[name], self._direction)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._graph.names)
+
+    def __len__(self) -> int:
+        return len(self._graph.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._graph._ids
+
+
+class _NodeView(Mapping):
+    """``nodes[name]`` -> attributes, ``nodes(data="type")`` -> ``(name, type)`` pairs, like NetworkX."""
+
+    def __init__(self, graph: "CompactGraph"):
+        self._graph = graph
+
+    def __getitem__(self, name: str) -> dict:
+        node_type = self._graph.types[self._graph.node_type[self._graph._ids[name]]]
+        return {} if node_type is None else {"type": node_type}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._graph.names)
+
+    def __len__(self) -> int:
+        return len(self._graph.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._graph._ids
+
+    def __call__(self, data=False):
+        graph = self._graph
+        if data is False:
+            return iter(graph.names)
+        types = graph.types
+        if data is True:
+            return ((name, {} if types[t] is None else {"type": types[t]})
+                    for name, t in zip(graph.names, graph.node_type))
+        if data == "type":
+            return zip(graph.names, (types[t] for t in graph.node_type))
+        return ((name, None) for name in graph.names)
+
+
+class _Members:
+    """Names of the nodes of one type, in insertion order."""
+
+    def __init__(self, names: List[str], ids: array, size: int):
+        self._names = names
+        self._ids = ids
+        self._size = size
+
+    def __iter__(self) -> Iterator[str]:
+        names = self._names
+        return (names[i] for i in self._ids if i >= 0)
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class _TypeIndex(Mapping):
+    """type -> names of that type; replaces the store's ``type_index``."""
+
+    def __init__(self, graph: "CompactGraph"):
+        self._graph = graph
+
+    def __getitem__(self, node_type: str) -> _Members:
+        graph = self._graph
+        type_id = graph._type_ids.get(node_type)
+        if type_id is None or type_id not in graph._type_members:
+            raise KeyError(node_type)
+        return _Members(graph.names, graph._type_members[type_id], graph._type_sizes[type_id])
+
+    def __iter__(self) -> Iterator[str]:
+        return (self._graph.types[t] for t in self._graph._type_members)
+
+    def __len__(self) -> int:
+        return len(self._graph._type_members)
+
+
+class _RelationAdjacency(Mapping):
+    """source -> targets over the edges labelled with one relation, sources in first-use order."""
+
+    def __init__(self, graph: "CompactGraph", relation: int):
+        self._graph = graph
+        self._relation = relation
+
+    def __getitem__(self, name: str) -> List[str]:
+        graph = self._graph
+        node = graph._ids.get(name)
+        if node is None:
+            raise KeyError(name)
+        ids, relations = graph._neighbour_relations(node, "out")
+        return [graph.names[i] for i, r in zip(ids, relations) if r == self._relation]
+
+    def get(self, name: str, default=None):
+        return self[name] if name in self._graph._ids else default
+
+    def __iter__(self) -> Iterator[str]:
+        names = self._graph.names
+        return (names[i] for i in self._graph._relation_sources[self._relation])
+
+    def __len__(self) -> int:
+        return len(self._graph._relation_sources[self._relation])
+
+
+class _RelationIndex(Mapping):
+    """relation -> ``_RelationAdjacency``; replaces the store's ``relation_index``."""
+
+    def __init__(self, graph: "CompactGraph"):
+        self._graph = graph
+
+    def __getitem__(self, relation: str) -> _RelationAdjacency:
+        relation_id = self._graph._relation_ids.get(relation)
+        if relation_id is None or relation_id not in self._graph._relation_sources:
+            raise KeyError(relation)
+        return _RelationAdjacency(self._graph, relation_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self._graph.relations[r] for r in self._graph._relation_sources)
+
+    def __len__(self) -> int:
+        return len(self._graph._relation_sources)
+
+
+class CompactGraph:
+    def __init__(self):
+        self.nodes = _NodeView(self)
+        self.adj = self.succ = _AdjacencyView(self, "out")
+        self.pred = _AdjacencyView(self, "in")
+        self.type_index = _TypeIndex(self)
+        self.relation_index = _RelationIndex(self)
+        self.clear()
+
+    def clear(self) -> None:
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.types: List[Optional[str]] = []
+        self._type_ids: Dict[Optional[str], int] = {}
+        self.relations: List[Optional[str]] = []
+        self._relation_ids: Dict[Optional[str], int] = {}
+        self.node_type = array("i")
+        # type id -> node ids in insertion order; a node that changed type leaves a -1 behind
+        self._type_members: Dict[int, array] = {}
+        self._type_sizes: Dict[int, int] = {}
+        self._type_position = array("i")
+        # relation id -> source ids in first-use order; the (relation, source) pairs already
+        # listed are a sorted key array plus a set of pairs added since it was last rebuilt
+        self._relation_sources: Dict[int, array] = {}
+        self._source_keys = np.empty(0, dtype=np.int64)
+        self._source_buffer = set()
+        self._set_arrays(np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                         np.empty(0, dtype=np.int32))
+        self._clear_buffer()
+
+    def _clear_buffer(self):
+        # Edges added since the last merge: key -> relation id, plus per-node neighbour lists
+        self._buffer: Dict[int, int] = {}
+        self._buffer_out: Dict[int, List[int]] = {}
+        self._buffer_in: Dict[int, List[int]] = {}
+
+    def _set_arrays(self, indptr: np.ndarray, sources: np.ndarray, targets: np.ndarray, relation: np.ndarray):
+        """Install CSR arrays for edges already sorted by source; builds the lookup and reverse arrays."""
+        num_nodes = len(indptr) - 1
+        self._indptr = indptr
+        self._indices = targets.astype(np.int32)
+        self._relation = relation.astype(np.int32)
+        keys = (sources.astype(np.int64) << _TARGET_BITS) | targets.astype(np.int64)
+        key_order = np.argsort(keys, kind="stable")
+        self._keys = keys[key_order]
+        self._key_position = key_order
+        reverse_order = np.argsort(targets, kind="stable")
+        self._rindptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(targets, minlength=num_nodes), out=self._rindptr[1:])
+        self._rindices = sources[reverse_order].astype(np.int32)
+        self._rposition = reverse_order
+
+    # Interning and lookups
+
+    def _node_id(self, name: str, type_id: Optional[int] = None) -> int:
+        """Id of ``name``, adding it with ``type_id`` (no type when ``None``) if it is new."""
+        node = self._ids.get(name)
+        if node is None:
+            node = self._ids[name] = len(self.names)
+            self.names.append(name)
+            if type_id is None:
+                type_id = _intern(self.types, self._type_ids, None)
+            self.node_type.append(type_id)
+            self._type_position.append(self._add_member(type_id, node))
+        return node
+
+    def _add_member(self, type_id: int, node: int) -> int:
+        members = self._type_members.get(type_id)
+        if members is None:
+            members = self._type_members[type_id] = array("i")
+            self._type_sizes[type_id] = 0
+        members.append(node)
+        self._type_sizes[type_id] += 1
+        return len(members) - 1
+
+    def _relation_id(self, key: int) -> Optional[int]:
+        relation = self._buffer.get(key)
+        if relation is not None:
+            return relation
+        position = self._csr_position(key)
+        return None if position is None else int(self._relation[position])
+
+    def _csr_position(self, key: int) -> Optional[int]:
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return int(self._key_position[i])
+        return None
+
+    def _edge_data(self, relation: int) -> dict:
+        label = self.relations[relation]
+        return {} if label is None else {"relation": label}
+
+    def _csr_slice(self, node: int, direction: str):
+        indptr = self._indptr if direction == "out" else self._rindptr
+        if node >= len(indptr) - 1:
+            return 0, 0
+        return int(indptr[node]), int(indptr[node + 1])
+
+    def _neighbour_ids(self, node: int, direction: str) -> List[int]:
+        start, end = self._csr_slice(node, direction)
+        ids = (self._indices if direction == "out" else self._rindices)[start:end].tolist()
+        buffered = (self._buffer_out if direction == "out" else self._buffer_in).get(node)
+        return ids + buffered if buffered else ids
+
+    def _neighbour_relations(self, node: int, direction: str):
+        start, end = self._csr_slice(node, direction)
+        if direction == "out":
+            ids = self._indices[start:end].tolist()
+            relations = self._relation[start:end].tolist()
+            buffered = self._buffer_out.get(node, ())
+            relations += [self._buffer[_edge_key(node, other)] for other in buffered]
+        else:
+            ids = self._rindices[start:end].tolist()
+            relations = self._relation[self._rposition[start:end]].tolist()
+            buffered = self._buffer_in.get(node, ())
+            relations += [self._buffer[_edge_key(other, node)] for other in buffered]
+        return ids + list(buffered), relations
+
+    def _degree(self, node: int, direction: str) -> int:
+        start, end = self._csr_slice(node, direction)
+        return end - start + len((self._buffer_out if direction == "out" else self._buffer_in).get(node, ()))
+
+    # DiGraph interface
+
+    def __contains__(self, name) -> bool:
+        return name in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def has_node(self, name) -> bool:
+        return name in self._ids
+
+    def has_edge(self, source, target) -> bool:
+        return source in self._ids and target in self.succ[source]
+
+    def number_of_nodes(self) -> int:
+        return len(self.names)
+
+    def number_of_edges(self) -> int:
+        return len(self._indices) + len(self._buffer)
+
+    def add_nodes_from(self, nodes: Iterable) -> None:
+        """``name`` or ``(name, {"type": ...})`` items; a given type replaces the node's type."""
+        # Only a node's last type in the batch counts, as with the store's dict indexes; new
+        # nodes are added with it directly, so only existing nodes ever change type
+        final_types: Dict[str, Optional[int]] = {}
+        for item in nodes:
+            name, attrs = item if isinstance(item, tuple) else (item, {})
+            if "type" in attrs:
+                final_types[name] = _intern(self.types, self._type_ids, attrs["type"])
+            else:
+                final_types.setdefault(name, None)
+        for name, type_id in final_types.items():
+            node = self._ids.get(name)
+            if node is None:
+                self._node_id(name, type_id)
+            elif type_id is not None:
+                self._set_type(node, type_id)
+
+    def _set_type(self, node: int, type_id: int):
+        old = self.node_type[node]
+        if old == type_id:
+            return
+        self.node_type[node] = type_id
+        members = self._type_members[old]
+        members[self._type_position[node]] = -1
+        self._type_sizes[old] -= 1
+        if not self._type_sizes[old]:
+            del self._type_members[old], self._type_sizes[old]
+        elif self._type_sizes[old] * 2 < len(members):
+            # Mostly holes: drop them and renumber the remaining members
+            members = self._type_members[old] = array("i", (i for i in members if i >= 0))
+            for position, member in enumerate(members):
+                self._type_position[member] = position
+        self._type_position[node] = self._add_member(type_id, node)
+
+    def add_edges_from(self, edges: Iterable, chunk: int = 65536) -> None:
+        """``(source, target)`` or ``(source, target, {"relation": ...})`` items; missing nodes are added."""
+        batch = []
+        for edge in edges:
+            batch.append(edge)
+            if len(batch) >= chunk:
+                self._add_edges(batch)
+                batch = []
+        if batch:
+            self._add_edges(batch)
+
+    def _add_edges(self, edges: List):
+        keys, relations = [], []
+        for source, target, *data in edges:
+            label = data[0].get("relation") if data else None
+            keys.append(_edge_key(self._node_id(source), self._node_id(target)))
+            relations.append(_intern(self.relations, self._relation_ids, label))
+
+        # Edges already in the arrays only get their relation replaced
+        in_csr = np.zeros(len(keys), dtype=bool)
+        if len(self._keys):
+            key_array = np.array(keys, dtype=np.int64)
+            found = np.minimum(np.searchsorted(self._keys, key_array), len(self._keys) - 1)
+            in_csr = self._keys[found] == key_array
+            positions = self._key_position[found[in_csr]]
+            self._relation[positions] = np.array(relations, dtype=np.int32)[in_csr]
+
+        self._note_relation_sources(keys, relations)
+        for key, relation, existing in zip(keys, relations, in_csr.tolist()):
+            source, target = key >> _TARGET_BITS, key & _TARGET_MASK
+            if existing:
+                continue
+            if key not in self._buffer:
+                self._buffer_out.setdefault(source, []).append(target)
+                self._buffer_in.setdefault(target, []).append(source)
+            self._buffer[key] = relation
+        if len(self._buffer) > max(MERGE_MIN_EDGES, MERGE_RATIO * len(self._indices)):
+            self._merge()
+
+    def _note_relation_sources(self, keys: List[int], relations: List[int]):
+        """List each edge's source under its relation the first time the pair is seen."""
+        pairs = (np.array(relations, dtype=np.int64) << _TARGET_BITS) | (np.array(keys, dtype=np.int64) >> _TARGET_BITS)
+        known = np.zeros(len(pairs), dtype=bool)
+        if len(self._source_keys):
+            found = np.minimum(np.searchsorted(self._source_keys, pairs), len(self._source_keys) - 1)
+            known = self._source_keys[found] == pairs
+        buffer = self._source_buffer
+        for pair in pairs[~known].tolist():
+            if pair not in buffer:
+                buffer.add(pair)
+                sources = self._relation_sources.get(pair >> _TARGET_BITS)
+                if sources is None:
+                    sources = self._relation_sources[pair >> _TARGET_BITS] = array("i")
+                sources.append(pair & _TARGET_MASK)
+        if len(buffer) > max(MERGE_MIN_EDGES, MERGE_RATIO * len(self._source_keys)):
+            self._source_keys = np.union1d(self._source_keys,
+                                           np.fromiter(buffer, dtype=np.int64, count=len(buffer)))
+            buffer.clear()
+
+    def _merge(self):
+        """Fold the append buffer into the CSR arrays, keeping each node's neighbours in insertion order."""
+        num_nodes = len(self.names)
+        if not self._buffer:
+            # Only nodes were added: give them empty rows
+            missing = num_nodes + 1 - len(self._indptr)
+            if missing:
+                self._indptr = np.concatenate([self._indptr, np.full(missing, self._indptr[-1])])
+                self._rindptr = np.concatenate([self._rindptr, np.full(missing, self._rindptr[-1])])
+            return
+        sources = np.repeat(np.arange(len(self._indptr) - 1, dtype=np.int64), np.diff(self._indptr))
+        targets = self._indices.astype(np.int64)
+        keys = np.fromiter(self._buffer.keys(), dtype=np.int64, count=len(self._buffer))
+        sources = np.concatenate([sources, keys >> _TARGET_BITS])
+        targets = np.concatenate([targets, keys & _TARGET_MASK])
+        relation = np.concatenate([self._relation, np.fromiter(self._buffer.values(), dtype=np.int32,
+                                                               count=len(self._buffer))])
+        order = np.argsort(sources, kind="stable")
+        sources, targets, relation = sources[order], targets[order], relation[order]
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+        self._set_arrays(indptr, sources, targets, relation)
+        self._clear_buffer()
+
+    def edges(self, data=False) -> Iterator:
+        """``(source, target)`` pairs, or ``(source, target, value)`` with ``data="relation"`` or ``True``."""
+        names, labels = self.names, self.relations
+        for source in range(len(names)):
+            ids, relations = self._neighbour_relations(source, "out")
+            if data is False:
+                for target in ids:
+                    yield names[source], names[target]
+            elif data is True:
+                for target, relation in zip(ids, relations):
+                    yield names[source], names[target], self._edge_data(relation)
+            else:
+                for target, relation in zip(ids, relations):
+                    yield names[source], names[target], labels[relation] if data == "relation" else None
+
+    def to_networkx(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes(data=True))
+        graph.add_edges_from(self.edges(data=True))
+        return graph
+
+    # Snapshots: the same string tables and CSR arrays as ``graphlog.encode_graph``
+
+    def encode(self) -> dict:
+        self._merge()
+        return {"names": list(self.names), "types": list(self.types), "relations": list(self.relations),
+                "node_type": np.frombuffer(self.node_type, dtype=np.int32).copy(), "indptr": self._indptr,
+                "indices": self._indices, "edge_relation": self._relation}
+
+    @classmethod
+    def from_encoded(cls, encoded: dict) -> "CompactGraph":
+        graph = cls()
+        graph.names = list(encoded["names"])
+        graph._ids = {name: i for i, name in enumerate(graph.names)}
+        for value in encoded["types"]:
+            _intern(graph.types, graph._type_ids, value)
+        for value in encoded["relations"]:
+            _intern(graph.relations, graph._relation_ids, value)
+        graph.node_type = array("i", np.asarray(encoded["node_type"], dtype=np.int32).tobytes())
+        for node, type_id in enumerate(graph.node_type):
+            graph._type_position.append(graph._add_member(type_id, node))
+
+        indptr = np.array(encoded["indptr"], dtype=np.int64)
+        sources = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+        relation = np.array(encoded["edge_relation"], dtype=np.int32)
+        graph._set_arrays(indptr, sources, np.array(encoded["indices"], dtype=np.int64), relation)
+        graph._source_keys = np.unique((relation.astype(np.int64) << _TARGET_BITS) | sources)
+        for relation_id in range(len(graph.relations)):
+            start, end = np.searchsorted(graph._source_keys, [relation_id << _TARGET_BITS,
+                                                              (relation_id + 1) << _TARGET_BITS])
+            if end > start:
+                unique = graph._source_keys[start:end] & _TARGET_MASK
+                graph._relation_sources[relation_id] = array("i", unique.astype(np.int32).tobytes())
+        return graph
@@ -0,0 +1,375 @@
+"""Durable storage for the knowledge graph: a write-ahead log plus binary snapshots.
+
+Every mutation is appended to the active log segment as one JSON line before it is
+applied in memory. Periodically the whole graph is written as a snapshot of
+memory-mappable arrays (interned string tables plus a CSR adjacency) and the log
+is rotated, so recovery loads the latest snapshot and replays only the segments
+written after it. Several worker processes can share one directory: appends are
+serialized with a file lock and each process replays records written by the
+others before it reads or writes.
+
+Layout of the data directory::
+
+    CURRENT                 generation of the latest snapshot
+    wal-00000003.log        mutations since snapshot 3
+    snapshot-00000003/      meta.json, *.json string tables, *.npy arrays
+"""
+from contextlib import contextmanager
+from typing import List, Optional
+import json
+import os
+import shutil
+import networkx as nx
+import numpy as np
+from compactgraph import CompactGraph
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single writer process is assumed
+    fcntl = None
+
+SNAPSHOT_FORMAT = 1
+
+
+class SnapshotError(RuntimeError):
+    """A snapshot is missing or damaged, e.g. by a crash while it was written without fsync."""
+
+
+class LogBehindError(RuntimeError):
+    """This process missed log segments that were compacted away; it must ``recover``."""
+
+
+def apply_record(graph, record: dict) -> None:
+    """Apply one log record to an ``nx.DiGraph`` or ``CompactGraph``."""
+    op = record["op"]
+    if op == "add_nodes":
+        graph.add_nodes_from((name, {"type": node_type}) for name, node_type in record["nodes"])
+    elif op == "add_edges":
+        graph.add_edges_from((source, target, {"relation": relation}) for source, target, relation in record["edges"])
+    elif op == "bulk":
+        graph.add_nodes_from((name, {"type": node_type}) for name, node_type in record["nodes"])
+        graph.add_edges_from((source, target, {"relation": relation}) for source, target, relation in record["edges"])
+    elif op == "clear":
+        graph.clear()
+    else:
+        raise ValueError(f"Unknown graph log operation: {op}")
+
+
+def _intern(table: dict, value) -> int:
+    index = table.get(value)
+    if index is None:
+        index = table[value] = len(table)
+    return index
+
+
+def encode_graph(graph) -> dict:
+    """Encode the graph as string tables and CSR arrays (``indptr``/``indices`` per source node)."""
+    if isinstance(graph, CompactGraph):
+        return graph.encode()
+    names = list(graph.nodes)
+    ids = {name: i for i, name in enumerate(names)}
+    types, relations = {}, {}
+
+    node_type = np.fromiter((_intern(types, data.get("type")) for _, data in graph.nodes(data=True)),
+                            dtype=np.int32, count=len(names))
+    indptr = np.zeros(len(names) + 1, dtype=np.int64)
+    indices = np.empty(graph.number_of_edges(), dtype=np.int32)
+    edge_relation = np.empty(graph.number_of_edges(), dtype=np.int32)
+    position = 0
+    for i, name in enumerate(names):
+        for target, data in graph.adj[name].items():
+            indices[position] = ids[target]
+            edge_relation[position] = _intern(relations, data.get("relation"))
+            position += 1
+        indptr[i + 1] = position
+
+    return {
+        "names": names,
+        "types": list(types),
+        "relations": list(relations),
+        "node_type": node_type,
+        "indptr": indptr,
+        "indices": indices,
+        "edge_relation": edge_relation,
+    }
+
+
+def decode_graph(encoded: dict, graph_class=nx.DiGraph):
+    if graph_class is CompactGraph:
+        return CompactGraph.from_encoded(encoded)
+    names, types, relations = encoded["names"], encoded["types"], encoded["relations"]
+    indptr, indices, edge_relation = encoded["indptr"], encoded["indices"], encoded["edge_relation"]
+
+    graph = nx.DiGraph()
+    graph.add_nodes_from((name, {"type": types[t]}) for name, t in zip(names, encoded["node_type"].tolist()))
+    sources = np.repeat(np.arange(len(names)), np.diff(indptr))
+    graph.add_edges_from((names[s], names[t], {"relation": relations[r]})
+                         for s, t, r in zip(sources.tolist(), indices.tolist(), edge_relation.tolist()))
+    return graph
+
+
+def _write_json(path: str, value) -> None:
+    with open(path, "w") as f:
+        json.dump(value, f)
+
+
+def _fsync(path: str) -> None:
+    """Flush a file, or a directory's entries, to disk."""
+    if os.path.isdir(path) and os.name == "nt":
+        return  # directories cannot be opened for fsync on Windows
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GraphLog:
+    def __init__(self, directory: str, fsync: bool = True):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.generation = 0  # segment this process has read up to
+        self.offset = 0  # byte offset of the next unread record in that segment
+        self.records_since_snapshot = 0
+        # ``clear`` records in the log up to our position, snapshots included; the same in every process
+        self.clears = 0
+        # Snapshot this process last loaded or wrote; kept, with the segments after it, by compaction
+        self.loaded_generation = 0
+
+    def _segment_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:08d}.log")
+
+    def _snapshot_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"snapshot-{generation:08d}")
+
+    @contextmanager
+    def _locked(self, name: str = "wal.lock"):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, name), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _current_generation(self) -> int:
+        try:
+            with open(os.path.join(self.directory, "CURRENT")) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def load_snapshot(self, generation: int, graph_class=nx.DiGraph):
+        """Load snapshot ``generation``; raises ``SnapshotError`` if it is missing or damaged.
+
+        Generation 0 is the empty graph the log starts from.
+        """
+        path = self._snapshot_path(generation)
+        if generation == 0 and not os.path.isdir(path):
+            return graph_class()
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                meta = json.load(f)
+            encoded = {}
+            for table in ("names", "types", "relations"):
+                with open(os.path.join(path, f"{table}.json")) as f:
+                    encoded[table] = json.load(f)
+            for array in ("node_type", "indptr", "indices", "edge_relation"):
+                encoded[array] = np.load(os.path.join(path, f"{array}.npy"), mmap_mode="r")
+            if (meta.get("nodes") != len(encoded["names"]) or meta.get("edges") != len(encoded["indices"])
+                    or len(encoded["indptr"]) != len(encoded["names"]) + 1):
+                raise ValueError("sizes do not match meta.json")
+            return decode_graph(encoded, graph_class)
+        except (OSError, EOFError, ValueError, IndexError, KeyError) as e:
+            raise SnapshotError(f"Snapshot {generation} cannot be loaded: {e}") from e
+
+    def _snapshot_clears(self, generation: int) -> int:
+        try:
+            with open(os.path.join(self._snapshot_path(generation), "meta.json")) as f:
+                return int(json.load(f).get("clears", 0))
+        except (OSError, ValueError):
+            return 0
+
+    def _count(self, records: List[dict]) -> None:
+        self.records_since_snapshot += len(records)
+        self.clears += sum(1 for record in records if record["op"] == "clear")
+
+    def _read_segment(self, generation: int, offset: int):
+        """Return ``(records, new_offset)``, ignoring a trailing line that is still being written."""
+        try:
+            with open(self._segment_path(generation), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        end = data.rfind(b"\n") + 1
+        records = [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+        return records, offset + end
+
+    def _drop_torn_tail_locked(self) -> None:
+        """Cut a partial last line left by a writer that crashed mid-append.
+
+        Otherwise the next append would be glued onto the fragment and the segment
+        could no longer be decoded. Call with the lock held, after reading the
+        active segment up to its last complete record.
+        """
+        path = self._segment_path(self.generation)
+        try:
+            if os.path.getsize(path) > self.offset:
+                os.truncate(path, self.offset)
+        except FileNotFoundError:
+            pass
+
+    def recover(self, graph_class=nx.DiGraph):
+        """Load the latest snapshot into a new ``graph_class`` and replay every log segment written after it."""
+        with self._locked():
+            self.generation = self._current_generation()
+            while True:
+                try:
+                    graph = self.load_snapshot(self.generation, graph_class)
+                    break
+                except SnapshotError:
+                    # Fall back to an older snapshot while the log segments after it are still there
+                    if self.generation == 0 or not os.path.exists(self._segment_path(self.generation - 1)):
+                        raise
+                    self.generation -= 1
+            self.loaded_generation = self.generation
+            self.offset = 0
+            self.records_since_snapshot = 0
+            self.clears = self._snapshot_clears(self.generation)
+            while True:
+                records, self.offset = self._read_segment(self.generation, self.offset)
+                for record in records:
+                    apply_record(graph, record)
+                self._count(records)
+                if not os.path.exists(self._segment_path(self.generation + 1)):
+                    self._drop_torn_tail_locked()
+                    return graph
+                self.generation += 1
+                self.offset = 0
+
+    def _read_new_locked(self) -> Optional[List[dict]]:
+        records = []
+        while True:
+            if (not os.path.exists(self._segment_path(self.generation))
+                    and self._current_generation() > self.generation):
+                # Another process compacted past a segment we never read; start over from its snapshot
+                return None
+            new, self.offset = self._read_segment(self.generation, self.offset)
+            records.extend(new)
+            if not os.path.exists(self._segment_path(self.generation + 1)):
+                break
+            self.generation += 1
+            self.offset = 0
+        self._count(records)
+        return records
+
+    def has_new_records(self) -> bool:
+        """Cheap check (two ``stat`` calls) for writes by other processes."""
+        try:
+            if os.path.getsize(self._segment_path(self.generation)) > self.offset:
+                return True
+        except FileNotFoundError:
+            return self._current_generation() > self.generation
+        return os.path.exists(self._segment_path(self.generation + 1))
+
+    def read_new(self) -> Optional[List[dict]]:
+        """Records other processes appended since we last read; ``None`` means call ``recover``."""
+        with self._locked():
+            return self._read_new_locked()
+
+    def append(self, record: dict) -> List[dict]:
+        """Durably append ``record`` and return the records other processes wrote before it.
+
+        The caller applies the returned records first, then its own, so every process
+        applies mutations in log order. Raises ``LogBehindError`` without writing if
+        this process must ``recover`` first.
+        """
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._locked():
+            others = self._read_new_locked()
+            if others is None:
+                raise LogBehindError("Graph log was compacted past this process's position.")
+            self._drop_torn_tail_locked()
+            with open(self._segment_path(self.generation), "ab") as f:
+                f.write(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self.offset += len(line)
+            self._count([record])
+            return others
+
+    def write_snapshot(self, graph, apply=apply_record) -> Optional[int]:
+        """Snapshot ``graph`` and rotate the log; returns the new generation.
+
+        Runs on the caller's thread and costs time proportional to the graph, holding
+        the log lock (and the store's lock, when called through ``GraphStore``).
+        ``graph`` must reflect every record this process has read. Records other
+        processes appended since are passed to ``apply`` first so the snapshot covers
+        the whole log. Returns ``None`` if this process fell too far behind to
+        snapshot, in which case it should ``recover``.
+        """
+        with self._locked():
+            others = self._read_new_locked()
+            if others is None:
+                return None
+            for record in others:
+                apply(record)
+            generation = self.generation + 1
+            encoded = encode_graph(graph)
+            path = self._snapshot_path(generation)
+            tmp_path = path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            for table in ("names", "types", "relations"):
+                _write_json(os.path.join(tmp_path, f"{table}.json"), encoded[table])
+            for array in ("node_type", "indptr", "indices", "edge_relation"):
+                np.save(os.path.join(tmp_path, f"{array}.npy"), encoded[array])
+            _write_json(os.path.join(tmp_path, "meta.json"), {
+                "format": SNAPSHOT_FORMAT, "generation": generation,
+                "nodes": len(encoded["names"]), "edges": len(encoded["indices"]), "clears": self.clears,
+            })
+            if self.fsync:
+                for name in os.listdir(tmp_path):
+                    _fsync(os.path.join(tmp_path, name))
+                _fsync(tmp_path)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+
+            # Start the next segment before publishing the snapshot that expects it
+            open(self._segment_path(generation), "ab").close()
+            current_tmp = os.path.join(self.directory, "CURRENT.tmp")
+            with open(current_tmp, "w") as f:
+                f.write(str(generation))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if self.fsync:
+                # The snapshot directory and the new segment must be on disk before CURRENT names them
+                _fsync(self.directory)
+            os.replace(current_tmp, os.path.join(self.directory, "CURRENT"))
+            if self.fsync:
+                _fsync(self.directory)
+
+            # Keep one generation back (or the last one known to load, if older) so processes
+            # lagging by a segment can still catch up and a damaged snapshot can be skipped
+            keep_from = min(self.generation, self.loaded_generation)
+            self.generation = generation
+            self.loaded_generation = generation
+            self.offset = 0
+            self.records_since_snapshot = 0
+
+            for name in os.listdir(self.directory):
+                if name.startswith(("wal-", "snapshot-")) and not name.endswith(".tmp"):
+                    stem = name.split("-", 1)[1].split(".", 1)[0]
+                    if stem.isdigit() and int(stem) < keep_from:
+                        target = os.path.join(self.directory, name)
+                        if os.path.isdir(target):
+                            shutil.rmtree(target, ignore_errors=True)
+                        else:
+                            os.remove(target)
+            return generation
@@ -0,0 +1,274 @@
+"""Path and reachability queries over the knowledge graph.
+
+Answers questions such as "which regulations apply to product X exported to country
+Y" without dumping the graph: shortest path, all simple paths up to a length, and
+the entities of a type reachable from an entity through a set of relations.
+
+Outgoing traversals restricted to some relations walk the store's per-relation
+adjacency index, so they never look at edges of other relations. Reachability sets
+(the transitive closure from one source) are cached by graph version and shared by
+queries that differ only in the target type; any mutation invalidates them.
+Each query holds the store lock from its entity checks through the traversal, so
+the graph cannot change under it, and checks a deadline so a runaway query gives up with ``QueryTimeoutError`` instead of
+blocking writers.
+"""
+from collections import deque
+from itertools import chain
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+import os
+import threading
+import time
+from cache import InMemoryBackend
+from graphstore import EntityNotFoundError
+
+GRAPH_QUERY_TIMEOUT = float(os.getenv("GRAPH_QUERY_TIMEOUT", "5"))
+# Reachability results kept for the current graph version
+GRAPH_QUERY_CACHE_SIZE = int(os.getenv("GRAPH_QUERY_CACHE_SIZE", "1024"))
+MAX_PATHS = 100
+DIRECTIONS = ("out", "in", "both")
+REVERSE = {"out": "in", "in": "out", "both": "both"}
+
+# Traversal steps between deadline checks
+_CHECK_EVERY = 1024
+
+Neighbours = Callable[[str], Iterable[str]]
+
+
+class QueryTimeoutError(TimeoutError):
+    """A graph query ran past its deadline."""
+
+
+class _Deadline:
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+        self.steps = 0
+
+    def tick(self):
+        self.steps += 1
+        if self.steps % _CHECK_EVERY == 0 and time.monotonic() > self.expires_at:
+            raise QueryTimeoutError("Graph query timed out.")
+
+
+class GraphQueryEngine:
+    def __init__(self, store, timeout: float = GRAPH_QUERY_TIMEOUT, cache_size: int = GRAPH_QUERY_CACHE_SIZE):
+        self.store = store
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._version = None
+        self._results = InMemoryBackend(max_entries=cache_size, ttl=float("inf"))
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+    def _sync(self) -> int:
+        """Drop cached results if the graph changed; returns the current version."""
+        self.store.refresh()
+        version = self.store.version
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._results.clear()
+                    self._version = version
+        return version
+
+    def _cached(self, key):
+        value = self._results.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def neighbours(self, relations: Optional[FrozenSet[str]], direction: str) -> Neighbours:
+        """Function from a node to its neighbours over ``relations`` edges (all when ``None``).
+
+        Must be called and used with the store lock held.
+        """
+        graph = self.store.graph
+        if direction == "both":
+            outgoing, incoming = self.neighbours(relations, "out"), self.neighbours(relations, "in")
+            return lambda node: chain(outgoing(node), incoming(node))
+        if relations is None:
+            adjacency = graph.succ if direction == "out" else graph.pred
+            return adjacency.__getitem__
+        if direction == "in":
+            return lambda node: [source for source, data in graph.pred[node].items()
+                                 if data.get("relation") in relations]
+
+        indexes = [self.store.relation_index[r] for r in relations if r in self.store.relation_index]
+        if len(indexes) == 1:
+            index = indexes[0]
+            return lambda node: index.get(node, ())
+        return lambda node: chain.from_iterable(index.get(node, ()) for index in indexes)
+
+    def _prepare(self, entities: Sequence[str], relations: Optional[Sequence[str]], direction: str):
+        """Validate a query and read the graph version; call with the store lock held."""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {', '.join(DIRECTIONS)}.")
+        version = self._sync()
+        for entity in entities:
+            if entity not in self.store.graph:
+                raise EntityNotFoundError(f"Entity not found: {entity}")
+        return version, frozenset(relations) if relations else None, _Deadline(self.timeout)
+
+    def _timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def shortest_path(self, source: str, target: str, relations: Sequence[str] = None,
+                      direction: str = "out") -> Optional[List[str]]:
+        """Fewest-hops path from ``source`` to ``target``, or ``None`` if there is none.
+
+        Searches breadth-first from both ends at once, always expanding the smaller
+        frontier, so it visits far fewer nodes than a one-sided search.
+        """
+        with self.store.lock:
+            _, relations, deadline = self._prepare((source, target), relations, direction)
+            if source == target:
+                return [source]
+            forward, backward = self.neighbours(relations, direction), self.neighbours(relations, REVERSE[direction])
+            parents, children = {source: None}, {target: None}
+            forward_fringe, backward_fringe = [source], [target]
+            try:
+                while forward_fringe and backward_fringe:
+                    if len(forward_fringe) <= len(backward_fringe):
+                        fringe, forward_fringe = forward_fringe, []
+                        for node in fringe:
+                            for neighbour in forward(node):
+                                deadline.tick()
+                                if neighbour not in parents:
+                                    parents[neighbour] = node
+                                    forward_fringe.append(neighbour)
+                                if neighbour in children:
+                                    return _join(neighbour, parents, children)
+                    else:
+                        fringe, backward_fringe = backward_fringe, []
+                        for node in fringe:
+                            for neighbour in backward(node):
+                                deadline.tick()
+                                if neighbour not in children:
+                                    children[neighbour] = node
+                                    backward_fringe.append(neighbour)
+                                if neighbour in parents:
+                                    return _join(neighbour, parents, children)
+            except QueryTimeoutError:
+                self._timed_out()
+                raise
+        return None
+
+    def all_paths(self, source: str, target: str, max_length: int = 3, relations: Sequence[str] = None,
+                  direction: str = "out", limit: int = MAX_PATHS) -> Tuple[List[List[str]], bool]:
+        """Simple paths of at most ``max_length`` edges, shortest first; ``(paths, truncated)``."""
+        paths = []
+        with self.store.lock:
+            _, relations, deadline = self._prepare((source, target), relations, direction)
+            neighbours = self.neighbours(relations, direction)
+            # Depth-first with an explicit stack of neighbour iterators; ``on_path`` keeps paths simple
+            path, on_path = [source], {source}
+            stack = [iter(neighbours(source))]
+            try:
+                while stack:
+                    neighbour = next(stack[-1], None)
+                    if neighbour is None:
+                        stack.pop()
+                        on_path.discard(path.pop())
+                        continue
+                    deadline.tick()
+                    if neighbour in on_path:
+                        continue
+                    if neighbour == target:
+                        paths.append(path + [target])
+                        # One path past the limit is enough to report the result as truncated
+                        if len(paths) > limit:
+                            break
+                    elif len(path) < max_length:
+                        path.append(neighbour)
+                        on_path.add(neighbour)
+                        stack.append(iter(neighbours(neighbour)))
+            except QueryTimeoutError:
+                self._timed_out()
+                raise
+        paths.sort(key=len)
+        return paths[:limit], len(paths) > limit
+
+    def reachable_from(self, source: str, relations: Sequence[str] = None, direction: str = "out",
+                       max_depth: int = None) -> Dict[str, int]:
+        """Hop distance of every entity reachable from ``source``, memoized per graph version."""
+        with self.store.lock:
+            version, relations, deadline = self._prepare((source,), relations, direction)
+            key = (version, "reachable", source, relations, direction, max_depth)
+            distances = self._cached(key)
+            if distances is not None:
+                return distances
+
+            distances = {source: 0}
+            queue = deque([source])
+            neighbours = self.neighbours(relations, direction)
+            try:
+                while queue:
+                    node = queue.popleft()
+                    depth = distances[node]
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    for neighbour in neighbours(node):
+                        deadline.tick()
+                        if neighbour not in distances:
+                            distances[neighbour] = depth + 1
+                            queue.append(neighbour)
+            except QueryTimeoutError:
+                self._timed_out()
+                raise
+            del distances[source]
+            self._results.set(key, distances)
+        return distances
+
+    def reachable(self, source: str, node_type: str = None, relations: Sequence[str] = None,
+                  direction: str = "out", max_depth: int = None) -> List[dict]:
+        """Entities of ``node_type`` (any type when ``None``) reachable from ``source``, nearest first."""
+        with self.store.lock:
+            version = self._sync()
+            key = (version, "typed", source, node_type, frozenset(relations) if relations else None, direction,
+                   max_depth)
+            results = self._cached(key)
+            if results is not None:
+                return results
+
+            # Re-entrant: the distances and the types below come from the same graph version
+            distances = self.reachable_from(source, relations, direction, max_depth)
+            nodes = self.store.graph.nodes
+            results = []
+            for name, distance in distances.items():
+                entity_type = nodes[name].get("type")
+                if node_type is None or entity_type == node_type:
+                    results.append({"name": name, "type": entity_type, "distance": distance})
+            self._results.set(key, results)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "graph_version": self._version,
+                "cached_results": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "timeouts": self.timeouts,
+                "timeout_seconds": self.timeout,
+            }
+
+
+def _join(meeting: str, parents: Dict[str, Optional[str]], children: Dict[str, Optional[str]]) -> List[str]:
+    """Path through ``meeting`` from the forward search's root to the backward search's root."""
+    path = []
+    node = meeting
+    while node is not None:
+        path.append(node)
+        node = parents[node]
+    path.reverse()
+    node = children[meeting]
+    while node is not None:
+        path.append(node)
+        node = children[node]
+    return path
@@ -0,0 +1,413 @@
+from collections import deque
+from itertools import chain, islice
+from typing import Dict, Iterator, List, Optional
+import base64
+import json
+import os
+import threading
+import networkx as nx
+from compactgraph import CompactGraph
+from graphlog import GraphLog, LogBehindError, apply_record
+
+# Directory for the write-ahead log and snapshots; empty keeps the graph in memory only
+GRAPH_DATA_DIR = os.getenv("GRAPH_DATA_DIR", "graph_data")
+# Log records between automatic snapshots. The write that reaches the count takes the
+# snapshot on its own request thread, a pause proportional to the graph size
+GRAPH_SNAPSHOT_EVERY = int(os.getenv("GRAPH_SNAPSHOT_EVERY", "1000"))
+GRAPH_WAL_FSYNC = os.getenv("GRAPH_WAL_FSYNC", "1") != "0"
+# In-memory representation: "networkx" (a DiGraph) or "compact" (interned ids and CSR arrays)
+GRAPH_CORE = os.getenv("GRAPH_CORE", "networkx")
+GRAPH_CORES = {"networkx": nx.DiGraph, "compact": CompactGraph}
+
+
+class EntityNotFoundError(LookupError):
+    """A relation refers to an entity that is not in the graph."""
+
+
+class CursorError(ValueError):
+    """A pagination cursor is malformed or belongs to a graph that has since been cleared."""
+
+
+class BulkValidationError(ValueError):
+    """A strict bulk load found invalid rows; nothing was applied."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+class GraphStore:
+    """The compliance knowledge graph plus a version counter bumped on every mutation.
+
+    Anything derived from the graph (layouts, rendered images, query results) can be
+    cached against ``version`` and is stale as soon as the number changes. With a
+    ``GraphLog`` every mutation is logged before it is applied and the graph is
+    recovered from disk on construction.
+
+    Nodes are also indexed by ``type`` and edges by ``relation``, and node insertion
+    order is kept in a list, so filtered and paginated reads touch only the rows they
+    return. ``epoch`` counts ``clear`` calls and invalidates outstanding cursors; with a
+    log it is the number of clears in the log, so every process sharing it agrees.
+
+    Listeners registered with ``subscribe`` are called with every applied log record,
+    including records replayed from other processes, to keep derived indexes current.
+
+    ``core="compact"`` keeps the graph in a ``CompactGraph``, which maintains the type
+    and relation indexes itself, in a fraction of the memory; ``snapshot`` converts it
+    to a DiGraph for the NetworkX algorithms that need one.
+    """
+
+    def __init__(self, log: GraphLog = None, snapshot_every: int = GRAPH_SNAPSHOT_EVERY, core: str = GRAPH_CORE):
+        if core not in GRAPH_CORES:
+            raise ValueError(f"Unknown graph core {core!r}; expected one of {', '.join(GRAPH_CORES)}.")
+        self.log = log
+        self.snapshot_every = snapshot_every
+        self.graph_class = GRAPH_CORES[core]
+        self.compact = core == "compact"
+        self.graph = self.graph_class()
+        self._networkx = None  # (version, DiGraph) converted from the compact core
+        self.version = 0
+        self.epoch = 0
+        self.lock = threading.RLock()
+        self._listeners = []
+        self._reset_indexes()
+        if log is not None:
+            self._recover()
+
+    def _recover(self):
+        self.graph = self.log.recover(self.graph_class)
+        self._reset_indexes()
+        self.epoch = self.log.clears
+        if not self.compact:
+            self._node_list.extend(self.graph)
+            for name, node_type in self.graph.nodes(data="type"):
+                if node_type is not None:
+                    self.type_index.setdefault(node_type, {})[name] = None
+            for source, target, relation in self.graph.edges(data="relation"):
+                self.relation_index.setdefault(relation, {}).setdefault(source, {})[target] = None
+        self.version += 1
+        for listener in self._listeners:
+            self._replay(listener)
+
+    def _replay(self, listener):
+        """Bring ``listener`` in line with the current graph: a clear followed by everything in it."""
+        listener({"op": "clear"})
+        listener({"op": "bulk", "nodes": [[name, node_type] for name, node_type in self.graph.nodes(data="type")],
+                  "edges": [[source, target, relation] for source, target, relation in self.graph.edges(data="relation")]})
+
+    def subscribe(self, listener):
+        """Call ``listener(record)`` for every mutation from now on, after replaying the current graph."""
+        with self.lock:
+            self._replay(listener)
+            self._listeners.append(listener)
+
+    def _reset_indexes(self):
+        if self.compact:
+            self._node_list = self.graph.names
+            self.type_index = self.graph.type_index
+            self.relation_index = self.graph.relation_index
+            return
+        self._node_list: List[str] = []
+        # Dicts with None values serve as insertion-ordered sets
+        self.type_index: Dict[str, Dict[str, None]] = {}
+        # relation -> source -> targets: a per-relation adjacency that queries can walk directly
+        self.relation_index: Dict[str, Dict[str, Dict[str, None]]] = {}
+
+    def _apply(self, record: dict):
+        if record["op"] == "clear":
+            apply_record(self.graph, record)
+            self._reset_indexes()
+            self.epoch += 1
+        elif self.compact:
+            apply_record(self.graph, record)
+        else:
+            self._apply_indexed(record)
+        self.version += 1
+        for listener in self._listeners:
+            listener(record)
+
+    def _apply_indexed(self, record: dict):
+        """Apply ``record`` to the DiGraph and update the type and relation indexes for it."""
+        graph = self.graph
+        nodes = record.get("nodes", ())
+        edges = record.get("edges", ())
+        old_types = {name: graph.nodes[name].get("type") for name, _ in nodes if name in graph}
+        old_relations = {(source, target): graph.adj[source][target].get("relation")
+                         for source, target, _ in edges if source in graph and target in graph.adj[source]}
+        touched = dict.fromkeys(chain((name for name, _ in nodes),
+                                      (node for source, target, _ in edges for node in (source, target))))
+        new_nodes = [name for name in touched if name not in graph]
+
+        apply_record(graph, record)
+
+        self._node_list.extend(new_nodes)
+        for name in dict.fromkeys(name for name, _ in nodes):
+            old_type, new_type = old_types.get(name), graph.nodes[name].get("type")
+            if old_type != new_type or name not in old_types:
+                if old_type is not None:
+                    self.type_index.get(old_type, {}).pop(name, None)
+                self.type_index.setdefault(new_type, {})[name] = None
+        for source, target, _ in edges:
+            key = (source, target)
+            old_relation, new_relation = old_relations.get(key), graph.adj[source][target].get("relation")
+            if old_relation != new_relation or key not in old_relations:
+                if key in old_relations:
+                    self.relation_index[old_relation][source].pop(target, None)
+                self.relation_index.setdefault(new_relation, {}).setdefault(source, {})[target] = None
+
+    def _commit(self, record: dict):
+        """Log ``record`` (after replaying anything other processes logged first) and apply it."""
+        if self.log is not None:
+            try:
+                others = self.log.append(record)
+            except LogBehindError:
+                self._recover()
+                others = self.log.append(record)
+            for other in others:
+                self._apply(other)
+        self._apply(record)
+        if self.log is not None and self.log.records_since_snapshot >= self.snapshot_every:
+            self.checkpoint()
+
+    def refresh(self):
+        """Pick up mutations other worker processes wrote to the shared log."""
+        if self.log is None or not self.log.has_new_records():
+            return
+        with self.lock:
+            records = self.log.read_new()
+            if records is None:
+                self._recover()
+            else:
+                for record in records:
+                    self._apply(record)
+
+    def checkpoint(self):
+        """Write a compact snapshot to disk and start a new log segment.
+
+        Other reads and writes of this store wait until the snapshot is written.
+        """
+        if self.log is None:
+            return
+        with self.lock:
+            if self.log.write_snapshot(self.graph, self._apply) is None:
+                self._recover()
+
+    def add_entities(self, entities) -> int:
+        with self.lock:
+            self._commit({"op": "add_nodes", "nodes": [[entity.name, entity.type] for entity in entities]})
+        return len(entities)
+
+    def add_relations(self, relations) -> int:
+        """Add relations in order; stops with ``EntityNotFoundError`` at the first unknown endpoint.
+
+        Relations before the failing one are kept, as they were before the graph was persisted.
+        """
+        with self.lock:
+            self.refresh()
+            edges = []
+            missing = None
+            for relation in relations:
+                if not self.graph.has_node(relation.source) or not self.graph.has_node(relation.target):
+                    missing = EntityNotFoundError("Source or target entity not found.")
+                    break
+                edges.append([relation.source, relation.target, relation.relation])
+            if edges:
+                self._commit({"op": "add_edges", "edges": edges})
+            if missing is not None:
+                raise missing
+        return len(relations)
+
+    def bulk_load(self, entities, relations, lenient: bool = False, errors=None) -> dict:
+        """Validate a whole payload in one set-based pass, then apply it as a single log record.
+
+        ``entities`` holds ``(row, name, type)`` and ``relations`` ``(row, source, target,
+        relation)`` tuples; relation endpoints may be existing entities or entities in the
+        same payload. ``errors`` carries rows the caller already rejected while parsing. In
+        strict mode any error raises ``BulkValidationError`` and the graph is untouched;
+        with ``lenient`` the valid rows are applied and the errors reported.
+        """
+        errors = list(errors or [])
+        with self.lock:
+            self.refresh()
+            names = {name for _, name, _ in entities}
+            endpoints = {node for _, source, target, _ in relations for node in (source, target)} - names
+            unknown = {node for node in endpoints if not self.graph.has_node(node)}
+
+            edges = []
+            for row, source, target, relation in relations:
+                if source in unknown or target in unknown:
+                    missing = source if source in unknown else target
+                    errors.append({"row": row, "error": f"Unknown entity: {missing}"})
+                else:
+                    edges.append([source, target, relation])
+
+            if errors and not lenient:
+                raise BulkValidationError(errors)
+            self._commit({"op": "bulk", "nodes": [[name, node_type] for _, name, node_type in entities],
+                          "edges": edges})
+        return {"entities": len(entities), "relations": len(edges), "errors": errors}
+
+    def clear(self) -> None:
+        with self.lock:
+            self._commit({"op": "clear"})
+
+    def snapshot(self):
+        """Return ``(version, DiGraph copy of the graph)`` taken atomically, safe to use without the lock.
+
+        The conversion from the compact core is cached until the next mutation, so
+        callers must treat that copy as read-only.
+        """
+        self.refresh()
+        with self.lock:
+            if not self.compact:
+                return self.version, self.graph.copy()
+            if self._networkx is None or self._networkx[0] != self.version:
+                self._networkx = (self.version, self.graph.to_networkx())
+            return self._networkx
+
+    def _node_record(self, name) -> dict:
+        return {"name": name, **self.graph.nodes[name]}
+
+    def _edge_record(self, source, target) -> dict:
+        return {"source": source, "target": target, "relation": self.graph.adj[source][target].get("relation")}
+
+    def _decode_cursor(self, cursor: Optional[str]):
+        if not cursor:
+            return 0, 0
+        try:
+            epoch, first, second = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            first, second = int(first), int(second)
+        except (ValueError, TypeError):
+            raise CursorError("Malformed cursor.")
+        if first < 0 or second < 0:
+            raise CursorError("Malformed cursor.")
+        if epoch != self.epoch:
+            raise CursorError("Cursor expired: the graph was cleared.")
+        return first, second
+
+    def _encode_cursor(self, first: int, second: int = 0) -> str:
+        return base64.urlsafe_b64encode(json.dumps([self.epoch, first, second]).encode("ascii")).decode("ascii")
+
+    def page_nodes(self, node_type: str = None, cursor: str = None, limit: int = 1000) -> dict:
+        """One page of nodes in insertion order, optionally only those of ``node_type``."""
+        self.refresh()
+        with self.lock:
+            position, _ = self._decode_cursor(cursor)
+            if node_type is None:
+                names = self._node_list[position:position + limit]
+                total = len(self._node_list)
+            else:
+                members = self.type_index.get(node_type, {})
+                names = list(islice(members, position, position + limit))
+                total = len(members)
+            end = position + len(names)
+            return {"nodes": [self._node_record(name) for name in names],
+                    "next_cursor": self._encode_cursor(end) if end < total else None}
+
+    def page_edges(self, relation: str = None, cursor: str = None, limit: int = 1000) -> dict:
+        """One page of edges, optionally only those labelled ``relation``.
+
+        Pages walk source nodes in insertion order; the cursor records the source
+        position and the offset into its targets, both stable under inserts.
+        """
+        self.refresh()
+        with self.lock:
+            first, second = self._decode_cursor(cursor)
+            if relation is not None:
+                adjacency = self.relation_index.get(relation, {})
+                sources = islice(adjacency, first, None)
+            else:
+                adjacency = self.graph.adj
+                sources = (self._node_list[i] for i in range(first, len(self._node_list)))
+
+            edges = []
+            position, offset = first, second
+            for source in sources:
+                targets = adjacency[source]
+                # (target, label) pairs read along with the targets, not looked up per edge
+                labelled = (((target, relation) for target in targets) if relation is not None else
+                            ((target, data.get("relation")) for target, data in targets.items()))
+                for target, label in islice(labelled, offset, offset + limit - len(edges)):
+                    edges.append({"source": source, "target": target, "relation": label})
+                    offset += 1
+                if offset < len(targets):
+                    break
+                position += 1
+                offset = 0
+                if len(edges) >= limit:
+                    break
+            more = position < len(adjacency)
+            return {"edges": edges, "next_cursor": self._encode_cursor(position, offset) if more else None}
+
+    def filtered(self, node_type: str = None, relation: str = None) -> dict:
+        """All nodes of ``node_type`` and edges labelled ``relation``, read from the indexes."""
+        self.refresh()
+        with self.lock:
+            names = self._node_list if node_type is None else self.type_index.get(node_type, {})
+            if relation is None:
+                edges = [{"source": source, "target": target, "relation": label}
+                         for source, target, label in self.graph.edges(data="relation")]
+            else:
+                edges = [{"source": source, "target": target, "relation": relation}
+                         for source, targets in self.relation_index.get(relation, {}).items() for target in targets]
+            return {"nodes": [self._node_record(name) for name in names], "edges": edges}
+
+    def iter_ndjson(self, node_type: str = None, relation: str = None, page_size: int = 1000) -> Iterator[str]:
+        """Stream nodes then edges as NDJSON lines, holding the lock for one page at a time."""
+        try:
+            for kind, page in (("node", self.page_nodes), ("edge", self.page_edges)):
+                cursor = None
+                while True:
+                    result = page(node_type if kind == "node" else relation, cursor, page_size)
+                    for item in result[kind + "s"]:
+                        yield json.dumps({kind: item}) + "\n"
+                    cursor = result["next_cursor"]
+                    if cursor is None:
+                        break
+        except CursorError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    def neighborhood(self, entity: str, depth: int = 1, relation: str = None, limit: int = 10000) -> dict:
+        """Nodes within ``depth`` hops of ``entity`` in either direction, and the edges among them.
+
+        With ``relation`` only edges with that label are followed and returned. Stops
+        expanding once ``limit`` nodes are collected and flags the result as truncated.
+        """
+        self.refresh()
+        with self.lock:
+            graph = self.graph
+            if entity not in graph:
+                raise EntityNotFoundError(f"Entity not found: {entity}")
+
+            def follows(source, target):
+                return relation is None or graph.adj[source][target].get("relation") == relation
+
+            seen = {entity: 0}
+            queue = deque([entity])
+            truncated = False
+            while queue and not truncated:
+                node = queue.popleft()
+                if seen[node] == depth:
+                    continue
+                neighbours = chain((t for t in graph.succ[node] if follows(node, t)),
+                                   (s for s in graph.pred[node] if follows(s, node)))
+                for neighbour in neighbours:
+                    if neighbour in seen:
+                        continue
+                    if len(seen) >= limit:
+                        truncated = True
+                        break
+                    seen[neighbour] = seen[node] + 1
+                    queue.append(neighbour)
+
+            edges = [self._edge_record(source, target)
+                     for source in seen for target in graph.succ[source]
+                     if target in seen and follows(source, target)]
+            return {"nodes": [{**self._node_record(name), "distance": distance} for name, distance in seen.items()],
+                    "edges": edges, "truncated": truncated}
+
+
+def store_from_env() -> GraphStore:
+    if not GRAPH_DATA_DIR:
+        return GraphStore()
+    return GraphStore(GraphLog(GRAPH_DATA_DIR, fsync=GRAPH_WAL_FSYNC))
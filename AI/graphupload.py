@@ -0,0 +1,85 @@
+"""Row parsing for streamed knowledge-graph uploads (NDJSON or CSV).
+
+Rows become plain tuples for ``GraphStore.bulk_load`` instead of Pydantic models,
+so hundreds of thousands of rows cost little more than their strings. A row is an
+entity when it has ``name`` and ``type`` and a relation when it has ``source``,
+``target`` and ``relation``; CSV uploads use those names as header columns and
+leave the other columns empty, and quoted CSV fields may contain newlines.
+"""
+import csv
+import json
+
+# Rejected rows reported back to the client; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+
+class UploadRows:
+    def __init__(self):
+        self.entities = []
+        self.relations = []
+        self.errors = []
+        self.rows = 0
+        self._csv_header = None
+        self._csv_record = []
+        self._csv_quotes = 0
+
+    def add(self, row: int, fields) -> None:
+        if not isinstance(fields, dict):
+            self.errors.append({"row": row, "error": "Expected an object."})
+            return
+        values = {key: fields.get(key) for key in ("name", "type", "source", "target", "relation")}
+        if values["name"] is not None or values["type"] is not None:
+            if not _non_empty(values["name"], values["type"]):
+                self.errors.append({"row": row, "error": "Entity rows need a non-empty name and type."})
+            else:
+                self.entities.append((row, values["name"], values["type"]))
+        elif not _non_empty(values["source"], values["target"], values["relation"]):
+            self.errors.append({"row": row, "error": "Relation rows need source, target and relation."})
+        else:
+            self.relations.append((row, values["source"], values["target"], values["relation"]))
+
+    def add_line(self, line: str, csv_format: bool) -> None:
+        if csv_format:
+            self._add_csv_line(line)
+            return
+        line = line.rstrip("\r")
+        if not line.strip():
+            return
+        self.rows += 1
+        try:
+            self.add(self.rows, json.loads(line))
+        except ValueError as e:
+            self.errors.append({"row": self.rows, "error": f"Invalid JSON: {e}"})
+
+    def add_lines(self, lines, csv_format: bool, final: bool = False) -> None:
+        """Add a batch of lines split from the body; ``final`` after the last one."""
+        for line in lines:
+            self.add_line(line, csv_format)
+        if final and self._csv_record:
+            self.rows += 1
+            self.errors.append({"row": self.rows, "error": "Unterminated quoted field."})
+            self._csv_record, self._csv_quotes = [], 0
+
+    def _add_csv_line(self, line: str) -> None:
+        # A quoted field may span lines: the record ends on the line where its quotes balance
+        self._csv_record.append(line + "\n")
+        self._csv_quotes += line.count('"')
+        if self._csv_quotes % 2:
+            return
+        record, self._csv_record, self._csv_quotes = self._csv_record, [], 0
+        if len(record) == 1 and not line.strip():
+            return
+        cells = next(csv.reader(record))
+        if self._csv_header is None:
+            self._csv_header = [column.strip() for column in cells]
+            return
+        self.rows += 1
+        self.add(self.rows, {column: cell for column, cell in zip(self._csv_header, cells) if cell != ""})
+
+
+def _non_empty(*values) -> bool:
+    return all(isinstance(value, str) and value for value in values)
+
+
+def error_report(errors) -> dict:
+    return {"error_count": len(errors), "errors": errors[:MAX_REPORTED_ERRORS]}
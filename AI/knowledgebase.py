@@ -1,14 +1,22 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Optional
-import networkx as nx
-import matplotlib.pyplot as plt
-import io
-from fastapi.responses import StreamingResponse
+import codecs
+from graphquery import QueryTimeoutError
+from graphstore import BulkValidationError, CursorError, EntityNotFoundError
+from graphupload import UploadRows, error_report
+from metrics import REGISTRY, cache_metrics
+from monitoring import instrument
+from resources import graph_queries, graph_renderer, graph_store, lifespan, on_startup
 
-# Initialize FastAPI app and NetworkX graph
-app = FastAPI(title="Compliance Knowledge Graph API")
-knowledge_graph = nx.DiGraph()
+# Largest page the paginated graph endpoints return
+MAX_PAGE_SIZE = 10000
+
+# Knowledge graph routes; the graph store and its query engine and renderer are shared
+# resources, so every router in the process sees the same graph
+router = APIRouter(tags=["knowledge graph"])
 
 # Pydantic models for API requests
 class Entity(BaseModel):
@@ -24,60 +32,166 @@ class GraphData(BaseModel):
     entities: List[Entity]
     relations: List[Relation]
 
+@REGISTRY.collector
+def graph_metrics():
+    if not graph_store.loaded:
+        return []
+    graph = graph_store.get().graph
+    collected = [("graph_nodes", "gauge", "Entities in the knowledge graph", [({}, graph.number_of_nodes())]),
+                 ("graph_edges", "gauge", "Relations in the knowledge graph", [({}, graph.number_of_edges())])]
+    if graph_queries.loaded:
+        collected += cache_metrics({"graph_reachability": graph_queries.get()})
+    return collected
+
+@on_startup(warmup=True)
+def warm_up_graph():
+    """Recover the graph and draw it once, which also pays for the matplotlib import."""
+    graph_queries.get()
+    graph_renderer.get().render()
+
 # API Endpoints
 
-@app.post("/add_entities/")
+@router.post("/add_entities")
 def add_entities(entities: List[Entity]):
     """Add entities to the knowledge graph."""
-    for entity in entities:
-        knowledge_graph.add_node(entity.name, type=entity.type)
+    graph_store.get().add_entities(entities)
     return {"message": f"{len(entities)} entities added successfully."}
 
-@app.post("/add_relations/")
+@router.post("/add_relations")
 def add_relations(relations: List[Relation]):
     """Add relations to the knowledge graph."""
-    for relation in relations:
-        if not knowledge_graph.has_node(relation.source) or not knowledge_graph.has_node(relation.target):
-            raise HTTPException(status_code=404, detail="Source or target entity not found.")
-        knowledge_graph.add_edge(relation.source, relation.target, relation=relation.relation)
+    try:
+        graph_store.get().add_relations(relations)
+    except EntityNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     return {"message": f"{len(relations)} relations added successfully."}
 
-@app.get("/get_graph/")
-def get_graph():
-    """Retrieve the knowledge graph as a dictionary."""
-    nodes = [{"name": node, **data} for node, data in knowledge_graph.nodes(data=True)]
-    edges = [{"source": u, "target": v, "relation": data["relation"]} for u, v, data in knowledge_graph.edges(data=True)]
-    return {"nodes": nodes, "edges": edges}
-
-@app.get("/visualize_graph/")
-def visualize_graph():
-    """Visualize the knowledge graph as an image."""
-    pos = nx.spring_layout(knowledge_graph)
-    plt.figure(figsize=(12, 8))
-    nx.draw_networkx_nodes(knowledge_graph, pos, node_size=1500, node_color="lightblue")
-    nx.draw_networkx_labels(knowledge_graph, pos, font_size=10)
-    nx.draw_networkx_edges(knowledge_graph, pos, arrowstyle="->", arrowsize=20, edge_color="gray")
-    edge_labels = nx.get_edge_attributes(knowledge_graph, "relation")
-    nx.draw_networkx_edge_labels(knowledge_graph, pos, edge_labels=edge_labels, font_size=8)
-    plt.title("Knowledge Graph Visualization")
-    plt.axis("off")
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
-    plt.close()
-    return StreamingResponse(buf, media_type="image/png")
-
-@app.post("/bulk_upload/")
-def bulk_upload(graph_data: GraphData):
-    """Add entities and relations in bulk."""
-    add_entities(graph_data.entities)
-    add_relations(graph_data.relations)
-    return {"message": "Graph data uploaded successfully."}
-
-@app.delete("/clear_graph/")
+@router.get("/get_graph")
+def get_graph(type: Optional[str] = None, relation: Optional[str] = None, format: str = "json"):
+    """Retrieve the knowledge graph, optionally only nodes of ``type`` and edges of ``relation``.
+
+    ``format=ndjson`` streams one ``{"node": ...}`` or ``{"edge": ...}`` line at a time
+    instead of building the whole response in memory.
+    """
+    if format == "ndjson":
+        return StreamingResponse(graph_store.get().iter_ndjson(type, relation), media_type="application/x-ndjson")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'.")
+    return graph_store.get().filtered(type, relation)
+
+@router.get("/get_graph/nodes")
+def get_graph_nodes(type: Optional[str] = None, cursor: Optional[str] = None,
+                    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE)):
+    """One page of nodes; pass the returned ``next_cursor`` to get the next page."""
+    try:
+        return graph_store.get().page_nodes(type, cursor, limit)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/get_graph/edges")
+def get_graph_edges(relation: Optional[str] = None, cursor: Optional[str] = None,
+                    limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE)):
+    """One page of edges; pass the returned ``next_cursor`` to get the next page."""
+    try:
+        return graph_store.get().page_edges(relation, cursor, limit)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/get_graph/neighborhood")
+def get_graph_neighborhood(entity: str, depth: int = Query(1, ge=1, le=5), relation: Optional[str] = None,
+                           limit: int = Query(1000, ge=1, le=MAX_PAGE_SIZE)):
+    """The entities within ``depth`` hops of ``entity`` and the relations among them."""
+    try:
+        return graph_store.get().neighborhood(entity, depth, relation, limit)
+    except EntityNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/query/shortest_path")
+def query_shortest_path(source: str, target: str, relation: Optional[List[str]] = Query(None),
+                        direction: str = "out"):
+    """Fewest-hops path between two entities, following only ``relation`` edges if given."""
+    path = _run_query(graph_queries.get().shortest_path, source, target, relation, direction)
+    return {"path": path, "length": len(path) - 1 if path else None}
+
+@router.get("/query/paths")
+def query_paths(source: str, target: str, max_length: int = Query(3, ge=1, le=6),
+                relation: Optional[List[str]] = Query(None), direction: str = "out",
+                limit: int = Query(100, ge=1, le=1000)):
+    """All simple paths of at most ``max_length`` relations between two entities."""
+    paths, truncated = _run_query(graph_queries.get().all_paths, source, target, max_length, relation, direction, limit)
+    return {"paths": paths, "truncated": truncated}
+
+@router.get("/query/reachable")
+def query_reachable(source: str, type: Optional[str] = None, relation: Optional[List[str]] = Query(None),
+                    direction: str = "out", max_depth: Optional[int] = Query(None, ge=1)):
+    """Entities of ``type`` reachable from ``source`` via ``relation`` edges, nearest first."""
+    entities = _run_query(graph_queries.get().reachable, source, type, relation, direction, max_depth)
+    return {"entities": entities}
+
+@router.get("/query/stats")
+def query_stats():
+    """Index and reachability cache statistics of the query engine."""
+    return graph_queries.get().stats()
+
+def _run_query(query, *args):
+    try:
+        return query(*args)
+    except EntityNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueryTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/visualize_graph")
+def visualize_graph(request: Request):
+    """Visualize the knowledge graph as an image; unchanged graphs answer 304 to a matching ETag."""
+    png, etag = graph_renderer.get().render()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(png, media_type="image/png", headers=headers)
+
+@router.post("/bulk_upload")
+def bulk_upload(graph_data: GraphData, lenient: bool = False):
+    """Add entities and relations in bulk, all or nothing unless ``lenient`` is set."""
+    entities = [(row, entity.name, entity.type) for row, entity in enumerate(graph_data.entities)]
+    relations = [(row, relation.source, relation.target, relation.relation)
+                 for row, relation in enumerate(graph_data.relations)]
+    return _bulk_load(entities, relations, lenient)
+
+@router.post("/bulk_upload/stream")
+async def bulk_upload_stream(request: Request, lenient: bool = False):
+    """Add entities and relations from an NDJSON or CSV body (``Content-Type: text/csv``), one row per line."""
+    rows = UploadRows()
+    csv_format = "csv" in request.headers.get("content-type", "")
+    # utf-8-sig drops a byte order mark, which spreadsheet exports put before the CSV header
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    # Rows are parsed in the threadpool a received chunk at a time, not on the event loop
+    async for chunk in request.stream():
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        await run_in_threadpool(rows.add_lines, lines, csv_format)
+    await run_in_threadpool(rows.add_lines, [pending + decoder.decode(b"", final=True)], csv_format, True)
+    return await run_in_threadpool(_bulk_load, rows.entities, rows.relations, lenient, rows.errors)
+
+def _bulk_load(entities, relations, lenient, errors=None):
+    try:
+        result = graph_store.get().bulk_load(entities, relations, lenient=lenient, errors=errors)
+    except BulkValidationError as e:
+        raise HTTPException(status_code=422, detail={"message": "Upload rejected; nothing was applied.",
+                                                     **error_report(e.errors)})
+    return {"message": f"{result['entities']} entities and {result['relations']} relations uploaded successfully.",
+            "entities": result["entities"], "relations": result["relations"], **error_report(result["errors"])}
+
+@router.delete("/clear_graph")
 def clear_graph():
     """Clear the entire knowledge graph."""
-    knowledge_graph.clear()
+    graph_store.get().clear()
     return {"message": "Knowledge graph cleared successfully."}
 
+# Standalone app serving only the knowledge graph routes
+app = FastAPI(title="Compliance Knowledge Graph API", lifespan=lifespan)
+app.include_router(router)
+instrument(app)
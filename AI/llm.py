@@ -0,0 +1,273 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import json
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+from cache import InMemoryBackend, ResponseCache, cache_from_env, chat_cache_key
+from metrics import span
+from retrieval import KnowledgeRetriever
+
+# Client and cache selection below reads the environment, so pick up .env first
+load_dotenv()
+
+SYSTEM_PROMPT = (
+    "You are EcoExpand AI, a smart chatbot that helps users understand compliance regulations "
+    "and international export incentives. Provide detailed, accurate, and actionable guidance."
+)
+CHAT_MODEL = "gpt-4"
+MAX_TOKENS = 300  # Adjust based on response length requirements
+TEMPERATURE = 0.7  # Controls creativity
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+# Upper bound on concurrent upstream LLM calls per worker; further requests queue
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "16"))
+
+
+class AsyncOpenAIClient:
+    """Async client for the chat completions REST endpoint over one pooled HTTP connection set.
+
+    Point ``base_url`` at a local stub server to exercise /chat without the real API.
+    """
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, timeout: float = 60.0, max_connections: int = 100):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    def _request(self, messages, model, temperature, max_tokens, stream=False):
+        headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+        body = {"model": model, "messages": messages, "max_tokens": max_tokens,
+                "temperature": temperature, "stream": stream}
+        return headers, body
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> str:
+        headers, body = self._request(messages, model, temperature, max_tokens)
+        response = await self.client.post("/chat/completions", json=body, headers=headers)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+    async def astream(self, messages: List[Dict[str, str]], model: str, temperature: float,
+                      max_tokens: int) -> AsyncIterator[str]:
+        """Yield content tokens as the upstream server-sent events arrive."""
+        headers, body = self._request(messages, model, temperature, max_tokens, stream=True)
+        async with self.client.stream("POST", "/chat/completions", json=body, headers=headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                token = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                if token:
+                    yield token
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class FakeChatClient:
+    """Offline stand-in for tests and local runs; records every call it receives."""
+
+    def __init__(self, reply: Optional[str] = None):
+        self.reply = reply
+        self.calls = []
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> str:
+        self.calls.append({"messages": messages, "model": model,
+                           "temperature": temperature, "max_tokens": max_tokens})
+        if self.reply is not None:
+            return self.reply
+        return f"[offline] {messages[-1]['content']}"
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> str:
+        return self.complete(messages, model, temperature, max_tokens)
+
+    async def astream(self, messages: List[Dict[str, str]], model: str, temperature: float,
+                      max_tokens: int) -> AsyncIterator[str]:
+        for i, word in enumerate(self.complete(messages, model, temperature, max_tokens).split(" ")):
+            yield word if i == 0 else " " + word
+
+    async def aclose(self):
+        pass
+
+
+def async_client_from_env():
+    """``LLM_CLIENT=fake`` swaps in ``FakeChatClient`` so /chat works without network."""
+    if os.getenv("LLM_CLIENT", "openai").lower() == "fake":
+        return FakeChatClient()
+    return AsyncOpenAIClient()
+
+
+response_cache: Optional[ResponseCache] = cache_from_env()
+
+
+def build_messages(user_query: str, context: str = None) -> List[Dict[str, str]]:
+    system_prompt = SYSTEM_PROMPT
+    if context:
+        system_prompt += f"\nContext: {context}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_query}
+    ]
+
+
+def _consume_exception(task: asyncio.Task) -> None:
+    # Every caller may have gone before an upstream call failed; don't log it as never retrieved
+    if not task.cancelled():
+        task.exception()
+
+
+class ChatService:
+    """Async /chat backend: cache, coalescing of identical in-flight queries and a limit
+    on concurrent upstream calls, so a slow LLM never ties up the server's threads.
+
+    With a ``retriever`` the caller's context is extended with relevant documents and
+    graph facts before the prompt is built (and before the cache key is computed).
+    """
+
+    def __init__(self, client, cache: Optional[ResponseCache] = None, max_in_flight: int = CHAT_MAX_IN_FLIGHT,
+                 retriever: Optional[KnowledgeRetriever] = None):
+        self.client = client
+        self.cache = cache
+        self.retriever = retriever
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.in_flight = 0
+        self.queued = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    @asynccontextmanager
+    async def _upstream_slot(self):
+        start = time.perf_counter()
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        waited = time.perf_counter() - start
+        self.queue_time_total += waited
+        self.queue_time_max = max(self.queue_time_max, waited)
+        self.in_flight += 1
+        self.upstream_calls += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def _cache_get(self, key: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        if isinstance(self.cache.backend, InMemoryBackend):
+            return self.cache.get(key)
+        return await asyncio.to_thread(self.cache.get, key)
+
+    async def _cache_set(self, key: str, value: str) -> None:
+        if self.cache is None:
+            return
+        if isinstance(self.cache.backend, InMemoryBackend):
+            self.cache.set(key, value)
+        else:
+            await asyncio.to_thread(self.cache.set, key, value)
+
+    async def _augment(self, user_query: str, context: str = None) -> Optional[str]:
+        if self.retriever is None:
+            return context
+        with span("retrieval"):
+            return await asyncio.to_thread(self.retriever.build_context, user_query, context)
+
+    async def generate(self, user_query: str, context: str = None) -> str:
+        context = await self._augment(user_query, context)
+        key = chat_cache_key(user_query, context, CHAT_MODEL, TEMPERATURE, MAX_TOKENS)
+        cached = await self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        # The upstream call is a task of its own, so a caller that disconnects or times out
+        # cancels only its wait and never the answer other callers are waiting for
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._ask(key, user_query, context))
+            task.add_done_callback(_consume_exception)
+            self._pending[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _ask(self, key: str, user_query: str, context: Optional[str]) -> str:
+        try:
+            async with self._upstream_slot():
+                with span("llm_upstream"):
+                    answer = await self.client.acomplete(build_messages(user_query, context),
+                                                         CHAT_MODEL, TEMPERATURE, MAX_TOKENS)
+            await self._cache_set(key, answer)
+            return answer
+        finally:
+            self._pending.pop(key, None)
+
+    async def stream(self, user_query: str, context: str = None) -> AsyncIterator[str]:
+        """Yield the answer token by token; completed answers are cached like ``generate``."""
+        context = await self._augment(user_query, context)
+        key = chat_cache_key(user_query, context, CHAT_MODEL, TEMPERATURE, MAX_TOKENS)
+        cached = await self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        async with self._upstream_slot():
+            with span("llm_upstream"):
+                async for token in self.client.astream(build_messages(user_query, context),
+                                                       CHAT_MODEL, TEMPERATURE, MAX_TOKENS):
+                    parts.append(token)
+                    yield token
+        await self._cache_set(key, "".join(parts))
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "queue_time_avg_seconds": self.queue_time_total / self.upstream_calls if self.upstream_calls else 0.0,
+            "queue_time_max_seconds": self.queue_time_max,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "retrieval": self.retriever.stats() if self.retriever is not None else None,
+        }
+
+    async def aclose(self):
+        for task in list(self._pending.values()):
+            task.cancel()
+        await self.client.aclose()
+
+
+async def sse_events(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Frame tokens as server-sent events, ending with ``[DONE]`` like the OpenAI stream."""
+    try:
+        async for token in tokens:
+            yield f"data: {json.dumps({'token': token})}\n\n"
+    except Exception as e:
+        yield f"data: {json.dumps({'error': f'Error generating response: {str(e)}'})}\n\n"
+    yield "data: [DONE]\n\n"
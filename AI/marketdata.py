@@ -0,0 +1,98 @@
+"""Streaming loader for market indicator datasets.
+
+Historical data has one row per country and month (tens of millions of rows), far
+more than fits in memory as one float64 frame. Rows are read in chunks with
+compact dtypes (float32, categorical ``Country``) and only the columns the models
+use, and each chunk is folded into per-country sums, so memory is bounded by the
+chunk size and the number of countries, not the file size.
+
+The result has one row per country (the mean of each indicator) in order of
+first appearance, plus ``Market_Risk_Score``, which is what ``riskmodel`` trains
+and predicts on. CSV is read with pandas; Parquet and Arrow/Feather files need
+``pyarrow`` and are read with column projection.
+"""
+from typing import Iterator, List, Optional
+import os
+import numpy as np
+import pandas as pd
+
+INDICATOR_COLUMNS = ['Political_Stability', 'Economic_Stability', 'Export_Incentives', 'Duty_Drawback',
+                     'Trade_Agreements', 'Cost_Saving']
+DTYPES = {'Country': 'category', **{column: np.float32 for column in INDICATOR_COLUMNS}}
+# Rows per chunk; bounds peak memory while reading
+MARKET_CHUNK_ROWS = int(os.getenv("MARKET_CHUNK_ROWS", "1000000"))
+
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+ARROW_SUFFIXES = ('.arrow', '.feather', '.ipc')
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        raise ImportError("Reading Parquet or Arrow market data requires pyarrow: pip install pyarrow")
+
+
+def read_chunks(path: str, columns: Optional[List[str]] = None,
+                chunksize: int = MARKET_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the file as frames of at most ``chunksize`` rows with only ``columns``, in compact dtypes."""
+    columns = columns or list(DTYPES)
+    dtypes = {column: DTYPES[column] for column in columns if column in DTYPES}
+    suffix = os.path.splitext(path)[1].lower()
+
+    if suffix in PARQUET_SUFFIXES or suffix in ARROW_SUFFIXES:
+        _import_pyarrow()
+        if suffix in PARQUET_SUFFIXES:
+            import pyarrow.parquet as pq
+            batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
+        else:
+            import pyarrow.feather as feather
+            batches = feather.read_table(path, columns=columns, memory_map=True).to_batches(max_chunksize=chunksize)
+        for batch in batches:
+            yield batch.to_pandas().astype(dtypes)
+        return
+
+    yield from pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunksize)
+
+
+def aggregate_by_country(chunks: Iterator[pd.DataFrame], columns: List[str] = INDICATOR_COLUMNS) -> pd.DataFrame:
+    """Mean of ``columns`` per country over all chunks, countries in order of first appearance.
+
+    Rows with a missing value in any of ``columns`` are skipped, as ``dropna`` did.
+    Running totals across chunks are kept in float64 so long histories do not lose precision.
+    """
+    totals = None
+    order = {}
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=['Country'] + columns)
+        if chunk.empty:
+            continue
+        # Categories differ between chunks, so group on codes and label the groups by name
+        for country in chunk['Country'].unique():
+            order.setdefault(str(country), None)
+        grouped = chunk.groupby('Country', sort=False, observed=True)
+        sums = grouped[columns].sum().astype(np.float64)
+        sums['_rows'] = grouped.size()
+        sums.index = sums.index.astype(str)
+        totals = sums if totals is None else totals.add(sums, fill_value=0)
+
+    if totals is None:
+        return pd.DataFrame({'Country': pd.Series([], dtype=str),
+                             **{column: pd.Series([], dtype=np.float32) for column in columns}})
+    totals = totals.reindex(list(order))
+    means = totals[columns].div(totals['_rows'], axis=0).astype(np.float32)
+    means.index.name = 'Country'
+    return means.reset_index()
+
+
+def market_risk_score(political_stability, economic_stability):
+    """The derived stability score the models use; works on scalars, Series and arrays alike."""
+    return political_stability * 0.4 + economic_stability * 0.6
+
+
+def load_market_frame(path: str, chunksize: int = MARKET_CHUNK_ROWS) -> pd.DataFrame:
+    """Per-country features and ``Market_Risk_Score`` for the models, read in bounded memory."""
+    data = aggregate_by_country(read_chunks(path, ['Country'] + INDICATOR_COLUMNS, chunksize))
+    data['Market_Risk_Score'] = market_risk_score(data['Political_Stability'], data['Economic_Stability'])
+    return data
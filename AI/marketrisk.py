@@ -1,32 +1,19 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, FastAPI, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Literal, Optional, Union
 import pandas as pd
-import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
+from riskmodel import BATCH_STREAM_THRESHOLD, FEATURE_COLUMNS, admin_token_ok, iter_batch_json
+from scenario import (DEFAULT_PERCENTILES, SCENARIO_SYNC_ROWS, Perturbation, ScenarioJobsFull, simulate,
+                      validate_scenario)
+from metrics import REGISTRY
+from monitoring import instrument
+from resources import lifespan, market_model, on_startup, scenario_jobs
 
-# Initialize FastAPI
-app = FastAPI(title="EcoExpand Risk and Incentive Analysis API", version="1.0")
-
-# Load Data
-data = pd.read_csv('market_data.csv')  # Replace with your dataset
-
-# Preprocessing
-data.dropna(inplace=True)
-data['Market_Risk_Score'] = data['Political_Stability'] * 0.4 + data['Economic_Stability'] * 0.6
-
-# Clustering for Market Risk Categorization
-kmeans = KMeans(n_clusters=3, random_state=42)
-data['Risk_Cluster'] = kmeans.fit_predict(data[['Market_Risk_Score']])
-
-# Train Random Forest for Incentive Prediction
-X = data[['Export_Incentives', 'Duty_Drawback', 'Trade_Agreements', 'Market_Risk_Score']]
-y = data['Cost_Saving']
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
-rf_model.fit(X_train, y_train)
+# Risk routes; the model snapshot (data loaded, models trained and every country's result
+# precomputed) is a shared resource loaded on first use, from MARKET_DATA_PATH
+router = APIRouter(tags=["market risk"])
 
 
 # Pydantic Models for Input Validation
@@ -40,42 +27,161 @@ class RiskResponse(BaseModel):
     predicted_cost_savings: str
 
 
-# API Endpoints
-@app.get("/")
-def root():
-    return {"message": "Welcome to the EcoExpand Risk and Incentive Analysis API"}
+class BatchCountryRequest(BaseModel):
+    countries: Union[Literal["all"], List[str]]
+
+
+class BatchRiskResponse(BaseModel):
+    results: List[RiskResponse]
+    missing: List[str]
+
+
+class PerturbationRequest(BaseModel):
+    column: Literal['Political_Stability', 'Economic_Stability', 'Export_Incentives', 'Duty_Drawback',
+                    'Trade_Agreements']
+    mode: Literal["relative", "absolute"] = "relative"
+    delta: float = 0.0
+    distribution: Optional[Literal["normal", "uniform"]] = None
+    std: float = 0.0
+    low: float = 0.0
+    high: float = 0.0
+    countries: Optional[List[str]] = None
+
+
+class ScenarioRequest(BaseModel):
+    perturbations: List[PerturbationRequest]
+    draws: int = 1000
+    percentiles: List[float] = list(DEFAULT_PERCENTILES)
+    countries: Optional[List[str]] = None
+    seed: Optional[int] = None
+    clip: bool = True
+    background: Optional[bool] = None  # Defaults to background for large simulations
 
 
-@app.get("/countries/")
+@REGISTRY.collector
+def market_metrics():
+    if not market_model.loaded:
+        return []
+    stats = market_model.get().stats()
+    return [
+        ("market_model_version", "gauge", "Version of the served model snapshot", [({}, stats["version"])]),
+        ("market_model_reloads_total", "counter", "Model reloads by outcome",
+         [({"outcome": "ok"}, stats["reloads"]), ({"outcome": "failed"}, stats["failed_reloads"])]),
+    ]
+
+
+# Load (or train) the models and run one prediction before traffic arrives
+@on_startup(warmup=True)
+def warm_up_market_model():
+    model = market_model.get().current
+    simulate(model, [Perturbation('Political_Stability')], draws=1, countries=list(model.data['Country'][:1]))
+
+
+# API Endpoints
+@router.get("/countries")
 def list_countries():
-    countries = data['Country'].unique().tolist()
+    countries = market_model.get().current.data['Country'].unique().tolist()
     return {"countries": countries}
 
 
-@app.post("/analyze/", response_model=RiskResponse)
+@router.post("/analyze", response_model=RiskResponse)
 def analyze_country(request: CountryRequest):
     country = request.country
-    country_data = data[data['Country'] == country]
+    result = market_model.get().lookup(country)
 
-    if country_data.empty:
+    if result is None:
         raise HTTPException(status_code=404, detail=f"No data available for {country}")
 
-    # Risk Cluster
-    risk_cluster = int(country_data['Risk_Cluster'].values[0])
-    risk_cluster_label = {0: "Low Risk", 1: "Medium Risk", 2: "High Risk"}[risk_cluster]
+    return RiskResponse(**result.as_response(country))
+
+
+@router.post("/analyze/batch", response_model=BatchRiskResponse)
+def analyze_countries(request: BatchCountryRequest):
+    results, missing = market_model.get().lookup_many(request.countries)
 
-    # Predict Cost Savings
-    cost_saving = rf_model.predict(
-        country_data[['Export_Incentives', 'Duty_Drawback', 'Trade_Agreements', 'Market_Risk_Score']])
+    # Large batches are streamed so the full response is never built in memory
+    if len(results) > BATCH_STREAM_THRESHOLD:
+        return StreamingResponse(iter_batch_json(results, missing), media_type="application/json")
 
-    return RiskResponse(
-        country=country,
-        risk_cluster=f"Cluster {risk_cluster} ({risk_cluster_label})",
-        predicted_cost_savings=f"${cost_saving[0]:,.2f}"
+    return BatchRiskResponse(
+        results=[RiskResponse(**result.as_response(country)) for country, result in results],
+        missing=missing
     )
 
 
-@app.get("/feature-importance/")
+@router.post("/admin/reload")
+async def reload_market_model(retrain: bool = False, wait: bool = False,
+                              x_admin_token: Optional[str] = Header(None)):
+    """Reload market_data.csv and the models; in-flight requests keep the snapshot they started with."""
+    if not admin_token_ok(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+    holder = await market_model.aget()
+    if wait:
+        try:
+            await run_in_threadpool(holder.reload, retrain)
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Reload failed, previous model kept: {e}")
+        return holder.stats()
+    if not holder.reload_in_background(retrain):
+        raise HTTPException(status_code=409, detail="A reload is already running.")
+    return JSONResponse({"message": "Reload started."}, status_code=202)
+
+
+@router.get("/model/metrics")
+def model_metrics():
+    return market_model.get().stats()
+
+
+@router.post("/scenario")
+async def run_scenario(request: ScenarioRequest):
+    """Simulate predicted cost savings under perturbed indicators; large runs become background jobs."""
+    model = (await market_model.aget()).current
+    perturbations = [Perturbation(p.column, p.mode, p.delta, p.distribution, p.std, p.low, p.high, p.countries)
+                     for p in request.perturbations]
+    try:
+        validate_scenario(perturbations, request.draws, request.percentiles)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def run(progress=None):
+        return simulate(model, perturbations, request.draws, request.percentiles, request.countries,
+                        request.seed, request.clip, progress=progress)
+
+    stochastic = any(p.distribution is not None for p in perturbations)
+    rows = (request.draws if stochastic else 1) * len(model.country_index)
+    if request.background or (request.background is None and rows > SCENARIO_SYNC_ROWS):
+        try:
+            job_id = scenario_jobs.get().submit(run)
+        except ScenarioJobsFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        return JSONResponse({"job_id": job_id, "status_url": f"/scenario/jobs/{job_id}"}, status_code=202)
+    try:
+        return await run_in_threadpool(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/scenario/jobs/{job_id}")
+def scenario_job(job_id: str):
+    """Status and progress of a scenario job, with the result once it is done."""
+    job = scenario_jobs.get().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown scenario job.")
+    return job
+
+
+@router.get("/feature-importance")
 def feature_importance():
-    importances = pd.Series(rf_model.feature_importances_, index=X.columns).sort_values(ascending=False)
+    importances = pd.Series(market_model.get().current.rf_model.feature_importances_, index=FEATURE_COLUMNS).sort_values(ascending=False)
     return importances.to_dict()
+
+
+# Standalone app serving only the risk routes
+app = FastAPI(title="EcoExpand Risk and Incentive Analysis API", version="1.0", lifespan=lifespan)
+app.include_router(router)
+instrument(app)
+
+
+@app.get("/")
+def root():
+    return {"message": "Welcome to the EcoExpand Risk and Incentive Analysis API"}
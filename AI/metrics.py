@@ -0,0 +1,298 @@
+"""Request and stage metrics in the Prometheus text exposition format.
+
+``MetricsMiddleware`` records, per route template, a latency histogram, request
+and response body sizes and in-flight requests. Code paths that matter for
+latency wrap their work in ``span("stage")`` (spaCy parse, summary scoring, RF
+predict, upstream LLM call, graph layout, PNG render, ...), which feeds one
+histogram labelled by stage. Values owned by other objects (cache hit ratios,
+pool and upstream queues) are read at scrape time by collectors registered with
+``REGISTRY.collector``. ``GET /metrics`` renders it all.
+
+Spans recorded inside NLP pool worker processes are collected with
+``collect_spans`` and merged into this process's registry by the pool.
+
+The registry is in-process, like the caches: each worker exposes its own numbers
+and the scraper aggregates them.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+import threading
+import time
+
+METRIC_PREFIX = "ecoexpand_"
+# Seconds; spans from a cached lookup (~100us) to a slow LLM call or cold model load
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Bytes
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(label) for label in labels)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}"
+                     for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+# (name without prefix, type, help, [(labels, value)]) read from other objects at scrape time
+CollectedMetric = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect: Callable[[], Iterable[CollectedMetric]]):
+        """Register ``collect``; usable as a decorator. It must not load lazy resources."""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        # Several collectors may report the same metric (e.g. one cache each); emit each family once
+        families: Dict[str, Tuple[str, str, list]] = {}
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                families.setdefault(name, (kind, documentation, []))[2].extend(samples)
+        for name, (kind, documentation, samples) in families.items():
+            name = METRIC_PREFIX + name
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds",
+                                     "Time from request start to the last response byte",
+                                     ["method", "route", "status"])
+REQUEST_BYTES = REGISTRY.histogram("http_request_size_bytes", "Request body size", ["method", "route"],
+                                   SIZE_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram("http_response_size_bytes", "Response body size", ["method", "route"],
+                                    SIZE_BUCKETS)
+IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Requests being handled", ["method"])
+STAGE_SECONDS = REGISTRY.histogram("stage_duration_seconds", "Time spent in one stage of handling a request",
+                                   ["stage"])
+
+_local = threading.local()
+
+
+@contextmanager
+def span(stage: str):
+    """Time the block as ``stage``; inside ``collect_spans`` the timing is kept for the caller."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        collected = getattr(_local, "spans", None)
+        if collected is not None:
+            collected.append((stage, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, stage)
+
+
+def collect_spans(job: Callable, *args) -> Tuple[object, List[Tuple[str, float]]]:
+    """Run ``job`` and return its result with the spans it recorded instead of observing them.
+
+    Used in pool worker processes, whose registry nobody scrapes.
+    """
+    _local.spans = []
+    try:
+        result = job(*args)
+        return result, _local.spans
+    finally:
+        _local.spans = None
+
+
+def observe_spans(spans: Iterable[Tuple[str, float]]) -> None:
+    for stage, elapsed in spans:
+        STAGE_SECONDS.observe(elapsed, stage)
+
+
+def cache_metrics(caches: Dict[str, Optional[object]]) -> List[CollectedMetric]:
+    """Hit/miss counters and hit ratio of ``ResponseCache``-like objects (``stats()`` with hits/misses)."""
+    stats = {name: cache.stats() for name, cache in caches.items() if cache is not None}
+    return [
+        ("cache_hits_total", "counter", "Cache lookups that found an entry",
+         [({"cache": name}, s["hits"]) for name, s in stats.items()]),
+        ("cache_misses_total", "counter", "Cache lookups that missed",
+         [({"cache": name}, s["misses"]) for name, s in stats.items()]),
+        ("cache_hit_ratio", "gauge", "Share of cache lookups that hit since startup",
+         [({"cache": name}, s["hit_ratio"]) for name, s in stats.items()]),
+    ]
+
+
+def _route_template(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request until its last response byte is sent.
+
+    Streaming responses are timed to the end of the stream. Routes are labelled by
+    their template (``/scenario/jobs/{job_id}``), so label cardinality stays bounded.
+    """
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        start = time.perf_counter()
+        status = 500
+        request_bytes = 0
+        response_bytes = 0
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        profiled = self.profiler is not None and self.profiler.begin(scope["path"])
+        IN_FLIGHT.inc(method)
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            IN_FLIGHT.dec(method)
+            if profiled:
+                self.profiler.end()
+            route = _route_template(scope)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method, route, str(status))
+            REQUEST_BYTES.observe(request_bytes, method, route)
+            RESPONSE_BYTES.observe(response_bytes, method, route)
@@ -0,0 +1,65 @@
+"""``/metrics`` and the profiler controls, added to every app by ``instrument``."""
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from metrics import REGISTRY, MetricsMiddleware
+from profiling import PROFILER
+from resources import RESOURCES
+from riskmodel import admin_token_ok
+
+router = APIRouter(tags=["monitoring"])
+
+
+@REGISTRY.collector
+def resource_metrics():
+    return [
+        ("resource_loaded", "gauge", "Whether a shared resource has been loaded",
+         [({"resource": name}, int(res.loaded)) for name, res in RESOURCES.items()]),
+        ("resource_load_seconds", "gauge", "Time the shared resource took to load",
+         [({"resource": name}, res.load_seconds) for name, res in RESOURCES.items() if res.loaded]),
+    ]
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Latency, payload, stage, cache and queue metrics in the Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _require_admin(token: Optional[str]):
+    if not admin_token_ok(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+
+@router.post("/metrics/profile")
+def start_profile(path: str, requests: int = 20, x_admin_token: Optional[str] = Header(None)):
+    """Sample stacks during the next ``requests`` requests to ``path``."""
+    _require_admin(x_admin_token)
+    try:
+        return PROFILER.arm(path, requests)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.delete("/metrics/profile")
+def stop_profile(x_admin_token: Optional[str] = Header(None)):
+    _require_admin(x_admin_token)
+    return PROFILER.disarm()
+
+
+@router.get("/metrics/profile")
+def profile_status():
+    return PROFILER.status()
+
+
+@router.get("/metrics/profile/stacks", response_class=PlainTextResponse)
+def profile_stacks(x_admin_token: Optional[str] = Header(None)):
+    """Collapsed stacks of the last profile, for flamegraph.pl or speedscope."""
+    _require_admin(x_admin_token)
+    return PlainTextResponse(PROFILER.collapsed())
+
+
+def instrument(app):
+    """Time every request of ``app`` and serve ``/metrics`` and the profiler endpoints."""
+    app.add_middleware(MetricsMiddleware, profiler=PROFILER)
+    app.include_router(router)
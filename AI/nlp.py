@@ -1,25 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from collections import deque
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from itertools import islice
 from pydantic import BaseModel
-import spacy
-from nltk.tokenize import sent_tokenize
-from nltk.corpus import stopwords
-from nltk.probability import FreqDist
-from collections import Counter
-import re
-from nltk import download
+from typing import AsyncIterator, List, Literal, Tuple
+import asyncio
+import json
+import time
+from cache import InMemoryBackend, ResponseCache
+from metrics import REGISTRY, cache_metrics
+from nlpdata import configure_nltk, verify
+from textanalysis import OUTPUTS, ThroughputStats, content_key, parse_documents
+from nlppool import NLPPool, analysis_job, batch_job, insights_job, key_phrases_job, summary_job
+from monitoring import instrument
+from resources import lifespan, nlp_pool, on_startup
 
-# FastAPI app initialization
-app = FastAPI(title="Compliance NLP API", version="1.0")
+# NLTK data comes from the local NLP_DATA_DIR (see nlpdata.py); nothing is downloaded here
+configure_nltk()
 
-# Download NLTK resources
-download('punkt')
-download('stopwords')
+# NLP routes; the spaCy model and the worker pool (CPU-bound endpoints run on worker
+# processes with their own copy of the model) are shared resources loaded on first use
+router = APIRouter(tags=["nlp"])
 
-# Load spaCy model
-nlp = spacy.load("en_core_web_sm")
+# Results of /analyze-text keyed by content hash, so resubmitted documents skip parsing
+analysis_cache = ResponseCache(InMemoryBackend(max_entries=256, ttl=24 * 3600))
 
-# Load stopwords
-stop_words = set(stopwords.words("english"))
+# Throughput of /batch/analyze across all batches served by this worker
+batch_stats = ThroughputStats()
 
 
 # Input schema for API
@@ -27,76 +34,183 @@ class TextInput(BaseModel):
     text: str
 
 
-# Preprocessing function
-def preprocess_text(text):
-    text = re.sub(r'\s+', ' ', text)  # Remove extra spaces
-    text = re.sub(r'[^\w\s]', '', text)  # Remove punctuation
-    return text.lower()
-
-
-# Function to extract key phrases
-def extract_key_phrases(text, top_n=10):
-    doc = nlp(text)
-    nouns_verbs = [token.text for token in doc if token.pos_ in ("NOUN", "VERB")]
-    filtered_words = [word for word in nouns_verbs if word not in stop_words]
-    return Counter(filtered_words).most_common(top_n)
+class AnalysisInput(BaseModel):
+    text: str
+    outputs: List[Literal["key_phrases", "summary", "insights"]] = list(OUTPUTS)
 
 
-# Function to summarize text
-def summarize_text(text, num_sentences=3):
-    sentences = sent_tokenize(text)
-    doc = nlp(text)
-    sentence_scores = {}
+@REGISTRY.collector
+def nlp_metrics():
+    collected = cache_metrics({"analysis": analysis_cache})
+    if nlp_pool.loaded:
+        stats = nlp_pool.get().stats()
+        collected += [
+            ("nlp_pool_pending", "gauge", "NLP jobs queued or running", [({}, stats["pending"])]),
+            ("nlp_pool_jobs_total", "counter", "NLP jobs by outcome",
+             [({"outcome": outcome}, stats[outcome]) for outcome in ("completed", "rejected", "timed_out")]),
+        ]
+    return collected
 
-    for sent in sentences:
-        words = preprocess_text(sent).split()
-        for word in words:
-            if word in stop_words:
-                continue
-            for token in doc:
-                if token.text == word:
-                    sentence_scores[sent] = sentence_scores.get(sent, 0) + token.rank
 
-    ranked_sentences = sorted(sentence_scores, key=sentence_scores.get, reverse=True)
-    return " ".join(ranked_sentences[:num_sentences])
+# Report missing NLTK data or spaCy model at startup, without network calls
+@on_startup()
+def check_nlp_data():
+    verify()
 
 
-# Function to extract actionable insights
-def extract_actionable_insights(text):
-    insights = []
-    doc = nlp(text)
-    for ent in doc.ents:
-        if ent.label_ in ("ORG", "GPE", "MONEY", "LAW", "DATE"):
-            insights.append({"text": ent.text, "type": ent.label_})
-    return insights
+# Start the workers and run one document through every output before traffic arrives
+@on_startup(warmup=True)
+def warm_up_nlp():
+    pool = nlp_pool.get()
+    asyncio.run(pool.run(analysis_job, "EcoExpand exports goods from India to Germany under the 2023 agreement.",
+                         list(OUTPUTS)))
 
 
 # API endpoint for extracting key phrases
-@app.post("/extract-key-phrases")
+@router.post("/extract-key-phrases")
 async def get_key_phrases(input: TextInput):
     try:
-        text = preprocess_text(input.text)
-        key_phrases = extract_key_phrases(text)
+        pool = await nlp_pool.aget()
+        key_phrases = await pool.run(key_phrases_job, input.text)
         return {"key_phrases": key_phrases}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # API endpoint for summarizing text
-@app.post("/summarize-text")
+@router.post("/summarize-text")
 async def get_summary(input: TextInput):
     try:
-        summary = summarize_text(input.text)
+        pool = await nlp_pool.aget()
+        summary = await pool.run(summary_job, input.text)
         return {"summary": summary}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # API endpoint for extracting actionable insights
-@app.post("/extract-insights")
+@router.post("/extract-insights")
 async def get_insights(input: TextInput):
     try:
-        insights = extract_actionable_insights(input.text)
+        pool = await nlp_pool.aget()
+        insights = await pool.run(insights_job, input.text)
         return {"insights": insights}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# API endpoint for key phrases, summary and insights from a single parse
+@router.post("/analyze-text")
+async def analyze_text(input: AnalysisInput):
+    outputs = [output for output in OUTPUTS if output in input.outputs]
+    key = content_key(input.text, outputs)
+    try:
+        result = analysis_cache.get(key)
+        if result is None:
+            pool = await nlp_pool.aget()
+            result = await pool.run(analysis_job, input.text, outputs)
+            analysis_cache.set(key, result)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Hit and miss counters of the /analyze-text result cache
+@router.get("/analyze-text/cache")
+def analysis_cache_stats():
+    return analysis_cache.stats()
+
+
+async def _batch_lines(pool: NLPPool, documents: List[Tuple[str, object]], outputs: List[str],
+                       batch_size: int) -> AsyncIterator[str]:
+    """Analyze ``documents`` on the pool in chunks of ``batch_size`` and yield their NDJSON lines in order.
+
+    Up to one chunk per worker is in flight. An error before the first line propagates; after it, the
+    error is reported as a last ``{"error": ...}`` line, since the response status is already sent.
+    """
+    start = time.perf_counter()
+    num_tokens = 0
+    chunks = (documents[i:i + batch_size] for i in range(0, len(documents), batch_size))
+    window = deque(asyncio.ensure_future(pool.run(batch_job, chunk, outputs, batch_size))
+                   for chunk in islice(chunks, max(pool.size, 1)))
+    started = False
+    try:
+        while window:
+            lines, tokens = await window.popleft()
+            window.extend(asyncio.ensure_future(pool.run(batch_job, chunk, outputs, batch_size))
+                          for chunk in islice(chunks, 1))
+            num_tokens += tokens
+            for line in lines:
+                started = True
+                yield line
+    except HTTPException as e:
+        if not started:
+            raise
+        yield json.dumps({"error": e.detail, "status_code": e.status_code}) + "\n"
+        return
+    finally:
+        for future in window:
+            future.cancel()
+
+    throughput = batch_stats.record(len(documents), num_tokens, time.perf_counter() - start)
+    yield json.dumps({"throughput": throughput}) + "\n"
+
+
+# API endpoint for analyzing many documents with nlp.pipe, streamed back as NDJSON
+@router.post("/batch/analyze")
+async def analyze_batch(
+    request: Request,
+    outputs: List[Literal["key_phrases", "summary", "insights"]] = Query(list(OUTPUTS)),
+    batch_size: int = Query(64, ge=1, le=10000),
+):
+    """Body is a JSON list of documents, or NDJSON with ``Content-Type: application/x-ndjson``.
+
+    Chunks of ``batch_size`` documents run on the NLP pool, under the same 429/504 limits as the
+    other NLP endpoints.
+    """
+    ndjson = "ndjson" in request.headers.get("content-type", "")
+    try:
+        documents = parse_documents(await request.body(), ndjson)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    outputs = [output for output in OUTPUTS if output in outputs]
+    pool = await nlp_pool.aget()
+    lines = _batch_lines(pool, documents, outputs, batch_size)
+    # Wait for the first line, so a busy or failing pool still gets its status code
+    first = await lines.__anext__()
+
+    async def stream():
+        yield first
+        async for line in lines:
+            yield line
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# Throughput of the batch endpoint (docs/sec and tokens/sec)
+@router.get("/batch/metrics")
+def batch_metrics():
+    return batch_stats.snapshot()
+
+
+# Worker pool saturation and timeouts
+@router.get("/pool/metrics")
+def pool_metrics():
+    if not nlp_pool.loaded:
+        return {"loaded": False}
+    return nlp_pool.get().stats()
+
+
+# Standalone app serving only the NLP routes
+app = FastAPI(title="Compliance NLP API", version="1.0", lifespan=lifespan)
+app.include_router(router)
+instrument(app)
@@ -0,0 +1,122 @@
+"""NLTK data and the spaCy model from a local, preprovisioned directory.
+
+Workers used to call ``nltk.download`` on import, which hangs or fails on hosts
+without network access. Instead the data is provisioned once into
+``NLP_DATA_DIR`` (on a build machine, or baked into the image):
+
+    python nlpdata.py --provision
+
+and at runtime it is only looked up on the filesystem: NLTK searches
+``NLP_DATA_DIR/nltk_data`` first, and the spaCy model is loaded from
+``NLP_DATA_DIR/<model>`` when present, else from the installed package.
+``python nlpdata.py --check`` (and the NLP router at startup) reports anything
+missing without touching the network.
+"""
+from importlib.util import find_spec
+from typing import List
+import argparse
+import logging
+import os
+import sys
+
+NLP_DATA_DIR = os.getenv("NLP_DATA_DIR", "nlp_data")
+NLP_MODEL = os.getenv("NLP_MODEL", "en_core_web_sm")
+# Pipeline components no endpoint uses; excluded components are never loaded
+NLP_EXCLUDE_PIPES = [name for name in os.getenv("NLP_EXCLUDE_PIPES", "lemmatizer").split(",") if name]
+# Fail startup instead of warning when resources are missing
+NLP_REQUIRE_DATA = os.getenv("NLP_REQUIRE_DATA", "0") != "0"
+
+# Package id -> path NLTK looks up (punkt_tab is what sent_tokenize reads since NLTK 3.8.2)
+NLTK_RESOURCES = {"punkt_tab": "tokenizers/punkt_tab/english", "stopwords": "corpora/stopwords"}
+
+logger = logging.getLogger(__name__)
+
+
+def nltk_data_dir(data_dir: str = NLP_DATA_DIR) -> str:
+    return os.path.abspath(os.path.join(data_dir, "nltk_data"))
+
+
+def configure_nltk(data_dir: str = NLP_DATA_DIR) -> None:
+    """Search the local data directory first; cheap, and does not import NLTK."""
+    path = nltk_data_dir(data_dir)
+    # NLTK reads NLTK_DATA when it is first imported; worker processes inherit it
+    entries = os.environ.get("NLTK_DATA", "").split(os.pathsep)
+    if path not in entries:
+        os.environ["NLTK_DATA"] = os.pathsep.join([path] + [entry for entry in entries if entry])
+    if "nltk.data" in sys.modules:
+        search_path = sys.modules["nltk.data"].path
+        if path not in search_path:
+            search_path.insert(0, path)
+
+
+def spacy_model_path(model_name: str = NLP_MODEL, data_dir: str = NLP_DATA_DIR) -> str:
+    local = os.path.join(data_dir, model_name)
+    return local if os.path.isfile(os.path.join(local, "config.cfg")) else model_name
+
+
+def load_spacy(model_name: str = NLP_MODEL):
+    import spacy
+    return spacy.load(spacy_model_path(model_name), exclude=NLP_EXCLUDE_PIPES)
+
+
+def _nltk_resource_found(path: str, data_dir: str) -> bool:
+    local = os.path.join(nltk_data_dir(data_dir), path)
+    package = os.path.join(nltk_data_dir(data_dir), *path.split("/")[:2])
+    if os.path.exists(local) or os.path.exists(package + ".zip"):
+        return True
+    # Elsewhere on NLTK's search path (e.g. ~/nltk_data); only then is NLTK imported
+    configure_nltk(data_dir)
+    import nltk.data
+    try:
+        nltk.data.find(path)
+        return True
+    except LookupError:
+        return False
+
+
+def missing_resources(data_dir: str = NLP_DATA_DIR, model_name: str = NLP_MODEL) -> List[str]:
+    """Names of the resources that cannot be loaded offline; never uses the network."""
+    missing = [name for name, path in NLTK_RESOURCES.items() if not _nltk_resource_found(path, data_dir)]
+    if spacy_model_path(model_name, data_dir) == model_name and find_spec(model_name) is None:
+        missing.append(model_name)
+    return missing
+
+
+def verify(data_dir: str = NLP_DATA_DIR, model_name: str = NLP_MODEL) -> List[str]:
+    missing = missing_resources(data_dir, model_name)
+    if missing:
+        message = (f"NLP resources missing from {os.path.abspath(data_dir)}: {', '.join(missing)}; "
+                   f"run `python nlpdata.py --provision` where the network is available")
+        if NLP_REQUIRE_DATA:
+            raise RuntimeError(message)
+        logger.warning(message)
+    return missing
+
+
+def provision(data_dir: str = NLP_DATA_DIR, model_name: str = NLP_MODEL) -> None:
+    """Download the NLTK data and copy the spaCy model into ``data_dir``; needs network access."""
+    import nltk
+    import spacy
+    for name in NLTK_RESOURCES:
+        nltk.download(name, download_dir=nltk_data_dir(data_dir), quiet=True, raise_on_error=True)
+    if find_spec(model_name) is None:
+        from spacy.cli import download
+        download(model_name)
+    spacy.load(model_name).to_disk(os.path.join(data_dir, model_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Provision or check the local NLP data directory.")
+    parser.add_argument("--data-dir", default=NLP_DATA_DIR)
+    parser.add_argument("--provision", action="store_true", help="Download the resources (needs network)")
+    parser.add_argument("--check", action="store_true", help="Only report missing resources")
+    args = parser.parse_args()
+    if args.provision:
+        provision(args.data_dir)
+    missing = missing_resources(args.data_dir)
+    print("Missing: " + ", ".join(missing) if missing else f"All NLP resources found under {args.data_dir}")
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Warm process pool for the CPU-bound NLP endpoints.
+
+spaCy holds the GIL while parsing, so calling it from an ``async def`` endpoint
+stalls the event loop and serializes every request in the worker. Work is sent to
+a pool of processes that each load the spaCy model once, with a bound on pending
+jobs (429 beyond it) and a per-request timeout (504). If a worker dies the pool
+is replaced and the affected requests get a 503.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+import asyncio
+import multiprocessing
+import os
+import threading
+from metrics import collect_spans, observe_spans, span
+from nlpdata import NLP_MODEL, configure_nltk, load_spacy
+from textanalysis import (analyze_doc, analyze_documents, insights_from_doc, key_phrases_from_doc, pipes_to_disable,
+                          preprocess_text, rank_sentences, score_sentences)
+
+# Worker processes; 0 runs jobs on a thread of this process instead
+NLP_POOL_SIZE = int(os.getenv("NLP_POOL_SIZE", str(os.cpu_count() or 1)))
+# Jobs queued or running before new requests are rejected with 429
+NLP_POOL_MAX_PENDING = int(os.getenv("NLP_POOL_MAX_PENDING", str(4 * max(NLP_POOL_SIZE, 1))))
+NLP_TIMEOUT = float(os.getenv("NLP_TIMEOUT", "30"))
+
+_nlp = None
+
+
+def _init_worker(model_name: str):
+    global _nlp
+    _nlp = load_spacy(model_name)
+
+
+def _get_nlp():
+    if _nlp is None:
+        _init_worker(NLP_MODEL)
+    return _nlp
+
+
+# Jobs run inside pool workers; they are module-level so they pickle by reference
+def _ping():
+    return os.getpid()
+
+
+def key_phrases_job(text, top_n=10):
+    nlp = _get_nlp()
+    with span("spacy_parse"):
+        doc = nlp(preprocess_text(text), disable=pipes_to_disable(nlp, ["key_phrases"]))
+    return key_phrases_from_doc(doc, top_n)
+
+
+def summary_job(text, num_sentences=3):
+    configure_nltk()
+    from nltk.tokenize import sent_tokenize
+    with span("sentence_split"):
+        sentences = sent_tokenize(text)
+    with span("summary_scoring"):
+        return rank_sentences(score_sentences(sentences), num_sentences)
+
+
+def insights_job(text):
+    nlp = _get_nlp()
+    with span("spacy_parse"):
+        doc = nlp(text, disable=pipes_to_disable(nlp, ["insights"]))
+    return insights_from_doc(doc)
+
+
+def analysis_job(text, outputs):
+    nlp = _get_nlp()
+    with span("spacy_parse"):
+        doc = nlp(text, disable=pipes_to_disable(nlp, outputs))
+    return analyze_doc(doc, outputs)
+
+
+def batch_job(documents, outputs, batch_size):
+    nlp = _get_nlp()
+    with span("spacy_parse"):
+        return analyze_documents(nlp, documents, outputs, batch_size)
+
+
+def _workers_unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="NLP workers are restarting, retry shortly.",
+                         headers={"Retry-After": "1"})
+
+
+class NLPPool:
+    def __init__(self, size: int = NLP_POOL_SIZE, max_pending: int = NLP_POOL_MAX_PENDING,
+                 timeout: float = NLP_TIMEOUT, model_name: str = NLP_MODEL, local_nlp=None):
+        self.size = size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.model_name = model_name
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        if size == 0 and local_nlp is not None:
+            global _nlp
+            _nlp = local_nlp
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn, not fork: the server process already runs threads
+        self._executor = ProcessPoolExecutor(max_workers=self.size,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(self.model_name,))
+        return self._executor
+
+    def start(self):
+        """Start the workers and wait until each has loaded the model."""
+        if self.size == 0 or self._executor is not None:
+            return
+        executor = self._create_executor()
+        for future in [executor.submit(_ping) for _ in range(self.size)]:
+            future.result()
+
+    def _discard(self, executor: ProcessPoolExecutor):
+        """Drop a pool whose worker died; the next job starts a new one."""
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    def _submit(self, job, *args):
+        """Return ``(future, executor)``, replacing a broken pool and retrying once."""
+        # Jobs return the stage timings they recorded, since a worker's own metrics are never scraped
+        if self.size == 0:
+            return asyncio.get_running_loop().run_in_executor(None, collect_spans, job, *args), None
+        for _ in range(2):
+            executor = self._executor or self._create_executor()
+            try:
+                return asyncio.wrap_future(executor.submit(collect_spans, job, *args)), executor
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise _workers_unavailable()
+
+    async def run(self, job, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=429, detail="NLP workers are busy, retry shortly.",
+                                    headers={"Retry-After": "1"})
+            self.pending += 1
+
+        try:
+            future, executor = self._submit(job, *args)
+        except BaseException:
+            with self._lock:
+                self.pending -= 1
+            raise
+        # The slot is freed when the job really finishes, not when the caller stops waiting,
+        # so timed-out jobs still count against the pending limit while they run
+        future.add_done_callback(self._release)
+
+        try:
+            result, spans = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            observe_spans(spans)
+            return result
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise HTTPException(status_code=504, detail="NLP processing timed out.")
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise _workers_unavailable()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.size,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "timeout_seconds": self.timeout,
+            }
@@ -0,0 +1,122 @@
+"""Opt-in sampling profiler for the next N requests to one route.
+
+Arm it with ``POST /metrics/profile?path=/analyze&requests=50``. While one of those
+requests is in flight a background thread samples the stack of every thread
+(``sys._current_frames``) every ``PROFILE_SAMPLE_INTERVAL`` seconds, like
+py-spy, so synchronous endpoints running in the threadpool and work on the event
+loop are both seen, at a cost of a few microseconds per sample. Idle threads
+(waiting on a lock, queue or selector) are skipped. ``GET /metrics/profile/stacks``
+returns the samples as collapsed stacks (``frame;frame;frame count``), the input
+format of flamegraph.pl and speedscope.
+
+Samples cover the whole process, so concurrent requests to other routes show up
+too; profile on a canary or at low traffic for clean results.
+"""
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "1000"))
+# Innermost frames in these files mean a thread is waiting, not working
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self.path = None
+        self.remaining = 0
+        self.active = 0
+        self.profiled = 0
+        self.samples = 0
+        self.started_at = None
+        self.stacks = Counter()
+
+    def arm(self, path: str, requests: int) -> dict:
+        """Profile the next ``requests`` requests to ``path``, discarding earlier samples."""
+        if not 1 <= requests <= PROFILE_MAX_REQUESTS:
+            raise ValueError(f"requests must be between 1 and {PROFILE_MAX_REQUESTS}.")
+        with self._lock:
+            self.path = path
+            self.remaining = requests
+            self.profiled = 0
+            self.samples = 0
+            self.started_at = None
+            self.stacks = Counter()
+        return self.status()
+
+    def disarm(self) -> dict:
+        with self._lock:
+            self.remaining = 0
+        return self.status()
+
+    def begin(self, path: str) -> bool:
+        """Called by the middleware for every request; True when this one is profiled."""
+        if self.remaining <= 0 or path != self.path:
+            return False
+        with self._lock:
+            if self.remaining <= 0 or path != self.path:
+                return False
+            self.remaining -= 1
+            self.active += 1
+            if self.started_at is None:
+                self.started_at = time.time()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+                self._thread.start()
+        return True
+
+    def end(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self.profiled += 1
+
+    def _sample(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if self.active <= 0:
+                    self._thread = None
+                    return
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.reverse()
+                with self._lock:
+                    self.stacks[";".join(stack)] += 1
+                    self.samples += 1
+            time.sleep(self.interval)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "remaining": self.remaining,
+                "in_flight": self.active,
+                "profiled_requests": self.profiled,
+                "samples": self.samples,
+                "interval_seconds": self.interval,
+                "started_at": self.started_at,
+            }
+
+    def collapsed(self) -> str:
+        with self._lock:
+            stacks = self.stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+PROFILER = SamplingProfiler()
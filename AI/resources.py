@@ -0,0 +1,191 @@
+"""Process-wide resources shared by the API routers.
+
+The service modules (``nlp``, ``chatbot``, ``marketrisk``, ``knowledgebase``) only
+define routes; the expensive objects behind them (spaCy model and worker pool,
+market model snapshot, knowledge graph, LLM client) live here. Each is created on
+first use, once per process, however many routers use it, so ``main`` composing
+all routers loads one graph store and one model rather than a copy per module,
+and a process that never serves an NLP request never loads spaCy.
+
+``lifespan`` is the FastAPI lifespan handler for every app built from these
+routers: it preloads the resources named in ``PRELOAD_RESOURCES`` (comma
+separated, or ``all``) so the first request does not pay for them, runs the
+routers' startup hooks (their warm-up hooks too with ``WARMUP=1``) before the
+server accepts traffic, and closes the loaded ones in reverse order on shutdown.
+Module imports here stay light: heavy libraries are imported by the factories.
+"""
+from contextlib import asynccontextmanager
+from fastapi.concurrency import run_in_threadpool
+from typing import Callable, Dict, List, Optional, Tuple
+import inspect
+import os
+import threading
+import time
+from graphquery import GraphQueryEngine
+from graphrender import GraphRenderer
+from graphstore import store_from_env
+from llm import ChatService, async_client_from_env, response_cache
+from nlpdata import load_spacy
+from nlppool import NLP_POOL_SIZE, NLPPool
+from retrieval import retriever_from_env
+from riskmodel import MarketModelHolder
+from scenario import ScenarioJobs
+
+MARKET_DATA_PATH = os.getenv("MARKET_DATA_PATH", "market_data.csv")
+PRELOAD_RESOURCES = os.getenv("PRELOAD_RESOURCES", "")
+# Run the routers' warm-up hooks before accepting traffic
+WARMUP = os.getenv("WARMUP", "0") != "0"
+
+
+class Resource:
+    """A value built by ``factory`` on the first ``get()`` and shared afterwards.
+
+    ``close`` is called with the value on shutdown and may be a coroutine function.
+    """
+
+    def __init__(self, name: str, factory: Callable, close: Optional[Callable] = None):
+        self.name = name
+        self.factory = factory
+        self.closer = close
+        self.loaded = False
+        self.load_seconds = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.loaded:
+            return self._value
+        with self._lock:
+            if not self.loaded:
+                start = time.perf_counter()
+                self._value = self.factory()
+                self.load_seconds = round(time.perf_counter() - start, 4)
+                self.loaded = True
+        return self._value
+
+    async def aget(self):
+        """``get()`` for async endpoints: a first load runs in the threadpool, not on the event loop."""
+        if self.loaded:
+            return self._value
+        return await run_in_threadpool(self.get)
+
+    async def close(self):
+        with self._lock:
+            if not self.loaded:
+                return
+            value, self._value, self.loaded = self._value, None, False
+        if self.closer is not None and value is not None:
+            result = self.closer(value)
+            if inspect.isawaitable(result):
+                await result
+
+    def stats(self) -> dict:
+        return {"loaded": self.loaded, "load_seconds": self.load_seconds}
+
+
+RESOURCES: Dict[str, Resource] = {}
+
+
+def resource(close: Optional[Callable] = None):
+    """Register the decorated factory as a ``Resource`` named after it."""
+    def register(factory: Callable) -> Resource:
+        RESOURCES[factory.__name__] = Resource(factory.__name__, factory, close)
+        return RESOURCES[factory.__name__]
+    return register
+
+
+@resource()
+def spacy_nlp():
+    return load_spacy()
+
+
+@resource(close=lambda pool: pool.shutdown())
+def nlp_pool():
+    # Without worker processes jobs run here, on the model this process already shares
+    pool = NLPPool(local_nlp=spacy_nlp.get() if NLP_POOL_SIZE == 0 else None)
+    pool.start()
+    return pool
+
+
+@resource()
+def graph_store():
+    return store_from_env()
+
+
+@resource()
+def graph_renderer():
+    return GraphRenderer(graph_store.get())
+
+
+@resource()
+def graph_queries():
+    return GraphQueryEngine(graph_store.get())
+
+
+@resource(close=lambda holder: holder.stop_watching())
+def market_model():
+    holder = MarketModelHolder(MARKET_DATA_PATH)
+    holder.start_watching()
+    return holder
+
+
+@resource(close=lambda jobs: jobs.shutdown())
+def scenario_jobs():
+    return ScenarioJobs()
+
+
+@resource(close=lambda retriever: retriever.close())
+def knowledge_retriever():
+    retriever = retriever_from_env()
+    if retriever is not None:
+        retriever.watch(graph_store.get())
+    return retriever
+
+
+@resource(close=lambda service: service.aclose())
+def chat_service():
+    return ChatService(async_client_from_env(), response_cache, retriever=knowledge_retriever.get())
+
+
+def preload_names(names: str = PRELOAD_RESOURCES) -> List[str]:
+    names = [name.strip() for name in names.split(",") if name.strip()]
+    if names == ["all"]:
+        return list(RESOURCES)
+    unknown = [name for name in names if name not in RESOURCES]
+    if unknown:
+        raise ValueError(f"Unknown resources in PRELOAD_RESOURCES: {', '.join(unknown)}")
+    return names
+
+
+def resource_stats() -> dict:
+    return {name: res.stats() for name, res in RESOURCES.items()}
+
+
+STARTUP_HOOKS: List[Tuple[Callable, bool]] = []
+
+
+def on_startup(warmup: bool = False):
+    """Register a function the lifespan handler runs, in the threadpool, before serving.
+
+    Warm-up hooks (``warmup=True``) exercise their resources once, so the first real
+    request does not pay for lazy imports, model loads and first-call overhead; they
+    only run with ``WARMUP=1``.
+    """
+    def register(hook: Callable) -> Callable:
+        STARTUP_HOOKS.append((hook, warmup))
+        return hook
+    return register
+
+
+@asynccontextmanager
+async def lifespan(app):
+    for name in preload_names():
+        await RESOURCES[name].aget()
+    for hook, warmup in STARTUP_HOOKS:
+        if WARMUP or not warmup:
+            await run_in_threadpool(hook)
+    try:
+        yield
+    finally:
+        for res in reversed(list(RESOURCES.values())):
+            await res.close()
@@ -0,0 +1,428 @@
+"""Retrieval of relevant knowledge for /chat prompts.
+
+Regulation documents (split into chunks) and knowledge graph facts are embedded with
+a hashing vectorizer, which needs no model download and no fitting, and kept in
+dense float32 matrices. The top-k snippets for a query are attached to the prompt
+within a token budget, so callers no longer paste large context blobs into every
+request.
+
+Search is exact: one matrix-vector product over the unit-length vectors plus an
+``argpartition``. At the sizes this service handles (tens of thousands of
+snippets) that takes a few milliseconds and needs no approximate index.
+
+Retrieval is opt-in (``RAG_ENABLED=1``): graph facts are held in memory by every
+worker, about 2 KB per entity, and embedded on start.
+
+Graph facts are rebuilt from the ``GraphStore`` through its listener hook: each
+mutation only marks the touched entities dirty, and a background thread re-embeds
+them in batches, holding the store lock only while it reads one batch's facts, so
+graph writes and searches never wait for embedding. Searches see facts as of the
+last finished batch.
+
+Document chunks are persisted under ``RAG_INDEX_DIR`` and memory-mapped on
+startup. The files are rewritten after every ``RAG_SAVE_EVERY`` indexed documents
+and on ``flush`` (at shutdown), not per document. Indexing is single-writer: other processes sharing
+the directory pick up the saved index when its files change, but documents
+indexed by two processes between saves are lost to whichever saves last.
+"""
+from collections import deque
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+import os
+import re
+import threading
+import time
+import numpy as np
+
+RAG_ENABLED = os.getenv("RAG_ENABLED", "0") != "0"
+# Directory for persisted document chunks; empty keeps them in memory only
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "rag_index")
+RAG_DIM = int(os.getenv("RAG_DIM", "512"))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+# Largest top_k a caller may ask for
+RAG_MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "50"))
+# Indexed documents kept in memory only before the index files are rewritten
+RAG_SAVE_EVERY = int(os.getenv("RAG_SAVE_EVERY", "100"))
+# Upper bound on prompt tokens spent on retrieved snippets
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "512"))
+RAG_MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.1"))
+# Relations listed in one entity's fact, counting both directions
+RAG_FACTS_PER_ENTITY = int(os.getenv("RAG_FACTS_PER_ENTITY", "20"))
+# Entities whose facts are read under one hold of the store lock and embedded together
+RAG_FACT_BATCH = int(os.getenv("RAG_FACT_BATCH", "1000"))
+CHUNK_WORDS = 120
+LATENCY_WINDOW = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def _index_stamp(directory: str):
+    try:
+        stat = os.stat(os.path.join(directory, "entries.json"))
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English), without a tokenizer."""
+    return max(1, len(text) // 4)
+
+
+def chunk_text(text: str, max_words: int = CHUNK_WORDS) -> List[str]:
+    """Split text into chunks of whole sentences with at most ``max_words`` words each."""
+    chunks, current, words = [], [], 0
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        length = len(sentence.split())
+        if current and words + length > max_words:
+            chunks.append(" ".join(current))
+            current, words = [], 0
+        if sentence:
+            current.append(sentence)
+            words += length
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class HashingEmbedder:
+    """Unit-length bag of words and bigrams, hashed into ``dim`` buckets."""
+
+    def __init__(self, dim: int = RAG_DIM):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.dim = dim
+        self._vectorizer = HashingVectorizer(n_features=dim, ngram_range=(1, 2), stop_words="english",
+                                             alternate_sign=False, norm="l2", dtype=np.float32)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # Relation labels such as "applies_to" should match the words "applies" and "to"
+        texts = [text.replace("_", " ") for text in texts]
+        return self._vectorizer.transform(texts).toarray()
+
+
+class VectorIndex:
+    """Growable matrix of unit vectors keyed by string, with exact top-k search.
+
+    A key added again replaces its row in place. ``load`` memory-maps a saved
+    matrix; it is copied into memory on the first write.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._size = 0
+        self._keys: List[str] = []
+        self._texts: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, size: int):
+        if size <= len(self._vectors) and self._vectors.flags.writeable:
+            return
+        capacity = max(size, 2 * len(self._vectors), 64)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def upsert(self, keys: List[str], texts: List[str], vectors: np.ndarray):
+        with self._lock:
+            self._reserve(self._size + len(keys))
+            for key, text, vector in zip(keys, texts, vectors):
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._rows[key] = self._size
+                    self._size += 1
+                    self._keys.append(key)
+                    self._texts.append(text)
+                else:
+                    self._texts[row] = text
+                self._vectors[row] = vector
+
+    def delete(self, keys: Iterable[str]):
+        """Remove rows by key; the last row moves into each freed slot."""
+        with self._lock:
+            for key in keys:
+                row = self._rows.pop(key, None)
+                if row is None:
+                    continue
+                self._reserve(self._size)
+                last = self._size - 1
+                if row != last:
+                    self._vectors[row] = self._vectors[last]
+                    self._keys[row], self._texts[row] = self._keys[last], self._texts[last]
+                    self._rows[self._keys[row]] = row
+                self._keys.pop()
+                self._texts.pop()
+                self._size -= 1
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._keys)
+
+    def clear(self):
+        with self._lock:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self._size = 0
+            self._keys, self._texts, self._rows = [], [], {}
+
+    def search(self, query: np.ndarray, top_k: int) -> List[Tuple[float, str, str]]:
+        """``(score, key, text)`` of the ``top_k`` most similar rows, best first."""
+        with self._lock:
+            if self._size == 0:
+                return []
+            scores = self._vectors[:self._size] @ query
+            top_k = min(top_k, self._size)
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[row]), self._keys[row], self._texts[row]) for row in best]
+
+    def save(self, directory: str):
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = os.path.join(directory, "vectors.tmp.npy")
+            np.save(tmp_path, self._vectors[:self._size])
+            entries_tmp = os.path.join(directory, "entries.json.tmp")
+            with open(entries_tmp, "w") as f:
+                json.dump({"dim": self.dim, "keys": self._keys, "texts": self._texts}, f)
+            os.replace(tmp_path, os.path.join(directory, "vectors.npy"))
+            os.replace(entries_tmp, os.path.join(directory, "entries.json"))
+
+    def load(self, directory: str) -> bool:
+        """Load a saved index if there is one with the same dimension; returns whether it did."""
+        try:
+            with open(os.path.join(directory, "entries.json")) as f:
+                entries = json.load(f)
+            vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        except (OSError, ValueError):
+            return False
+        if entries.get("dim") != self.dim or len(vectors) != len(entries["keys"]):
+            return False
+        with self._lock:
+            self._vectors = vectors
+            self._size = len(vectors)
+            self._keys, self._texts = entries["keys"], entries["texts"]
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+        return True
+
+
+class KnowledgeRetriever:
+    """Top-k regulation chunks and graph facts for a query, trimmed to a token budget."""
+
+    def __init__(self, embedder: HashingEmbedder = None, index_dir: Optional[str] = RAG_INDEX_DIR,
+                 top_k: int = RAG_TOP_K, token_budget: int = RAG_TOKEN_BUDGET, min_score: float = RAG_MIN_SCORE,
+                 save_every: int = RAG_SAVE_EVERY):
+        self.embedder = embedder or HashingEmbedder()
+        self.index_dir = index_dir or None
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.min_score = min_score
+        self.save_every = save_every
+        self.documents = VectorIndex(self.embedder.dim)
+        self.facts = VectorIndex(self.embedder.dim)
+        self._chunk_counts: Dict[str, int] = {}
+        self._unsaved = 0
+        self._saved_stamp = None
+        self._documents_lock = threading.Lock()
+        if self.index_dir:
+            self._load_documents()
+        self.store = None
+        self._dirty: Dict[str, None] = {}
+        self._lock = threading.Lock()
+        self._clears = 0  # facts built before a clear must not be stored after it
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.retrievals = 0
+        self.facts_embedded = 0
+        self.fact_sync_seconds = 0.0
+
+    def _load_documents(self):
+        self._saved_stamp = _index_stamp(self.index_dir)
+        self._chunk_counts = {}
+        if self.documents.load(self.index_dir):
+            for key in self.documents.keys():
+                doc_id, chunk = key.rsplit("#", 1)
+                self._chunk_counts[doc_id] = max(self._chunk_counts.get(doc_id, 0), int(chunk) + 1)
+
+    def _reload_if_changed(self):
+        """Pick up an index another process saved, unless this one has unsaved documents."""
+        if self.index_dir and not self._unsaved and _index_stamp(self.index_dir) != self._saved_stamp:
+            with self._documents_lock:
+                if not self._unsaved and _index_stamp(self.index_dir) != self._saved_stamp:
+                    self._load_documents()
+
+    def add_document(self, doc_id: str, text: str) -> int:
+        """Embed a document's chunks, replacing an earlier version with the same id; returns the chunk count."""
+        chunks = chunk_text(text)
+        keys = [f"{doc_id}#{i}" for i in range(len(chunks))]
+        vectors = self.embedder.embed(chunks) if chunks else None
+        self._reload_if_changed()
+        with self._documents_lock:
+            if chunks:
+                self.documents.upsert(keys, chunks, vectors)
+            self.documents.delete(f"{doc_id}#{i}" for i in range(len(chunks), self._chunk_counts.get(doc_id, 0)))
+            self._chunk_counts[doc_id] = len(chunks)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save_locked()
+        return len(chunks)
+
+    def _save_locked(self):
+        if self.index_dir and self._unsaved:
+            self.documents.save(self.index_dir)
+            self._saved_stamp = _index_stamp(self.index_dir)
+        self._unsaved = 0
+
+    def flush(self):
+        """Write documents indexed since the last save to ``index_dir``."""
+        with self._documents_lock:
+            self._save_locked()
+
+    def watch(self, store):
+        """Keep graph facts in step with ``store`` from a background thread."""
+        self.store = store
+        store.subscribe(self._on_graph_record)
+        threading.Thread(target=self._sync_in_background, name="rag-facts", daemon=True).start()
+
+    def close(self):
+        """Stop embedding graph facts and save unsaved documents."""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def _on_graph_record(self, record: dict):
+        # Called under the store lock on every mutation; just note which entities changed
+        with self._lock:
+            if record["op"] == "clear":
+                self._dirty.clear()
+                self.facts.clear()
+                self._clears += 1
+                return
+            for name, _ in record.get("nodes", ()):
+                self._dirty[name] = None
+            for source, target, _ in record.get("edges", ()):
+                self._dirty[source] = None
+                self._dirty[target] = None
+        self._wake.set()
+
+    def _entity_fact(self, graph, name: str) -> str:
+        sentences = [f"{name} is a {graph.nodes[name].get('type') or 'entity'}."]
+        outgoing = ((name, relation, target) for target, relation in
+                    ((t, d.get("relation")) for t, d in graph.succ[name].items()))
+        incoming = ((source, relation, name) for source, relation in
+                    ((s, d.get("relation")) for s, d in graph.pred[name].items()))
+        for count, (source, relation, target) in enumerate(outgoing):
+            if count >= RAG_FACTS_PER_ENTITY // 2:
+                break
+            sentences.append(f"{source} {relation} {target}.")
+        for count, (source, relation, target) in enumerate(incoming):
+            if len(sentences) > RAG_FACTS_PER_ENTITY:
+                break
+            sentences.append(f"{source} {relation} {target}.")
+        return " ".join(sentences)
+
+    def _sync_in_background(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                self.sync_facts()
+            except Exception:
+                logger.exception("Embedding graph facts failed")
+
+    def sync_facts(self):
+        """Re-embed the facts of every entity changed so far, a batch at a time."""
+        with self._sync_lock:
+            while not self._closed:
+                with self._lock:
+                    names = list(islice(self._dirty, RAG_FACT_BATCH))
+                    for name in names:
+                        del self._dirty[name]
+                    clears = self._clears
+                if not names:
+                    return
+                start = time.perf_counter()
+                with self.store.lock:
+                    graph = self.store.graph
+                    names = [name for name in names if name in graph]
+                    texts = [self._entity_fact(graph, name) for name in names]
+                vectors = self.embedder.embed(texts) if names else None
+                with self._lock:
+                    # Entities changed since were marked dirty again and come round in a later batch
+                    if names and clears == self._clears:
+                        self.facts.upsert([f"entity:{name}" for name in names], texts, vectors)
+                    self.facts_embedded += len(names)
+                    self.fact_sync_seconds += time.perf_counter() - start
+
+    def retrieve(self, query: str, top_k: int = None, token_budget: int = None) -> List[dict]:
+        """The most relevant snippets for ``query``, best first, whose total size fits the budget."""
+        top_k = min(top_k or self.top_k, RAG_MAX_TOP_K)
+        token_budget = self.token_budget if token_budget is None else token_budget
+        start = time.perf_counter()
+        self._reload_if_changed()
+        if self.store is not None:
+            self.store.refresh()  # records from other processes reach _on_graph_record here
+        vector = self.embedder.embed([query])[0]
+        candidates = [(score, key, text, "document") for score, key, text in self.documents.search(vector, top_k)]
+        candidates += [(score, key, text, "graph") for score, key, text in self.facts.search(vector, top_k)]
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        snippets, used = [], 0
+        for score, key, text, source in candidates[:top_k]:
+            if score < self.min_score:
+                break
+            tokens = estimate_tokens(text)
+            if used + tokens > token_budget:
+                continue
+            used += tokens
+            snippets.append({"id": key, "source": source, "score": round(score, 4), "text": text})
+
+        with self._lock:
+            self.retrievals += 1
+            self._latencies.append(time.perf_counter() - start)
+        return snippets
+
+    def build_context(self, user_query: str, context: str = None) -> Optional[str]:
+        """The caller's context followed by retrieved snippets, or just the caller's context if nothing matched."""
+        snippets = self.retrieve(user_query)
+        if not snippets:
+            return context
+        knowledge = "\n".join(f"- {snippet['text']}" for snippet in snippets)
+        if context:
+            return f"{context}\nRelevant knowledge:\n{knowledge}"
+        return f"Relevant knowledge:\n{knowledge}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            dirty = len(self._dirty)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0.0
+
+        return {
+            "documents_chunks": len(self.documents),
+            "graph_facts": len(self.facts),
+            "pending_entities": dirty,
+            "unsaved_documents": self._unsaved,
+            "retrievals": self.retrievals,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "latency_ms_max": latencies[-1] * 1000 if latencies else 0.0,
+            "facts_embedded": self.facts_embedded,
+            "fact_sync_seconds": round(self.fact_sync_seconds, 6),
+            "top_k": self.top_k,
+            "token_budget": self.token_budget,
+        }
+
+
+def retriever_from_env() -> Optional[KnowledgeRetriever]:
+    return KnowledgeRetriever() if RAG_ENABLED else None
@@ -0,0 +1,505 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from marketdata import load_market_frame
+from metrics import span
+
+# scikit-learn and joblib are imported where models are trained or loaded, so importing
+# this module for its constants and lookups stays cheap
+if TYPE_CHECKING:
+    from sklearn.cluster import KMeans
+    from sklearn.ensemble import RandomForestRegressor
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, workers may train concurrently
+    fcntl = None
+
+FEATURE_COLUMNS = ['Export_Incentives', 'Duty_Drawback', 'Trade_Agreements', 'Market_Risk_Score']
+RISK_LABELS = {0: "Low Risk", 1: "Medium Risk", 2: "High Risk"}
+# Batch responses with more results than this are streamed instead of built in memory
+BATCH_STREAM_THRESHOLD = 100
+
+# Trained models are persisted here so workers load instead of retraining on import
+MODEL_DIR = os.getenv("MARKET_MODEL_DIR", "models")
+MANIFEST_NAME = "manifest.json"
+# Bump when the artifact contents change shape; older artifacts are then retrained
+ARTIFACT_FORMAT = 3
+# Seconds between checks of the dataset and model files for changes; 0 disables watching
+MARKET_WATCH_INTERVAL = float(os.getenv("MARKET_WATCH_INTERVAL", "0"))
+# When set, reload requests must send it in the X-Admin-Token header
+MARKET_ADMIN_TOKEN = os.getenv("MARKET_ADMIN_TOKEN")
+
+
+class CountryRisk(NamedTuple):
+    country: str
+    risk_cluster: int
+    risk_label: str
+    predicted_cost_saving: float
+
+    def as_response(self, country: Optional[str] = None) -> Dict[str, str]:
+        """Fields of a ``RiskResponse``; ``country`` echoes the name the caller asked for."""
+        return {
+            "country": self.country if country is None else country,
+            "risk_cluster": f"Cluster {self.risk_cluster} ({self.risk_label})",
+            "predicted_cost_savings": f"${self.predicted_cost_saving:,.2f}",
+        }
+
+
+class MarketModel(NamedTuple):
+    """Everything a request handler needs, built together and swapped as one object."""
+    data: pd.DataFrame
+    kmeans: "KMeans"
+    rf_model: "RandomForestRegressor"
+    country_index: Mapping[str, CountryRisk]
+    version: int = 0
+    fingerprint: str = ""
+    loaded_at: str = ""
+    load_seconds: float = 0.0
+
+
+class TrainedModels(NamedTuple):
+    """Fitted models plus how they were chosen; what an artifact stores."""
+    kmeans: "KMeans"
+    # cluster_rank[kmeans label] is the risk cluster: 0 for the highest Market_Risk_Score centroid
+    cluster_rank: Tuple[int, ...]
+    rf_model: "RandomForestRegressor"
+    metrics: Mapping[str, object]
+
+
+def normalize_country(name: str) -> str:
+    """Canonical lookup key for a country name (case and whitespace insensitive)."""
+    return " ".join(name.split()).casefold()
+
+
+def load_market_data(path: str) -> pd.DataFrame:
+    """Read the market indicators, one row per country, and derive the risk score."""
+    return load_market_frame(path)
+
+
+def feature_matrix(data: pd.DataFrame) -> np.ndarray:
+    """Model inputs as a contiguous float64 array, the layout sklearn's trees predict on."""
+    return np.ascontiguousarray(data[FEATURE_COLUMNS].to_numpy(dtype=np.float64))
+
+
+def order_clusters(kmeans: "KMeans") -> Tuple[int, ...]:
+    """Rank KMeans labels by centroid so ids mean the same thing after every retrain.
+
+    A higher ``Market_Risk_Score`` means more stable, so the highest centroid
+    becomes cluster 0 (Low Risk) and the lowest cluster 2 (High Risk).
+    """
+    descending = np.argsort(-kmeans.cluster_centers_[:, 0])
+    rank = np.empty(len(descending), dtype=int)
+    rank[descending] = np.arange(len(descending))
+    return tuple(int(r) for r in rank)
+
+
+def assign_risk_clusters(data: pd.DataFrame, kmeans: "KMeans", cluster_rank: Sequence[int]) -> None:
+    labels = kmeans.predict(data[['Market_Risk_Score']].to_numpy(dtype=np.float64))
+    data['Risk_Cluster'] = np.asarray(cluster_rank)[labels]
+
+
+def train_models(data: pd.DataFrame, param_grid: Optional[Mapping[str, Sequence]] = None, cv: int = 5,
+                 n_jobs: int = 1, test_size: float = 0.2) -> TrainedModels:
+    """Fit the risk clustering and the cost-saving regressor; adds ``Risk_Cluster`` to ``data``.
+
+    With ``param_grid`` the regressor's hyperparameters are chosen by cross-validated
+    grid search on the training split, fitting candidates on ``n_jobs`` cores;
+    otherwise a default forest is fit. Either way the chosen model is scored on the
+    held-out ``test_size`` split and the scores land in ``metrics``.
+    """
+    from sklearn.cluster import KMeans
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+    from sklearn.model_selection import GridSearchCV, KFold, train_test_split
+
+    start = time.perf_counter()
+    kmeans = KMeans(n_clusters=len(RISK_LABELS), n_init=10, random_state=42)
+    kmeans.fit(data[['Market_Risk_Score']].to_numpy(dtype=np.float64))
+    cluster_rank = order_clusters(kmeans)
+    assign_risk_clusters(data, kmeans, cluster_rank)
+
+    X = feature_matrix(data)
+    y = data['Cost_Saving'].to_numpy(dtype=np.float64)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
+    metrics: Dict[str, object] = {"rows": len(data), "train_rows": len(X_train), "test_rows": len(X_test)}
+
+    search_start = time.perf_counter()
+    if param_grid:
+        folds = KFold(n_splits=max(2, min(cv, len(X_train))), shuffle=True, random_state=42)
+        # Parallelize across candidates and folds, not inside each forest, to avoid oversubscription
+        search = GridSearchCV(RandomForestRegressor(random_state=42, n_jobs=1), param_grid, cv=folds,
+                              scoring="neg_mean_absolute_error", n_jobs=n_jobs)
+        search.fit(X_train, y_train)
+        rf_model = search.best_estimator_
+        metrics.update(best_params=search.best_params_, cv_mae=-float(search.best_score_),
+                       candidates=len(search.cv_results_["params"]), cv_folds=folds.get_n_splits())
+    else:
+        rf_model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=n_jobs)
+        rf_model.fit(X_train, y_train)
+    metrics["fit_seconds"] = round(time.perf_counter() - search_start, 3)
+
+    if len(X_test):
+        predictions = rf_model.predict(X_test)
+        metrics.update(test_mae=float(mean_absolute_error(y_test, predictions)),
+                       test_rmse=float(np.sqrt(mean_squared_error(y_test, predictions))),
+                       test_r2=float(r2_score(y_test, predictions)) if len(X_test) > 1 else None)
+    metrics["cluster_centroids"] = [float(c) for c in kmeans.cluster_centers_[:, 0]]
+    metrics["training_seconds"] = round(time.perf_counter() - start, 3)
+    return TrainedModels(kmeans, cluster_rank, rf_model, metrics)
+
+
+def build_country_index(data: pd.DataFrame, rf_model: "RandomForestRegressor") -> Mapping[str, CountryRisk]:
+    """Precompute the /analyze answer for every country with a single predict call.
+
+    The first row per country wins, matching the old ``data[data['Country'] == country]``
+    lookup which reported the prediction for the first matching row.
+    """
+    rows = data.drop_duplicates(subset='Country', keep='first')
+    with span("rf_predict"):
+        predictions = rf_model.predict(feature_matrix(rows))
+
+    index: Dict[str, CountryRisk] = {}
+    for country, cluster, prediction in zip(rows['Country'], rows['Risk_Cluster'], predictions):
+        cluster = int(cluster)
+        index[normalize_country(country)] = CountryRisk(
+            country=country,
+            risk_cluster=cluster,
+            risk_label=RISK_LABELS[cluster],
+            predicted_cost_saving=float(prediction),
+        )
+    return MappingProxyType(index)
+
+
+def dataset_fingerprint(path: str) -> str:
+    """SHA-256 of the dataset file; a different fingerprint means the models are stale."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, write) -> None:
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_artifacts(model_dir: str, fingerprint: str, models: TrainedModels) -> dict:
+    """Write the fitted models and a manifest describing them; returns the manifest."""
+    import joblib
+    import sklearn
+    os.makedirs(model_dir, exist_ok=True)
+    artifact = f"market_model-{fingerprint[:12]}.joblib"
+    _write_atomic(os.path.join(model_dir, artifact),
+                  lambda tmp: joblib.dump({"kmeans": models.kmeans, "cluster_rank": list(models.cluster_rank),
+                                           "rf_model": models.rf_model}, tmp))
+
+    manifest = {
+        "format": ARTIFACT_FORMAT,
+        "artifact": artifact,
+        "fingerprint": fingerprint,
+        "feature_columns": FEATURE_COLUMNS,
+        "sklearn_version": sklearn.__version__,
+        "trained_at": datetime.now(timezone.utc).isoformat(),
+        "cluster_rank": list(models.cluster_rank),
+        "metrics": dict(models.metrics),
+    }
+
+    def write_manifest(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    previous = _manifest_artifact(model_dir)
+    # The manifest is replaced last, so readers only ever see a complete artifact
+    _write_atomic(os.path.join(model_dir, MANIFEST_NAME), write_manifest)
+    prune_artifacts(model_dir, keep=(artifact, previous))
+    return manifest
+
+
+def _manifest_artifact(model_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(model_dir, MANIFEST_NAME)) as f:
+            return json.load(f).get("artifact")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def prune_artifacts(model_dir: str, keep: Sequence[Optional[str]]) -> None:
+    """Delete model artifacts other than ``keep``.
+
+    The artifact the previous manifest named is kept too, for processes that read
+    that manifest just before it was replaced.
+    """
+    for name in os.listdir(model_dir):
+        if name.startswith("market_model-") and name.endswith(".joblib") and name not in keep:
+            try:
+                os.remove(os.path.join(model_dir, name))
+            except OSError:
+                pass
+
+
+def load_artifacts(model_dir: str, fingerprint: str) -> Optional[TrainedModels]:
+    """Return the ``TrainedModels`` if usable artifacts exist for ``fingerprint``, else ``None``.
+
+    Artifacts are rejected when the dataset, feature columns, artifact format or
+    scikit-learn version differ from what they were trained with.
+    """
+    import joblib
+    import sklearn
+    try:
+        with open(os.path.join(model_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (manifest.get("format") != ARTIFACT_FORMAT
+            or manifest.get("fingerprint") != fingerprint
+            or manifest.get("feature_columns") != FEATURE_COLUMNS
+            or manifest.get("sklearn_version") != sklearn.__version__):
+        return None
+
+    try:
+        # mmap_mode only maps plain numpy arrays such as the KMeans centres; the forest's trees
+        # are unpickled, so each worker still holds its own copy of them
+
+        models = joblib.load(os.path.join(model_dir, manifest["artifact"]), mmap_mode='r')
+    except (OSError, KeyError, ValueError):
+        return None
+    return TrainedModels(models["kmeans"], tuple(models["cluster_rank"]), models["rf_model"],
+                         manifest.get("metrics", {}))
+
+
+@contextmanager
+def _training_lock(model_dir: str):
+    """Serialize training across worker processes so only one of them retrains."""
+    os.makedirs(model_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(model_dir, ".lock"), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_or_train(data: pd.DataFrame, fingerprint: str, model_dir: str = MODEL_DIR, force: bool = False):
+    """Load the persisted models for this dataset, training and saving them only if needed."""
+    models = None if force else load_artifacts(model_dir, fingerprint)
+    if models is None:
+        with _training_lock(model_dir):
+            # Another worker may have finished training while we waited for the lock
+            models = None if force else load_artifacts(model_dir, fingerprint)
+            if models is None:
+                models = train_models(data)
+                save_artifacts(model_dir, fingerprint, models)
+
+    assign_risk_clusters(data, models.kmeans, models.cluster_rank)
+    return models.kmeans, models.rf_model
+
+
+def build_market_model(path: str = 'market_data.csv', model_dir: str = MODEL_DIR, version: int = 0,
+                       retrain: bool = False) -> MarketModel:
+    start = time.perf_counter()
+    fingerprint = dataset_fingerprint(path)
+    data = load_market_data(path)
+    kmeans, rf_model = load_or_train(data, fingerprint, model_dir, force=retrain)
+    return MarketModel(data, kmeans, rf_model, build_country_index(data, rf_model), version, fingerprint,
+                       datetime.now(timezone.utc).isoformat(), time.perf_counter() - start)
+
+
+def admin_token_ok(token: Optional[str]) -> bool:
+    if not MARKET_ADMIN_TOKEN:
+        return True
+    return token is not None and hmac.compare_digest(token, MARKET_ADMIN_TOKEN)
+
+
+def validate_market_model(model: MarketModel) -> None:
+    """Raise ``ValueError`` if ``model`` is not fit to serve requests."""
+    missing = [column for column in FEATURE_COLUMNS + ['Country'] if column not in model.data.columns]
+    if missing:
+        raise ValueError(f"Market data is missing columns: {', '.join(missing)}")
+    if not model.country_index:
+        raise ValueError("Market data has no usable rows.")
+    if getattr(model.rf_model, "n_features_in_", len(FEATURE_COLUMNS)) != len(FEATURE_COLUMNS):
+        raise ValueError("Cost-saving model was trained on different features.")
+    savings = np.fromiter((result.predicted_cost_saving for result in model.country_index.values()), dtype=np.float64)
+    if not np.isfinite(savings).all():
+        raise ValueError("Cost-saving model produced non-finite predictions.")
+    if any(result.risk_cluster not in RISK_LABELS for result in model.country_index.values()):
+        raise ValueError("Risk clustering produced an unknown cluster.")
+
+
+class MarketModelHolder:
+    """Holds the active ``MarketModel``; readers grab ``current`` once per request.
+
+    A reload builds and validates a complete new model off to the side and replaces
+    the reference in a single assignment, so in-flight requests keep the snapshot
+    they started with and never see a new index with an old dataset. A failed
+    reload leaves the previous snapshot serving. Reloads can run on a background
+    thread, triggered through ``reload_in_background`` or by watching the dataset
+    and model files.
+    """
+
+    def __init__(self, path: str = 'market_data.csv', model_dir: str = MODEL_DIR):
+        self.path = path
+        self.model_dir = model_dir
+        self._reload_lock = threading.Lock()
+        self._reload_thread = None
+        self._watch_thread = None
+        self._stop_watching = threading.Event()
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+        self.last_reload_seconds = 0.0
+        self.current = build_market_model(path, model_dir, version=1)
+        validate_market_model(self.current)
+        self._watched = self._watch_state()
+
+    def reload(self, retrain: bool = False) -> MarketModel:
+        """Build, validate and swap in a new snapshot; raises and keeps the old one on failure.
+
+        Waits for a reload that is already running, so call it off the event loop.
+        """
+        with self._reload_lock:
+            return self._reload_locked(retrain)
+
+    def _reload_locked(self, retrain: bool) -> MarketModel:
+        start = time.perf_counter()
+        try:
+            model = build_market_model(self.path, self.model_dir, self.current.version + 1, retrain)
+            validate_market_model(model)
+        except Exception as e:
+            self.failed_reloads += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.last_reload_seconds = time.perf_counter() - start
+        self.current = model
+        self.reloads += 1
+        self.last_error = None
+        # Training writes a new manifest; that must not look like an external change
+        self._watched = self._watch_state()
+        return model
+
+    @property
+    def reloading(self) -> bool:
+        """Whether any reload is running: background, waited-for or triggered by the watcher."""
+        return self._reload_lock.locked()
+
+    def reload_in_background(self, retrain: bool = False) -> bool:
+        """Start a reload on a background thread; returns ``False`` at once if one is already running.
+
+        Never blocks, so it is safe to call from the event loop.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._reload_thread = threading.Thread(target=self._reload_quietly, args=(retrain,),
+                                                   name="market-model-reload", daemon=True)
+            self._reload_thread.start()
+        except BaseException:
+            self._reload_lock.release()
+            raise
+        return True
+
+    def _reload_quietly(self, retrain: bool = False):
+        """Run a reload whose lock the caller already acquired, releasing it when done."""
+        try:
+            self._reload_locked(retrain)
+        except Exception:
+            pass  # recorded in failed_reloads and last_error
+        finally:
+            self._reload_lock.release()
+
+    def _watch_state(self):
+        """Modification stamps of the dataset and the model manifest."""
+        stamps = []
+        for path in (self.path, os.path.join(self.model_dir, MANIFEST_NAME)):
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _watch(self, interval: float):
+        while not self._stop_watching.wait(interval):
+            state = self._watch_state()
+            if state != self._watched and self._reload_lock.acquire(blocking=False):
+                self._watched = state
+                self._reload_quietly()
+
+    def start_watching(self, interval: float = MARKET_WATCH_INTERVAL):
+        """Poll the dataset and model files every ``interval`` seconds and reload when they change."""
+        if interval <= 0 or self._watch_thread is not None:
+            return
+        self._stop_watching.clear()
+        self._watch_thread = threading.Thread(target=self._watch, args=(interval,), name="market-data-watch",
+                                              daemon=True)
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        if self._watch_thread is not None:
+            self._stop_watching.set()
+            self._watch_thread.join()
+            self._watch_thread = None
+
+    def stats(self) -> dict:
+        model = self.current
+        return {
+            "version": model.version,
+            "fingerprint": model.fingerprint,
+            "loaded_at": model.loaded_at,
+            "load_seconds": round(model.load_seconds, 6),
+            "countries": len(model.country_index),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_reload_seconds": round(self.last_reload_seconds, 6),
+            "last_error": self.last_error,
+            "reloading": self.reloading,
+            "watching": self._watch_thread is not None,
+        }
+
+    def lookup(self, country: str):
+        """Return the precomputed ``CountryRisk`` for ``country`` or ``None``."""
+        return self.current.country_index.get(normalize_country(country))
+
+    def lookup_many(self, countries) -> Tuple[List[Tuple[str, CountryRisk]], List[str]]:
+        """Resolve a list of names, or ``"all"``, against one consistent index.
+
+        Returns ``(results, missing)`` where each result pairs the requested name with
+        its ``CountryRisk``.
+        """
+        index = self.current.country_index
+        if countries == "all":
+            return [(result.country, result) for result in index.values()], []
+
+        results, missing = [], []
+        for country in countries:
+            result = index.get(normalize_country(country))
+            if result is None:
+                missing.append(country)
+            else:
+                results.append((country, result))
+        return results, missing
+
+
+def iter_batch_json(results: Sequence[Tuple[str, CountryRisk]], missing: Sequence[str]) -> Iterator[str]:
+    """Encode a batch response incrementally, one country per chunk."""
+    yield '{"results": ['
+    for i, (country, result) in enumerate(results):
+        yield ("," if i else "") + json.dumps(result.as_response(country))
+    yield '], "missing": ' + json.dumps(list(missing)) + '}'
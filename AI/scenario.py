@@ -0,0 +1,229 @@
+"""What-if simulation of predicted cost savings under perturbed market indicators.
+
+A scenario is a list of perturbations of the raw indicator columns, either a fixed
+delta or a distribution sampled per draw and country. All draws for all countries
+are stacked into one feature matrix (``Market_Risk_Score`` recomputed from the
+perturbed stabilities) and sent through the served forest in row batches split
+across a thread pool; tree prediction releases the GIL, so this scales with cores.
+The result is a percentile band of predicted savings per country next to its
+baseline prediction.
+
+Large simulations run as background jobs whose progress can be polled.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from marketdata import market_risk_score
+from metrics import span
+from riskmodel import FEATURE_COLUMNS, MarketModel, normalize_country
+
+SCENARIO_COLUMNS = ('Political_Stability', 'Economic_Stability', 'Export_Incentives', 'Duty_Drawback',
+                    'Trade_Agreements')
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+SCENARIO_MAX_DRAWS = int(os.getenv("SCENARIO_MAX_DRAWS", "100000"))
+# Simulations with more rows (draws x countries) than this run as background jobs
+SCENARIO_SYNC_ROWS = int(os.getenv("SCENARIO_SYNC_ROWS", "200000"))
+# Rows predicted per batch; bounds the memory of the feature matrix
+SCENARIO_BATCH_ROWS = int(os.getenv("SCENARIO_BATCH_ROWS", "100000"))
+SCENARIO_WORKERS = int(os.getenv("SCENARIO_WORKERS", str(os.cpu_count() or 1)))
+SCENARIO_MAX_JOBS = int(os.getenv("SCENARIO_MAX_JOBS", "2"))
+# Jobs queued or running before new ones are rejected
+SCENARIO_MAX_PENDING = int(os.getenv("SCENARIO_MAX_PENDING", str(4 * SCENARIO_MAX_JOBS)))
+# Finished jobs kept for polling
+SCENARIO_KEEP_JOBS = int(os.getenv("SCENARIO_KEEP_JOBS", "100"))
+
+
+class ScenarioJobsFull(RuntimeError):
+    """Too many scenario jobs are queued or running to accept another."""
+
+
+class Perturbation(NamedTuple):
+    """A change to one indicator column.
+
+    ``relative`` multiplies by ``1 + change`` and ``absolute`` adds ``change``, where
+    the change is ``delta``, or a draw from ``normal(delta, std)`` or
+    ``uniform(low, high)`` when ``distribution`` is set. ``countries`` limits it to
+    some countries.
+    """
+    column: str
+    mode: str = "relative"
+    delta: float = 0.0
+    distribution: Optional[str] = None
+    std: float = 0.0
+    low: float = 0.0
+    high: float = 0.0
+    countries: Optional[Sequence[str]] = None
+
+    def validate(self):
+        if self.column not in SCENARIO_COLUMNS:
+            raise ValueError(f"Unknown column {self.column}; expected one of {', '.join(SCENARIO_COLUMNS)}.")
+        if self.mode not in ("relative", "absolute"):
+            raise ValueError("mode must be 'relative' or 'absolute'.")
+        if self.distribution not in (None, "normal", "uniform"):
+            raise ValueError("distribution must be 'normal' or 'uniform'.")
+        if self.std < 0 or self.low > self.high:
+            raise ValueError(f"Invalid distribution parameters for {self.column}.")
+
+    def changes(self, rng: np.random.Generator, draws: int, num_countries: int):
+        if self.distribution == "normal":
+            return rng.normal(self.delta, self.std, size=(draws, num_countries))
+        if self.distribution == "uniform":
+            return rng.uniform(self.low, self.high, size=(draws, num_countries))
+        return self.delta
+
+
+def validate_scenario(perturbations: Sequence[Perturbation], draws: int, percentiles: Sequence[float]):
+    """Raise ``ValueError`` for a scenario that cannot run, before any work is queued."""
+    for perturbation in perturbations:
+        perturbation.validate()
+    if not 1 <= draws <= SCENARIO_MAX_DRAWS:
+        raise ValueError(f"draws must be between 1 and {SCENARIO_MAX_DRAWS}.")
+    if not percentiles or any(not 0 <= q <= 100 for q in percentiles):
+        raise ValueError("percentiles must be between 0 and 100.")
+
+
+def simulate(model: MarketModel, perturbations: Sequence[Perturbation], draws: int = 1000,
+             percentiles: Sequence[float] = DEFAULT_PERCENTILES, countries: Optional[Sequence[str]] = None,
+             seed: Optional[int] = None, clip: bool = True, workers: int = SCENARIO_WORKERS,
+             progress: Callable[[float], None] = None) -> dict:
+    """Run the scenario against one model snapshot and summarize predictions per country.
+
+    With ``clip`` perturbed indicators are kept within [0, 1], the range of the
+    dataset's scores. Scenarios made only of fixed deltas are deterministic and
+    run a single draw.
+    """
+    start = time.perf_counter()
+    validate_scenario(perturbations, draws, percentiles)
+    if all(perturbation.distribution is None for perturbation in perturbations):
+        draws = 1
+
+    rows = model.data.drop_duplicates(subset='Country', keep='first')
+    if countries:
+        wanted = {normalize_country(country) for country in countries}
+        rows = rows[[normalize_country(country) in wanted for country in rows['Country']]]
+        if rows.empty:
+            raise ValueError("None of the requested countries are in the dataset.")
+    names = [str(country) for country in rows['Country']]
+    keys = [normalize_country(name) for name in names]
+    num_countries = len(names)
+
+    # (draws, countries) matrix per indicator, perturbed in place
+    rng = np.random.default_rng(seed)
+    base = {column: rows[column].to_numpy(dtype=np.float64) for column in SCENARIO_COLUMNS}
+    values = {column: np.broadcast_to(base[column], (draws, num_countries)).copy() for column in SCENARIO_COLUMNS}
+    for perturbation in perturbations:
+        mask = np.ones(num_countries, dtype=bool)
+        if perturbation.countries:
+            targets = {normalize_country(country) for country in perturbation.countries}
+            mask = np.array([key in targets for key in keys])
+        change = np.broadcast_to(perturbation.changes(rng, draws, num_countries), (draws, num_countries))
+        column = values[perturbation.column]
+        if perturbation.mode == "relative":
+            column[:, mask] *= 1 + change[:, mask]
+        else:
+            column[:, mask] += change[:, mask]
+    if clip:
+        for column in values.values():
+            np.clip(column, 0.0, 1.0, out=column)
+
+    features = {
+        **values,
+        'Market_Risk_Score': market_risk_score(values['Political_Stability'], values['Economic_Stability']),
+    }
+    predictions = np.empty(draws * num_countries, dtype=np.float64)
+    total_rows = draws * num_countries
+    draws_per_batch = max(1, SCENARIO_BATCH_ROWS // num_countries)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for first in range(0, draws, draws_per_batch):
+            last = min(draws, first + draws_per_batch)
+            X = np.stack([features[column][first:last].ravel() for column in FEATURE_COLUMNS], axis=1)
+            slices = np.array_split(np.arange(len(X)), max(1, min(workers, len(X))))
+            with span("rf_predict"):
+                parts = executor.map(lambda rows: model.rf_model.predict(X[rows]), slices)
+                predictions[first * num_countries:last * num_countries] = np.concatenate(list(parts))
+            if progress is not None:
+                progress(last * num_countries / total_rows)
+    predictions = predictions.reshape(draws, num_countries)
+
+    baseline = model.rf_model.predict(np.stack([rows[column].to_numpy(dtype=np.float64)
+                                                for column in FEATURE_COLUMNS], axis=1))
+    bands = np.percentile(predictions, list(percentiles), axis=0)
+    means = predictions.mean(axis=0)
+    medians = np.median(predictions, axis=0)
+    results = [{
+        "country": name,
+        "baseline": float(baseline[i]),
+        "mean": float(means[i]),
+        "median_change": float(medians[i] - baseline[i]),
+        "bands": {f"p{q:g}": float(bands[j, i]) for j, q in enumerate(percentiles)},
+    } for i, name in enumerate(names)]
+    return {
+        "model_version": model.version,
+        "draws": draws,
+        "rows": total_rows,
+        "seconds": round(time.perf_counter() - start, 4),
+        "percentiles": list(percentiles),
+        "results": results,
+    }
+
+
+class ScenarioJobs:
+    """Runs simulations on a small thread pool and keeps their status for polling."""
+
+    def __init__(self, max_running: int = SCENARIO_MAX_JOBS, keep: int = SCENARIO_KEEP_JOBS,
+                 max_pending: int = SCENARIO_MAX_PENDING):
+        self.keep = keep
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix="scenario")
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[Callable[[float], None]], dict]) -> str:
+        """Queue ``run(progress)``; returns the job id.
+
+        Raises ``ScenarioJobsFull`` when ``max_pending`` jobs are already queued or running.
+        """
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "status": "queued", "progress": 0.0, "error": None, "result": None,
+               "submitted_at": datetime.now(timezone.utc).isoformat(), "seconds": None}
+        with self._lock:
+            if sum(1 for other in self._jobs.values() if other["status"] in ("queued", "running")) >= self.max_pending:
+                raise ScenarioJobsFull("Too many scenario jobs are queued, retry later.")
+            self._jobs[job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, run)
+        return job_id
+
+    def _run(self, job: dict, run):
+        start = time.perf_counter()
+        job["status"] = "running"
+
+        def progress(fraction: float):
+            job["progress"] = round(fraction, 4)
+
+        try:
+            job["result"] = run(progress)
+            job["status"] = "done"
+            job["progress"] = 1.0
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["seconds"] = round(time.perf_counter() - start, 4)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
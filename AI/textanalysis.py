@@ -0,0 +1,193 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+import hashlib
+import json
+import math
+import re
+import threading
+from metrics import span
+from nlpdata import configure_nltk
+
+OUTPUTS = ("key_phrases", "summary", "insights")
+INSIGHT_LABELS = ("ORG", "GPE", "MONEY", "LAW", "DATE")
+
+# spaCy components (en_core_web_sm) each output depends on; the rest can be skipped
+REQUIRED_PIPES = {
+    "key_phrases": {"tok2vec", "tagger", "attribute_ruler"},
+    "summary": {"tok2vec", "parser", "senter", "sentencizer"},
+    "insights": {"tok2vec", "ner"},
+}
+
+_stop_words = None
+
+
+def get_stop_words():
+    global _stop_words
+    if _stop_words is None:
+        configure_nltk()
+        from nltk.corpus import stopwords
+        _stop_words = set(stopwords.words("english"))
+    return _stop_words
+
+
+# Preprocessing function
+def preprocess_text(text):
+    text = re.sub(r'\s+', ' ', text)  # Remove extra spaces
+    text = re.sub(r'[^\w\s]', '', text)  # Remove punctuation
+    return text.lower()
+
+
+def pipes_to_disable(nlp, outputs: Iterable[str]) -> List[str]:
+    """Pipeline components that none of ``outputs`` need."""
+    needed = set()
+    for output in outputs:
+        needed |= REQUIRED_PIPES[output]
+    return [name for name in nlp.pipe_names if name not in needed]
+
+
+def key_phrases_from_doc(doc, top_n=10):
+    stop_words = get_stop_words()
+    words = [token.lower_ for token in doc
+             if token.pos_ in ("NOUN", "VERB") and not token.is_punct and token.lower_ not in stop_words]
+    return Counter(words).most_common(top_n)
+
+
+def score_sentences(sentences: List[str]) -> Dict[str, float]:
+    """Score sentences by the TF-IDF weight of their content words, in one pass over the text.
+
+    Term frequencies over the whole text and sentence frequencies are counted once;
+    each sentence then sums the weights of its words and is normalized by the square
+    root of its length so long sentences are not favoured just for being long.
+    """
+    stop_words = get_stop_words()
+    tokenized = [[word for word in preprocess_text(sent).split() if word not in stop_words]
+                 for sent in sentences]
+
+    term_freq = Counter()
+    sentence_freq = Counter()
+    for words in tokenized:
+        term_freq.update(words)
+        sentence_freq.update(set(words))
+    if not term_freq:
+        return {}
+
+    max_freq = max(term_freq.values())
+    num_sentences = len(sentences)
+    weights = {word: (count / max_freq) * math.log(1 + num_sentences / sentence_freq[word])
+               for word, count in term_freq.items()}
+
+    sentence_scores = {}
+    for sent, words in zip(sentences, tokenized):
+        if words:
+            score = sum(weights[word] for word in words) / math.sqrt(len(words))
+            sentence_scores[sent] = max(score, sentence_scores.get(sent, 0.0))
+    return sentence_scores
+
+
+def rank_sentences(sentence_scores, num_sentences=3):
+    ranked_sentences = sorted(sentence_scores, key=sentence_scores.get, reverse=True)
+    return " ".join(ranked_sentences[:num_sentences])
+
+
+def summary_from_doc(doc, num_sentences=3):
+    """Summarize using the sentence boundaries spaCy's parser already found."""
+    sentences = [sent.text.strip() for sent in doc.sents]
+    with span("summary_scoring"):
+        return rank_sentences(score_sentences(sentences), num_sentences)
+
+
+def insights_from_doc(doc):
+    return [{"text": ent.text, "type": ent.label_} for ent in doc.ents if ent.label_ in INSIGHT_LABELS]
+
+
+def analyze_doc(doc, outputs: Iterable[str]) -> Dict[str, object]:
+    """Derive every requested output from one parsed ``Doc``."""
+    result = {}
+    if "key_phrases" in outputs:
+        result["key_phrases"] = key_phrases_from_doc(doc)
+    if "summary" in outputs:
+        result["summary"] = summary_from_doc(doc)
+    if "insights" in outputs:
+        result["insights"] = insights_from_doc(doc)
+    return result
+
+
+def content_key(text: str, outputs: Iterable[str]) -> str:
+    """Cache key for an analysis: hash of the exact text plus the outputs requested."""
+    digest = hashlib.sha256(text.encode("utf-8"))
+    digest.update(json.dumps(sorted(set(outputs))).encode("utf-8"))
+    return "analysis:" + digest.hexdigest()
+
+
+class ThroughputStats:
+    """Running totals of batch analysis, reported as docs/sec and tokens/sec."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.tokens = 0
+        self.seconds = 0.0
+        self.last_batch = None
+
+    def record(self, documents: int, tokens: int, seconds: float) -> dict:
+        batch = {
+            "documents": documents,
+            "tokens": tokens,
+            "seconds": round(seconds, 6),
+            "docs_per_second": documents / seconds if seconds else 0.0,
+            "tokens_per_second": tokens / seconds if seconds else 0.0,
+        }
+        with self._lock:
+            self.documents += documents
+            self.tokens += tokens
+            self.seconds += seconds
+            self.last_batch = batch
+        return batch
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "documents": self.documents,
+                "tokens": self.tokens,
+                "seconds": round(self.seconds, 6),
+                "docs_per_second": self.documents / self.seconds if self.seconds else 0.0,
+                "tokens_per_second": self.tokens / self.seconds if self.seconds else 0.0,
+                "last_batch": self.last_batch,
+            }
+
+
+def parse_documents(body: bytes, ndjson: bool = False) -> List[Tuple[str, object]]:
+    """Parse a batch body into ``(text, id)`` pairs.
+
+    The body is a JSON list, or one JSON value per line when ``ndjson`` is set. Each
+    document is either a string or an object with ``text`` and an optional ``id``;
+    documents without an id are numbered by position.
+    """
+    if ndjson:
+        items = (json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip())
+    else:
+        items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON list of documents.")
+
+    documents = []
+    for position, item in enumerate(items):
+        if isinstance(item, str):
+            documents.append((item, position))
+        elif isinstance(item, dict) and isinstance(item.get("text"), str):
+            documents.append((item["text"], item.get("id", position)))
+        else:
+            raise ValueError(f"Document {position} must be a string or an object with a 'text' field.")
+    return documents
+
+
+def analyze_documents(nlp, documents: List[Tuple[str, object]], outputs: Iterable[str],
+                      batch_size: int) -> Tuple[List[str], int]:
+    """Run documents through ``nlp.pipe``; return one NDJSON line per document and the number of tokens."""
+    outputs = list(outputs)
+    lines, num_tokens = [], 0
+    for doc, doc_id in nlp.pipe(documents, as_tuples=True, batch_size=batch_size,
+                                disable=pipes_to_disable(nlp, outputs)):
+        num_tokens += len(doc)
+        lines.append(json.dumps({"id": doc_id, "tokens": len(doc), **analyze_doc(doc, outputs)}) + "\n")
+    return lines, num_tokens
@@ -0,0 +1,72 @@
+"""Offline training for the risk models served by marketrisk.py and main.py.
+
+Run this after updating the dataset (e.g. nightly) so API workers start by loading
+the saved artifacts instead of training on import:
+
+    python train.py --data market_data.csv --model-dir models --n-jobs -1
+
+The cost-saving forest's hyperparameters are picked by cross-validated grid search
+run in parallel across cores, the chosen model is scored on a held-out split, and
+the report (also stored in the artifact manifest) is printed. Risk clusters are
+ordered by centroid, so cluster 0 is always the lowest-risk group.
+"""
+import argparse
+import json
+import time
+from riskmodel import (MODEL_DIR, RISK_LABELS, dataset_fingerprint, load_market_data, save_artifacts,
+                       train_models)
+
+PARAM_GRID = {
+    "n_estimators": [100, 300],
+    "max_depth": [None, 8, 16],
+    "min_samples_leaf": [1, 2, 4],
+    "max_features": [1.0, "sqrt"],
+}
+
+
+def print_report(metrics: dict, cluster_rank) -> None:
+    print(f"Rows: {metrics['rows']} ({metrics['train_rows']} train / {metrics['test_rows']} test)")
+    if "best_params" in metrics:
+        print(f"Search: {metrics['candidates']} candidates x {metrics['cv_folds']} folds, "
+              f"best CV MAE {metrics['cv_mae']:,.2f}")
+        print(f"Best params: {json.dumps(metrics['best_params'])}")
+    if "test_mae" in metrics:
+        r2 = metrics["test_r2"]
+        print(f"Test MAE {metrics['test_mae']:,.2f}  RMSE {metrics['test_rmse']:,.2f}  "
+              f"R2 {'n/a' if r2 is None else f'{r2:.3f}'}")
+    centroids = metrics["cluster_centroids"]
+    for label, rank in sorted(enumerate(cluster_rank), key=lambda item: item[1]):
+        print(f"Cluster {rank} ({RISK_LABELS[rank]}): Market_Risk_Score centroid {centroids[label]:.3f}")
+    print(f"Fit {metrics['fit_seconds']:.2f}s, total training {metrics['training_seconds']:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and persist the EcoExpand risk models.")
+    parser.add_argument("--data", default="market_data.csv", help="Market indicators (CSV, Parquet or Arrow)")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Directory for the model artifacts")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Cores for the search (-1: all)")
+    parser.add_argument("--cv", type=int, default=5, help="Cross-validation folds")
+    parser.add_argument("--test-size", type=float, default=0.2, help="Share of rows held out for the report")
+    parser.add_argument("--no-search", action="store_true", help="Fit the default forest without a search")
+    parser.add_argument("--report", help="Also write the metrics as JSON to this path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = load_market_data(args.data)
+    fingerprint = dataset_fingerprint(args.data)
+    load_seconds = time.perf_counter() - start
+    models = train_models(data, None if args.no_search else PARAM_GRID, cv=args.cv, n_jobs=args.n_jobs,
+                          test_size=args.test_size)
+    manifest = save_artifacts(args.model_dir, fingerprint, models)
+
+    print(f"Loaded {args.data} in {load_seconds:.2f}s")
+    print_report(models.metrics, models.cluster_rank)
+    print(f"Wrote {args.model_dir}/{manifest['artifact']} (dataset {fingerprint[:12]}) "
+          f"in {time.perf_counter() - start:.2f}s")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()